@@ -0,0 +1,92 @@
+"""
+Measure expense import throughput (rows/sec): one POST /api/expenses per row
+versus POST /api/expenses/bulk with JSON and CSV bodies.
+
+    python -m benchmarks.bulk_import --rows 1000 5000
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from benchmarks.common import CATEGORIES, reset_db, seed_tenant, server
+
+
+def make_rows(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [{
+        "amount": round(rng.uniform(5, 500), 2),
+        "currency": "USD",
+        "category": rng.choice(CATEGORIES),
+        "description": f"card feed row {index}",
+        "date": (start + timedelta(days=rng.randint(0, 364))).isoformat()
+    } for index in range(count)]
+
+
+def to_csv(rows: list) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+async def timed_rows_per_sec(rows: int, func) -> float:
+    started = time.perf_counter()
+    await func()
+    return round(rows / (time.perf_counter() - started), 1)
+
+
+async def run(sizes):
+    results = []
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for size in sizes:
+            await reset_db()
+            tenant = await seed_tenant(expenses=0, users=1, managers=1)
+            employee = tenant["employees"][0]
+            headers = {"Authorization": f"Bearer {server.create_access_token({'sub': employee.email})}"}
+            rows = make_rows(size)
+
+            async def per_row():
+                for row in rows:
+                    response = await http.post("/api/expenses", json=row, headers=headers)
+                    response.raise_for_status()
+
+            async def bulk_json():
+                for start in range(0, len(rows), server.BULK_IMPORT_MAX_ROWS):
+                    response = await http.post("/api/expenses/bulk", json=rows[start:start + server.BULK_IMPORT_MAX_ROWS],
+                                               headers=headers)
+                    response.raise_for_status()
+
+            async def bulk_csv():
+                for start in range(0, len(rows), server.BULK_IMPORT_MAX_ROWS):
+                    body = to_csv(rows[start:start + server.BULK_IMPORT_MAX_ROWS])
+                    response = await http.post("/api/expenses/bulk", content=body,
+                                               headers={**headers, "content-type": "text/csv"})
+                    response.raise_for_status()
+
+            row = {
+                "rows": size,
+                "per_row_rows_per_sec": await timed_rows_per_sec(size, per_row),
+                "bulk_json_rows_per_sec": await timed_rows_per_sec(size, bulk_json),
+                "bulk_csv_rows_per_sec": await timed_rows_per_sec(size, bulk_csv)
+            }
+            print(json.dumps(row))
+            results.append(row)
+    await server.client.drop_database(server.db.name)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 5000])
+    args = parser.parse_args()
+    asyncio.run(run(args.rows))
@@ -0,0 +1,137 @@
+"""
+Shared helpers for the backend benchmarks.
+
+Benchmarks run against a real mongod (MONGO_URL from backend/.env) in a
+throwaway database named by BENCH_DB_NAME, so they never touch app data.
+Run them from the backend directory, e.g. `python -m benchmarks.dashboard_stats`.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+BENCH_DB_NAME = os.environ.get("BENCH_DB_NAME", "expense_benchmark")
+CATEGORIES = ["meals", "travel", "office", "software", "general"]
+STATUSES = ["pending", "approved", "rejected"]
+CURRENCIES = ["USD", "USD", "USD", "EUR", "GBP"]
+MERCHANTS = ["Uber", "Lyft", "Lufthansa", "Hotel Berlin Mitte", "Hilton Paris", "Starbucks",
+             "Staples", "Amazon", "Atlassian", "Pret A Manger", "Deutsche Bahn", "Marriott London"]
+
+
+def use_benchmark_db():
+    """Point the server module at the benchmark database."""
+    server.db = server.client[BENCH_DB_NAME]
+    return server.db
+
+
+async def reset_db():
+    await server.client.drop_database(BENCH_DB_NAME)
+    use_benchmark_db()
+    await server.run_migrations()
+    await server.ensure_indexes()
+
+
+async def seed_tenant(
+    expenses: int,
+    users: int = 200,
+    managers: int = 10,
+    batch_size: int = 10000,
+    seed: int = 42,
+    password: str = "",
+    rebuild_rollups: bool = True
+) -> Dict[str, Any]:
+    """
+    Seed one company with an admin, `managers` managers and `users` employees
+    spread across them, then `expenses` expenses over the last two years, and
+    build the matching expense_rollups.
+    With `password`, every seeded user can log in with it (hashed once).
+    Returns the seeded admin, managers and employees as User models.
+    """
+    rng = random.Random(seed)
+    company_id = str(uuid.uuid4())
+    hashed_password = server._hash_password(password, server.PASSWORD_BCRYPT_ROUNDS) if password else None
+    await server.db.companies.insert_one({
+        "id": company_id, "name": "Benchmark Co", "currency": "USD", "country": "US",
+        "created_at": datetime.now(timezone.utc)
+    })
+
+    def make_user(role: str, manager=None) -> dict:
+        user_id = str(uuid.uuid4())
+        return {
+            "id": user_id, "email": f"{role}-{user_id[:8]}@bench.example.com", "full_name": f"{role} {user_id[:8]}",
+            "role": role, "company_id": company_id, "manager_id": manager and manager["id"],
+            "ancestor_ids": manager["ancestor_ids"] + [manager["id"]] if manager else [], "is_active": True,
+            "is_manager_approver": False, "password": "", "created_at": datetime.now(timezone.utc),
+            **({"hashed_password": hashed_password} if hashed_password else {})
+        }
+
+    admin = make_user("admin")
+    manager_docs = [make_user("manager", admin) for _ in range(managers)]
+    employee_docs = [make_user("employee", rng.choice(manager_docs)) for _ in range(users)]
+    await server.db.users.insert_many([admin] + manager_docs + employee_docs)
+
+    owners = employee_docs + manager_docs
+    now = datetime.now(timezone.utc)
+    batch = []
+    for _ in range(expenses):
+        owner = rng.choice(owners)
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "employee_id": owner["id"],
+            "company_id": company_id,
+            "manager_id": owner["manager_id"],
+            "ancestor_ids": owner["ancestor_ids"],
+            "amount": round(rng.uniform(5, 2000), 2),
+            "currency": rng.choice(CURRENCIES),
+            "category": rng.choice(CATEGORIES),
+            "description": f"{rng.choice(CATEGORIES)} expense",
+            "merchant": rng.choice(MERCHANTS),
+            "date": now - timedelta(days=rng.randint(0, 730), seconds=rng.randint(0, 86400)),
+            "status": rng.choice(STATUSES),
+            "receipt_url": None,
+            "created_at": now,
+            "approval_history": []
+        })
+        if len(batch) >= batch_size:
+            await server.db.expenses.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await server.db.expenses.insert_many(batch, ordered=False)
+    if rebuild_rollups:
+        await server.rebuild_expense_rollups()
+
+    def as_user(doc: dict) -> server.User:
+        return server.User(**{key: value for key, value in doc.items() if key not in ("password", "hashed_password")})
+
+    return {
+        "company_id": company_id,
+        "admin": as_user(admin),
+        "managers": [as_user(doc) for doc in manager_docs],
+        "employees": [as_user(doc) for doc in employee_docs]
+    }
+
+
+async def measure(func: Callable[[], Awaitable[Any]], iterations: int = 20, warmup: int = 2) -> Dict[str, float]:
+    """Time an async callable; returns latency percentiles in milliseconds."""
+    for _ in range(warmup):
+        await func()
+    samples: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 2),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 2),
+        "mean_ms": round(statistics.mean(samples), 2)
+    }
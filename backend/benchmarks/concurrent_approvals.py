@@ -0,0 +1,93 @@
+"""
+Measure approval latency and contention: several approvers race to decide
+the same pending expenses through POST /api/expenses/{id}/approve.
+
+Every expense must end with exactly one successful decision; the rest of the
+racing requests must come back as 409.
+
+    python -m benchmarks.concurrent_approvals --expenses 200 --approvers 4
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.common import reset_db, seed_tenant, server
+
+
+async def run(expenses: int, approvers: int, background: int):
+    await reset_db()
+    tenant = await seed_tenant(expenses=background, users=50, managers=5)
+    employee = tenant["employees"][0]
+    manager = next(m for m in tenant["managers"] if m.id == employee.manager_id)
+    # The admin plus the owner's manager, repeated to the requested number of approvers
+    deciders = [tenant["admin"], manager] * approvers
+    tokens = [server.create_access_token({"sub": user.email}) for user in deciders[:approvers]]
+
+    expense_ids = []
+    for index in range(expenses):
+        expense = server.Expense(
+            employee_id=employee.id, company_id=employee.company_id, manager_id=employee.manager_id,
+            ancestor_ids=employee.ancestor_ids,
+            amount=10 + index, currency="USD", category="meals", description=f"race {index}",
+            date=datetime.now(timezone.utc)
+        )
+        expense_ids.append(expense.id)
+        await server.db.expenses.insert_one(expense.dict())
+    await server.rebuild_expense_rollups()
+
+    latencies = []
+    statuses = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def decide(expense_id: str, token: str, action: str):
+            started = time.perf_counter()
+            response = await http.post(f"/api/expenses/{expense_id}/approve", json={"action": action},
+                                       headers={"Authorization": f"Bearer {token}"})
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            decide(expense_id, token, "approve" if index % 2 == 0 else "reject")
+            for expense_id in expense_ids
+            for index, token in enumerate(tokens)
+        ])
+        elapsed = time.perf_counter() - started
+
+    decided = await server.db.expenses.aggregate([
+        {"$match": {"id": {"$in": expense_ids}}},
+        {"$project": {"decisions": {"$size": "$approval_history"}}},
+        {"$group": {"_id": "$decisions", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    latencies.sort()
+    report = {
+        "expenses": expenses,
+        "approvers": approvers,
+        "requests": len(latencies),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+        "status_counts": statuses,
+        "decisions_per_expense": {str(row["_id"]): row["count"] for row in decided},
+        "rollup_buckets_drifted": (await server.verify_expense_rollups())["drifted"]
+    }
+    print(json.dumps(report, default=str))
+    await server.client.drop_database(server.db.name)
+
+    if report["decisions_per_expense"] != {"1": expenses}:
+        raise SystemExit("Some expenses were decided more than once")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--expenses", type=int, default=200)
+    parser.add_argument("--approvers", type=int, default=4)
+    parser.add_argument("--background", type=int, default=10000, help="Other expenses seeded into the tenant")
+    args = parser.parse_args()
+    asyncio.run(run(args.expenses, args.approvers, args.background))
@@ -0,0 +1,60 @@
+"""
+Compare the legacy multi-query dashboard stats with the single $facet pipeline.
+
+    python -m benchmarks.dashboard_stats --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import json
+
+from benchmarks.common import measure, reset_db, seed_tenant, server
+
+
+async def legacy_dashboard_stats(current_user: server.User) -> dict:
+    """The pre-$facet implementation: accessible-user list plus one query per status."""
+    if current_user.role == "admin":
+        users = await server.db.users.find({"company_id": current_user.company_id}).to_list(None)
+        user_ids = [user["id"] for user in users]
+    elif current_user.role == "manager":
+        team = await server.db.users.find({
+            "company_id": current_user.company_id, "manager_id": current_user.id
+        }).to_list(None)
+        user_ids = [user["id"] for user in team] + [current_user.id]
+    else:
+        user_ids = [current_user.id]
+
+    query = {"employee_id": {"$in": user_ids}}
+    total = await server.db.expenses.count_documents(query)
+    pending = await server.db.expenses.count_documents({**query, "status": "pending"})
+    approved = await server.db.expenses.count_documents({**query, "status": "approved"})
+    result = await server.db.expenses.aggregate([
+        {"$match": {**query, "status": "approved"}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    return {"total_expenses": total, "pending_expenses": pending, "approved_expenses": approved,
+            "total_amount": result[0]["total"] if result else 0, "total_users": len(user_ids)}
+
+
+async def run(sizes, iterations):
+    results = []
+    for size in sizes:
+        await reset_db()
+        tenant = await seed_tenant(expenses=size)
+        for role, user in (("admin", tenant["admin"]), ("manager", tenant["managers"][0]),
+                           ("employee", tenant["employees"][0])):
+            legacy = await measure(lambda: legacy_dashboard_stats(user), iterations)
+            facet = await measure(lambda: server.compute_dashboard_stats(user), iterations)
+            row = {"expenses": size, "role": role, "legacy": legacy, "facet": facet,
+                   "speedup_p50": round(legacy["p50_ms"] / facet["p50_ms"], 2) if facet["p50_ms"] else None}
+            print(json.dumps(row))
+            results.append(row)
+    await server.client.drop_database(server.db.name)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.iterations))
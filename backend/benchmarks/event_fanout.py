@@ -0,0 +1,81 @@
+"""
+Cost of idle /api/events streams and of fanning an event out to them:
+memory per open stream, and the time from publish until every subscriber
+of the company has the event, for a growing number of subscribers.
+
+Drives server.event_stream directly (no sockets, no mongod needed).
+
+    python -m benchmarks.event_fanout --subscribers 1000 10000 --events 50
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from benchmarks.common import server
+
+
+def make_user(role: str, company_id: str) -> server.User:
+    return server.User(email=f"{uuid.uuid4().hex}@bench.example", full_name="Bench",
+                       role=role, company_id=company_id)
+
+
+async def run(subscriber_counts, events):
+    results = []
+    for count in subscriber_counts:
+        company_id = str(uuid.uuid4())
+        owner = make_user("employee", company_id)
+        # A mix of audiences: admins get everything, other employees nothing
+        users = [make_user("admin" if i % 10 == 0 else "employee", company_id) for i in range(count)]
+        received = [0]
+        done = asyncio.Event()
+        expected = sum(1 for user in users if user.role == "admin")
+
+        async def consume(user):
+            async for message in server.event_stream(user, heartbeat=3600):
+                if message.startswith("event: expense"):
+                    received[0] += 1
+                    if received[0] == expected:
+                        done.set()
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tasks = [asyncio.create_task(consume(user)) for user in users]
+        await asyncio.sleep(0.1)
+        per_stream = (tracemalloc.get_traced_memory()[0] - before) / count
+        tracemalloc.stop()
+
+        latencies = []
+        for _ in range(events):
+            received[0] = 0
+            done.clear()
+            expense = {"id": str(uuid.uuid4()), "company_id": company_id, "employee_id": owner.id,
+                       "status": "pending", "amount": 12.5, "currency": "USD"}
+            started = time.perf_counter()
+            server.event_broker.publish(server.expense_event("expense.created", expense))
+            await done.wait()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        server.event_broker.close()
+        await asyncio.gather(*tasks)
+        latencies.sort()
+        row = {
+            "subscribers": count,
+            "bytes_per_idle_stream": round(per_stream),
+            "fanout_p50_ms": round(statistics.median(latencies), 3),
+            "fanout_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 3)
+        }
+        print(json.dumps(row))
+        results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--events", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.subscribers, args.events))
@@ -0,0 +1,43 @@
+"""
+Latency of GET /api/expenses/search (server.search_expenses) per role on a
+growing tenant: a selective merchant term, a two-word query and a term that
+matches every expense (the worst case for ranking and facets).
+
+    python -m benchmarks.expense_search --sizes 100000 1000000
+"""
+import argparse
+import asyncio
+import json
+
+from benchmarks.common import measure, reset_db, seed_tenant, server
+
+QUERIES = ["uber", "hotel berlin", "expense"]
+
+
+async def run(sizes, iterations):
+    results = []
+    filters = server.ExpenseFilterParams(status=None, category=None, date_from=None, date_to=None)
+    for size in sizes:
+        await reset_db()
+        tenant = await seed_tenant(expenses=size, rebuild_rollups=False)
+        for role, user in (("admin", tenant["admin"]), ("manager", tenant["managers"][0]),
+                           ("employee", tenant["employees"][0])):
+            for query in QUERIES:
+                first = await server.search_expenses(user, query, filters, 1, server.SEARCH_DEFAULT_LIMIT)
+                timing = await measure(
+                    lambda: server.search_expenses(user, query, filters, 1, server.SEARCH_DEFAULT_LIMIT),
+                    iterations
+                )
+                row = {"expenses": size, "role": role, "q": query, "matches": first["total"], **timing}
+                print(json.dumps(row))
+                results.append(row)
+    await server.client.drop_database(server.db.name)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.iterations))
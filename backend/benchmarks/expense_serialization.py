@@ -0,0 +1,95 @@
+"""
+Per-row cost of serializing an expense list page: the previous path
+(Expense(**doc) per row, FastAPI validation against List[Expense],
+jsonable_encoder + stdlib JSON) versus the fast path (projected plain rows
+encoded with orjson). No database needed.
+
+    python -m benchmarks.expense_serialization --rows 100 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from benchmarks.common import CATEGORIES, CURRENCIES, STATUSES, measure, server
+
+# The response field FastAPI builds for response_model=List[Expense]
+EXPENSE_LIST_FIELD = create_response_field(name="Response_get_expenses", type_=List[server.Expense])
+
+
+def make_documents(count: int, seed: int = 3) -> list:
+    """Expense documents as Mongo returns them (naive UTC datetimes, a short approval history)."""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    documents = []
+    for _ in range(count):
+        status = rng.choice(STATUSES)
+        documents.append({
+            "id": str(uuid.uuid4()),
+            "employee_id": str(uuid.uuid4()),
+            "company_id": str(uuid.uuid4()),
+            "manager_id": str(uuid.uuid4()),
+            "amount": round(rng.uniform(5, 2000), 2),
+            "currency": rng.choice(CURRENCIES),
+            "category": rng.choice(CATEGORIES),
+            "description": f"{rng.choice(CATEGORIES)} expense",
+            "date": now - timedelta(days=rng.randint(0, 730)),
+            "status": status,
+            "receipt_url": None,
+            "created_at": now,
+            "approval_history": [] if status == "pending" else [{
+                "approver_id": str(uuid.uuid4()), "approver_name": "Approver", "action": status[:-1],
+                "comment": None, "timestamp": now
+            }]
+        })
+    return documents
+
+
+async def previous_path(documents: list) -> bytes:
+    models = [server.Expense(**document) for document in documents]
+    content = await serialize_response(field=EXPENSE_LIST_FIELD, response_content=models)
+    return JSONResponse(content).body
+
+
+def fast_path(documents: list) -> bytes:
+    return ORJSONResponse(server.expense_rows(documents)).body
+
+
+async def run(sizes):
+    results = []
+    for size in sizes:
+        documents = make_documents(size)
+        if json.loads(await previous_path(documents)) != json.loads(fast_path(documents)):
+            raise SystemExit("Fast path output differs from the previous path")
+
+        async def timed_previous():
+            await previous_path(documents)
+
+        async def timed_fast():
+            fast_path(documents)
+
+        previous = await measure(timed_previous, iterations=30, warmup=3)
+        fast = await measure(timed_fast, iterations=30, warmup=3)
+        row = {
+            "rows": size,
+            "previous_us_per_row": round(previous["p50_ms"] * 1000 / size, 2),
+            "fast_us_per_row": round(fast["p50_ms"] * 1000 / size, 2),
+            "speedup": round(previous["p50_ms"] / fast["p50_ms"], 1)
+        }
+        print(json.dumps(row))
+        results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000])
+    args = parser.parse_args()
+    asyncio.run(run(args.rows))
@@ -0,0 +1,285 @@
+"""
+Load test: drive the real FastAPI app in-process through an ASGI client with
+a weighted mix of user journeys and report req/s and p50/p99 per endpoint.
+
+Journeys: login (bcrypt verify), dashboard (stats + recent expenses), list
+(page through /api/expenses), approvals (pending queue + one decision) and
+receipt (upload to the fake OCR backend). Seeds `--companies` synthetic
+tenants first unless `--reuse` points it at a database seeded earlier.
+
+    python -m benchmarks.load_test --companies 2 --users 200 --expenses 100000 \\
+        --concurrency 50 --duration 30 --output baseline.json
+    python -m benchmarks.load_test --reuse --duration 30 --output current.json \\
+        --compare baseline.json --threshold 0.2
+
+Compare mode exits with status 1 when any endpoint's p50, p99 or error count
+grew, or its req/s dropped, by more than the threshold.
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+from benchmarks.common import reset_db, seed_tenant, server, use_benchmark_db
+
+PASSWORD = "load-test-password"
+MIXES = {
+    "default": {"login": 1, "dashboard": 4, "list": 4, "approvals": 2, "receipt": 1},
+    "read-heavy": {"dashboard": 5, "list": 5},
+    "login-storm": {"login": 1},
+    "approvals": {"approvals": 1},
+    "receipts": {"receipt": 1},
+}
+# Losing an approval race is part of the workload, not an error
+EXPECTED_STATUSES = {"POST /api/expenses/{id}/approve": {409}}
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+def make_receipt_jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((600, 800), 40).convert("RGB").save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.recording = False
+
+    async def call(self, http: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await http.request(method, url, **kwargs)
+        elapsed = (time.perf_counter() - started) * 1000
+        if self.recording:
+            self.samples[endpoint].append(elapsed)
+            if response.status_code >= 400 and response.status_code not in EXPECTED_STATUSES.get(endpoint, ()):
+                self.errors[endpoint] += 1
+        return response
+
+    def report(self, seconds: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            samples.sort()
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": self.errors[endpoint],
+                "rps": round(len(samples) / seconds, 2),
+                "p50_ms": round(percentile(samples, 0.5), 2),
+                "p99_ms": round(percentile(samples, 0.99), 2)
+            }
+        everything = sorted(sample for samples in self.samples.values() for sample in samples)
+        total = {
+            "requests": len(everything),
+            "errors": sum(self.errors.values()),
+            "rps": round(len(everything) / seconds, 2),
+            "p50_ms": round(percentile(everything, 0.5), 2) if everything else None,
+            "p99_ms": round(percentile(everything, 0.99), 2) if everything else None
+        }
+        return {"total": total, "endpoints": endpoints}
+
+
+class Tenant:
+    def __init__(self, admin: server.User, managers: List[server.User], employees: List[server.User]):
+        self.admin = admin
+        self.managers = managers
+        self.employees = employees
+        self.everyone = [admin] + managers + employees
+        self.headers = {
+            user.id: {"Authorization": f"Bearer {server.create_access_token({'sub': user.email})}"}
+            for user in self.everyone
+        }
+
+
+async def seed(companies: int, users: int, managers: int, expenses: int, seed_value: int) -> List[Tenant]:
+    await reset_db()
+    tenants = []
+    for index in range(companies):
+        seeded = await seed_tenant(expenses=expenses, users=users, managers=managers, seed=seed_value + index,
+                                   password=PASSWORD, rebuild_rollups=False)
+        tenants.append(Tenant(seeded["admin"], seeded["managers"], seeded["employees"]))
+    await server.rebuild_expense_rollups()
+    return tenants
+
+
+async def load_tenants() -> List[Tenant]:
+    """Tenants from a database seeded by an earlier run."""
+    use_benchmark_db()
+    by_company: Dict[str, List[server.User]] = defaultdict(list)
+    async for doc in server.db.users.find({"email": {"$regex": "@bench\\.example\\.com$"}}, {"_id": 0}):
+        by_company[doc["company_id"]].append(server.User(**doc))
+    tenants = []
+    for members in by_company.values():
+        admin = next((user for user in members if user.role == "admin"), None)
+        if admin:
+            tenants.append(Tenant(
+                admin,
+                [user for user in members if user.role == "manager"],
+                [user for user in members if user.role == "employee"]
+            ))
+    if not tenants:
+        raise SystemExit("No seeded tenants found; run once without --reuse")
+    return tenants
+
+
+class Journeys:
+    def __init__(self, http: httpx.AsyncClient, recorder: Recorder, receipt_body: bytes, pages: int):
+        self.http = http
+        self.recorder = recorder
+        self.receipt_body = receipt_body
+        self.pages = pages
+
+    async def login(self, rng: random.Random, tenant: Tenant):
+        user = rng.choice(tenant.everyone)
+        await self.recorder.call(self.http, "POST /api/auth/login", "POST", "/api/auth/login",
+                                 json={"email": user.email, "password": PASSWORD})
+
+    async def dashboard(self, rng: random.Random, tenant: Tenant):
+        headers = tenant.headers[rng.choice(tenant.everyone).id]
+        await asyncio.gather(
+            self.recorder.call(self.http, "GET /api/dashboard/stats", "GET", "/api/dashboard/stats", headers=headers),
+            self.recorder.call(self.http, "GET /api/expenses", "GET", "/api/expenses",
+                               headers=headers, params={"limit": 5})
+        )
+
+    async def list(self, rng: random.Random, tenant: Tenant):
+        headers = tenant.headers[rng.choice(tenant.everyone).id]
+        params: Dict[str, Any] = {"limit": 50}
+        for _ in range(rng.randint(1, self.pages)):
+            response = await self.recorder.call(self.http, "GET /api/expenses", "GET", "/api/expenses",
+                                                headers=headers, params=params)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            params["after"] = cursor
+
+    async def approvals(self, rng: random.Random, tenant: Tenant):
+        approver = rng.choice(tenant.managers + [tenant.admin])
+        headers = tenant.headers[approver.id]
+        response = await self.recorder.call(self.http, "GET /api/expenses/pending", "GET", "/api/expenses/pending",
+                                            headers=headers, params={"limit": 20})
+        pending = response.json() if response.status_code == 200 else []
+        if pending:
+            expense = rng.choice(pending)
+            await self.recorder.call(self.http, "POST /api/expenses/{id}/approve", "POST",
+                                     f"/api/expenses/{expense['id']}/approve", headers=headers,
+                                     json={"action": rng.choice(["approve", "reject"]), "comment": "load test"})
+
+    async def receipt(self, rng: random.Random, tenant: Tenant):
+        employee = rng.choice(tenant.employees)
+        # Trailing bytes after the JPEG end marker make every upload a distinct receipt
+        body = self.receipt_body + rng.getrandbits(128).to_bytes(16, "big")
+        await self.recorder.call(self.http, "POST /api/expenses/with-receipt", "POST", "/api/expenses/with-receipt",
+                                 headers=tenant.headers[employee.id],
+                                 files={"receipt": ("receipt.jpg", body, "image/jpeg")},
+                                 data={"description": "load test receipt"})
+
+
+async def run_load(tenants: List[Tenant], mix: Dict[str, int], concurrency: int, duration: float,
+                   warmup: float, pages: int, seed_value: int) -> Dict[str, Any]:
+    server.receipt_store = server.LocalBlobStore(Path(tempfile.mkdtemp(prefix="receipts-load-")))
+    server.ocr_backend = server.FakeOcrBackend()
+    server.ocr_worker_pool.start()
+
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as http:
+        journeys = Journeys(http, recorder, make_receipt_jpeg(), pages)
+        loop = asyncio.get_running_loop()
+        measure_from = loop.time() + warmup
+        deadline = measure_from + duration
+
+        async def virtual_user(index: int):
+            rng = random.Random(seed_value * 1000 + index)
+            while loop.time() < deadline:
+                recorder.recording = loop.time() >= measure_from
+                journey = rng.choices(names, weights)[0]
+                await getattr(journeys, journey)(rng, rng.choice(tenants))
+
+        await asyncio.gather(*(virtual_user(index) for index in range(concurrency)))
+    await server.ocr_worker_pool.stop()
+    return recorder.report(duration)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Regressions of current against baseline, as readable lines."""
+    regressions = []
+    for endpoint, base in baseline["endpoints"].items():
+        now = current["endpoints"].get(endpoint)
+        if now is None:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if base[metric] and now[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{endpoint}: {metric} {base[metric]} -> {now[metric]}")
+        if base["rps"] and now["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{endpoint}: rps {base['rps']} -> {now['rps']}")
+        # Errors grow with the threshold too; a clean baseline still fails on any error
+        if now["errors"] > base["errors"] * (1 + threshold):
+            regressions.append(f"{endpoint}: errors {base['errors']} -> {now['errors']}")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.mix not in MIXES:
+        raise SystemExit(f"Unknown mix {args.mix!r}; choose from {', '.join(MIXES)}")
+    seeding_started = time.perf_counter()
+    if args.reuse:
+        tenants = await load_tenants()
+    else:
+        tenants = await seed(args.companies, args.users, args.managers, args.expenses, args.seed)
+    seed_seconds = time.perf_counter() - seeding_started
+
+    report = await run_load(tenants, MIXES[args.mix], args.concurrency, args.duration,
+                            args.warmup, args.pages, args.seed)
+    report["config"] = {
+        "mix": args.mix, "concurrency": args.concurrency, "duration_seconds": args.duration,
+        "companies": len(tenants), "users": args.users, "managers": args.managers,
+        "expenses_per_company": None if args.reuse else args.expenses,
+        "seed_seconds": round(seed_seconds, 1)
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text()), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--companies", type=int, default=1)
+    parser.add_argument("--users", type=int, default=200, help="employees per company")
+    parser.add_argument("--managers", type=int, default=10, help="managers per company")
+    parser.add_argument("--expenses", type=int, default=10000, help="expenses per company")
+    parser.add_argument("--reuse", action="store_true", help="use the tenants already in BENCH_DB_NAME")
+    parser.add_argument("--mix", default="default", help=f"one of: {', '.join(MIXES)}")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds run before measuring")
+    parser.add_argument("--pages", type=int, default=3, help="max pages per list journey")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression, e.g. 0.2 = 20%%")
+    sys.exit(asyncio.run(main(parser.parse_args())))
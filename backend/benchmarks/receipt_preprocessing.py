@@ -0,0 +1,119 @@
+"""
+Before/after numbers for receipt preprocessing: bytes forwarded to OCR
+(original upload vs downscaled preview) and the time to load a receipt
+in the approvals UI (original vs thumbnail).
+
+Uploads synthetic phone-sized JPEGs through POST /api/expenses/with-receipt
+with the fake OCR backend and waits for the OCR jobs to finish.
+
+    python -m benchmarks.receipt_preprocessing --receipts 10 --megapixels 12
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from PIL import Image
+
+from benchmarks.common import measure, reset_db, seed_tenant, server
+
+
+class RecordingOcrBackend(server.FakeOcrBackend):
+    """Fake OCR that records how many bytes it was handed."""
+
+    def __init__(self):
+        super().__init__()
+        self.bytes_received = []
+
+    async def extract(self, image_path: str, mime_type: str) -> dict:
+        self.bytes_received.append(os.path.getsize(image_path))
+        return await super().extract(image_path, mime_type)
+
+
+def make_phone_jpeg(megapixels: float, seed: int) -> bytes:
+    """Noisy 4:3 JPEG at high quality, roughly the size of a phone photo of a receipt."""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    image = Image.effect_noise((width, height), 40 + seed % 20).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+async def run(receipts: int, megapixels: float):
+    await reset_db()
+    tenant = await seed_tenant(expenses=0, users=1, managers=1)
+    employee = tenant["employees"][0]
+    headers = {"Authorization": f"Bearer {server.create_access_token({'sub': employee.email})}"}
+
+    server.receipt_store = server.LocalBlobStore(Path(tempfile.mkdtemp(prefix="receipts-bench-")))
+    server.ocr_backend = ocr = RecordingOcrBackend()
+    server.ocr_worker_pool.start()
+
+    originals = [make_phone_jpeg(megapixels, seed) for seed in range(receipts)]
+    preprocess_started = time.perf_counter()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        job_ids = []
+        for index, body in enumerate(originals):
+            response = await http.post("/api/expenses/with-receipt", headers=headers,
+                                        files={"receipt": (f"receipt-{index}.jpg", body, "image/jpeg")})
+            response.raise_for_status()
+            job_ids.append(response.json()["job_id"])
+
+        expense_ids = []
+        for job_id in job_ids:
+            while True:
+                job = (await http.get(f"/api/receipt-jobs/{job_id}", headers=headers)).json()
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                await asyncio.sleep(0.05)
+            if job["status"] != "succeeded":
+                raise SystemExit(f"Receipt job failed: {job['error']}")
+            expense_ids.append(job["expense"]["id"])
+        pipeline_seconds = time.perf_counter() - preprocess_started
+
+        async def load(variant: str):
+            for expense_id in expense_ids:
+                response = await http.get(f"/api/expenses/{expense_id}/receipt", params={"variant": variant},
+                                          headers=headers)
+                response.raise_for_status()
+
+        original_load = await measure(lambda: load("original"), iterations=5, warmup=1)
+        thumbnail_load = await measure(lambda: load("thumbnail"), iterations=5, warmup=1)
+        thumbnail_bytes = [
+            len((await http.get(f"/api/expenses/{expense_id}/receipt", params={"variant": "thumbnail"},
+                                headers=headers)).content)
+            for expense_id in expense_ids
+        ]
+
+    await server.ocr_worker_pool.stop()
+    server.receipt_preprocessor.shutdown()
+    report = {
+        "receipts": receipts,
+        "megapixels": megapixels,
+        "ocr_bytes_before_mean": round(statistics.mean(len(body) for body in originals)),
+        "ocr_bytes_after_mean": round(statistics.mean(ocr.bytes_received)),
+        "thumbnail_bytes_mean": round(statistics.mean(thumbnail_bytes)),
+        "upload_to_expense_seconds": round(pipeline_seconds, 2),
+        # Latency to load all receipts once, as the approvals list would
+        "load_all_original_ms": original_load,
+        "load_all_thumbnail_ms": thumbnail_load
+    }
+    print(json.dumps(report))
+    await server.client.drop_database(server.db.name)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--receipts", type=int, default=10)
+    parser.add_argument("--megapixels", type=float, default=12)
+    args = parser.parse_args()
+    asyncio.run(run(args.receipts, args.megapixels))
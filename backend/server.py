@@ -1,23 +1,43 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile, Form, Request, Response, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator, Iterable
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 from passlib.hash import bcrypt
 import base64
 # from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
-import tempfile
 import aiofiles
-import requests
+import aiofiles.os
+import tempfile
+from contextlib import asynccontextmanager
 import json
+import csv
+import io
+import asyncio
+import time
+import hashlib
+import re
+import bisect
+import secrets
+import threading
+import argparse
+import httpx
+import orjson
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from cachetools import TTLCache
+from PIL import Image, ImageOps, UnidentifiedImageError
 
 # Mock classes for emergentintegrations
 class LlmChat:
@@ -39,9 +59,522 @@ class FileContentWithMimeType:
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics configuration
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # if set, /metrics requires "Authorization: Bearer <token>"
+METRICS_LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get("METRICS_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+METRICS_LOOP_LAG_WARN_SECONDS = float(os.environ.get("METRICS_LOOP_LAG_WARN_SECONDS", "0.1"))
+
+# Slow query profiler (opt-in)
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_SLOW_MS = float(os.environ.get("PROFILER_SLOW_MS", "100"))
+PROFILER_COOLDOWN_SECONDS = float(os.environ.get("PROFILER_COOLDOWN_SECONDS", "60"))  # per query shape
+PROFILER_MAX_CONCURRENT_EXPLAINS = int(os.environ.get("PROFILER_MAX_CONCURRENT_EXPLAINS", "2"))
+PROFILER_MAX_SHAPES = int(os.environ.get("PROFILER_MAX_SHAPES", "10000"))  # shapes remembered for the cooldown
+PROFILER_COLLECTION_MAX_BYTES = int(os.environ.get("PROFILER_COLLECTION_MAX_BYTES", str(16 * 1024 * 1024)))
+PROFILER_COLLECTION = "_profiler"
+
+# Metrics
+# Request latency per route template, Mongo command latency per collection and
+# command, and event-loop lag, kept as fixed-bucket histograms in process and
+# rendered in the Prometheus text format at /metrics. Comparing the three tells
+# whether a slow route is waiting on Mongo, spending CPU in the handler, or
+# stuck behind something blocking the loop. Mongo observations arrive on driver
+# threads, so the registry takes a lock.
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate like Prometheus' histogram_quantile: linear within the bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]
+    
+    def summary(self) -> Dict[str, Any]:
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.sum / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.5)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99))
+        }
+
+def _prometheus_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _prometheus_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_prometheus_label_value(value)}"' for key, value in labels.items()) + "}"
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.http_latency: Dict[Tuple[str, str], Histogram] = {}
+            self.http_responses: Dict[Tuple[str, str, str], int] = {}
+            self._in_flight: Dict[int, dict] = {}
+            self.mongo_latency: Dict[Tuple[str, str], Histogram] = {}
+            self.mongo_documents: Dict[Tuple[str, str], int] = {}
+            self.mongo_failures: Dict[Tuple[str, str], int] = {}
+            self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+            self.loop_lag_last = 0.0
+    
+    @staticmethod
+    def route_of(scope: dict) -> str:
+        # The route template, not the raw path, keeps label cardinality bounded
+        return getattr(scope.get("route"), "path", None) or "unmatched"
+    
+    def request_started(self, scope: dict):
+        with self._lock:
+            self._in_flight[id(scope)] = scope
+    
+    def request_finished(self, scope: dict, status_code: int, duration: float):
+        key = (scope["method"], self.route_of(scope))
+        with self._lock:
+            self._in_flight.pop(id(scope), None)
+            histogram = self.http_latency.get(key)
+            if histogram is None:
+                histogram = self.http_latency[key] = Histogram(HTTP_LATENCY_BUCKETS)
+            histogram.observe(duration)
+            response_key = (*key, str(status_code))
+            self.http_responses[response_key] = self.http_responses.get(response_key, 0) + 1
+    
+    def in_flight_routes(self) -> List[str]:
+        with self._lock:
+            scopes = list(self._in_flight.values())
+        return sorted({f"{scope['method']} {self.route_of(scope)}" for scope in scopes})
+    
+    def observe_mongo(self, collection: str, command: str, duration: float, documents: int, failed: bool = False):
+        key = (collection, command)
+        with self._lock:
+            histogram = self.mongo_latency.get(key)
+            if histogram is None:
+                histogram = self.mongo_latency[key] = Histogram(MONGO_LATENCY_BUCKETS)
+            histogram.observe(duration)
+            self.mongo_documents[key] = self.mongo_documents.get(key, 0) + documents
+            if failed:
+                self.mongo_failures[key] = self.mongo_failures.get(key, 0) + 1
+    
+    def observe_loop_lag(self, lag: float):
+        with self._lock:
+            self.loop_lag.observe(lag)
+            self.loop_lag_last = lag
+    
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        
+        def family(name: str, metric_type: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+        
+        def histogram_lines(name: str, labels: Dict[str, str], histogram: Histogram):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_prometheus_labels({**labels, 'le': repr(bound)})} {cumulative}")
+            lines.append(f"{name}_bucket{_prometheus_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} {histogram.count}")
+        
+        with self._lock:
+            family("http_requests_in_flight", "gauge", "HTTP requests currently being served.")
+            lines.append(f"http_requests_in_flight {len(self._in_flight)}")
+            
+            family("http_request_duration_seconds", "histogram", "HTTP request latency by route template.")
+            for (method, route), histogram in sorted(self.http_latency.items()):
+                histogram_lines("http_request_duration_seconds", {"method": method, "route": route}, histogram)
+            
+            family("http_responses_total", "counter", "HTTP responses by route template and status code.")
+            for (method, route, status_code), count in sorted(self.http_responses.items()):
+                lines.append(f"http_responses_total{_prometheus_labels({'method': method, 'route': route, 'status': status_code})} {count}")
+            
+            family("mongo_command_duration_seconds", "histogram", "MongoDB command latency by collection and command.")
+            for (collection, command), histogram in sorted(self.mongo_latency.items()):
+                histogram_lines("mongo_command_duration_seconds", {"collection": collection, "command": command}, histogram)
+            
+            family("mongo_command_documents_returned_total", "counter", "Documents returned by MongoDB cursors.")
+            for (collection, command), count in sorted(self.mongo_documents.items()):
+                lines.append(f"mongo_command_documents_returned_total{_prometheus_labels({'collection': collection, 'command': command})} {count}")
+            
+            family("mongo_command_failures_total", "counter", "Failed MongoDB commands.")
+            for (collection, command), count in sorted(self.mongo_failures.items()):
+                lines.append(f"mongo_command_failures_total{_prometheus_labels({'collection': collection, 'command': command})} {count}")
+            
+            family("event_loop_lag_seconds", "histogram", "How late the event loop woke a periodic probe.")
+            histogram_lines("event_loop_lag_seconds", {}, self.loop_lag)
+            family("event_loop_lag_last_seconds", "gauge", "Event loop lag at the latest probe.")
+            lines.append(f"event_loop_lag_last_seconds {self.loop_lag_last}")
+        return "\n".join(lines) + "\n"
+    
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = []
+            for (method, route), histogram in sorted(self.http_latency.items()):
+                statuses = {
+                    status_code: count for (m, r, status_code), count in self.http_responses.items()
+                    if (m, r) == (method, route)
+                }
+                routes.append({"method": method, "route": route, **histogram.summary(), "statuses": statuses})
+            commands = [
+                {"collection": collection, "command": command, **histogram.summary(),
+                 "documents_returned": self.mongo_documents.get((collection, command), 0),
+                 "failures": self.mongo_failures.get((collection, command), 0)}
+                for (collection, command), histogram in sorted(self.mongo_latency.items())
+            ]
+            return {
+                "in_flight": len(self._in_flight),
+                "routes": routes,
+                "mongo_commands": commands,
+                "event_loop_lag": {**self.loop_lag.summary(), "last_ms": round(self.loop_lag_last * 1000, 3)}
+            }
+
+metrics = MetricsRegistry()
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware, so streaming responses pass straight through)."""
+    
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        self.registry.request_started(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.registry.request_finished(scope, status_code, time.perf_counter() - started)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Feeds per collection/command durations and documents returned into the registry."""
+    
+    # Handshake, auth and session housekeeping, not application queries
+    IGNORED_COMMANDS = frozenset({
+        "hello", "ismaster", "isMaster", "ping", "buildInfo", "buildinfo",
+        "saslStart", "saslContinue", "authenticate", "endSessions"
+    })
+    
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._collections: Dict[Tuple[Any, int], str] = {}
+        self._lock = threading.Lock()
+    
+    def started(self, event):
+        if event.command_name in self.IGNORED_COMMANDS:
+            return
+        field = "collection" if event.command_name == "getMore" else event.command_name
+        collection = event.command.get(field)
+        if not isinstance(collection, str):
+            collection = "-"  # Database-level commands (e.g. aggregate: 1)
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+    
+    def _finish(self, event) -> Optional[str]:
+        with self._lock:
+            return self._collections.pop((event.connection_id, event.request_id), None)
+    
+    def succeeded(self, event):
+        collection = self._finish(event)
+        if collection is None:
+            return
+        reply = event.reply or {}
+        cursor = reply.get("cursor")
+        if isinstance(cursor, dict):
+            documents = len(cursor.get("firstBatch", cursor.get("nextBatch")) or [])
+        elif event.command_name == "findAndModify":
+            documents = 1 if reply.get("value") else 0
+        else:
+            documents = 0
+        self.registry.observe_mongo(collection, event.command_name, event.duration_micros / 1e6, documents)
+    
+    def failed(self, event):
+        collection = self._finish(event)
+        if collection is not None:
+            self.registry.observe_mongo(collection, event.command_name, event.duration_micros / 1e6, 0, failed=True)
+
+mongo_command_metrics = MongoCommandMetrics(metrics)
+
+async def monitor_event_loop_lag(interval: float, warn_after: float):
+    """
+    Sleep for interval and record how much later than that the loop woke up.
+    Lag means a coroutine ran blocking code (sync I/O, CPU-heavy work) on the loop.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        metrics.observe_loop_lag(lag)
+        if lag >= warn_after:
+            logging.warning(
+                f"Event loop blocked for {lag:.3f}s; requests in flight: {', '.join(metrics.in_flight_routes()) or 'none'}"
+            )
+
+# Slow Query Profiler
+# With PROFILER_ENABLED, any explainable command slower than PROFILER_SLOW_MS is
+# re-run as explain("executionStats") in the background. The winning plan,
+# keys/documents examined vs. returned and whether it scanned the collection
+# are logged and stored in the capped _profiler collection. Filters are stored
+# as shapes (values replaced by "?"), and each shape is explained at most once
+# per PROFILER_COOLDOWN_SECONDS.
+EXPLAINABLE_COMMANDS = frozenset({"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"})
+# Session/transport fields the driver adds; explain takes the bare command
+EXPLAIN_STRIPPED_FIELDS = frozenset({"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"})
+
+def redact_query_shape(value: Any) -> Any:
+    """Keep field names and operators, replace values with "?"."""
+    if isinstance(value, dict):
+        return {key: redact_query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $in/$nin lists collapse to one placeholder; pipelines and $or keep their structure
+        if value and all(isinstance(item, dict) for item in value):
+            return [redact_query_shape(item) for item in value]
+        return ["?"]
+    return "?"
+
+def explainable_command(command_name: str, command: dict) -> Optional[dict]:
+    """The command as explain accepts it, or None."""
+    if command_name not in EXPLAINABLE_COMMANDS:
+        return None
+    bare = {
+        key: value for key, value in command.items()
+        if not key.startswith("$") and key not in EXPLAIN_STRIPPED_FIELDS
+    }
+    # Writes are explained one statement at a time
+    for statements in ("updates", "deletes"):
+        if statements in bare:
+            if not bare[statements]:
+                return None
+            bare[statements] = bare[statements][:1]
+    return bare
+
+def command_filter(command_name: str, command: dict) -> Any:
+    if command_name == "aggregate":
+        return command.get("pipeline")
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        return statements[0].get("q")
+    return command.get("filter", command.get("query"))
+
+def _find_in_explain(document: Any, key: str) -> Optional[dict]:
+    """First value for key anywhere in an explain document (aggregate nests it under $cursor)."""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        children = document.values()
+    elif isinstance(document, list):
+        children = document
+    else:
+        return None
+    for child in children:
+        found = _find_in_explain(child, key)
+        if found is not None:
+            return found
+    return None
+
+def _plan_stages(plan: Any) -> List[dict]:
+    stages = []
+    while isinstance(plan, dict):
+        stages.append(plan)
+        if "inputStages" in plan:
+            for child in plan["inputStages"]:
+                stages.extend(_plan_stages(child))
+            break
+        plan = plan.get("inputStage")
+    return stages
+
+def summarize_explain(explain: dict) -> Dict[str, Any]:
+    planner = _find_in_explain(explain, "queryPlanner") or {}
+    winning_plan = planner.get("winningPlan") or {}
+    # Slot-based engine plans wrap the classic tree in queryPlan
+    stages = _plan_stages(winning_plan.get("queryPlan", winning_plan))
+    stats = _find_in_explain(explain, "executionStats") or {}
+    index_names = sorted({stage["indexName"] for stage in stages if stage.get("indexName")})
+    return {
+        "plan": " <- ".join(
+            stage.get("stage", "?") + (f"({stage['indexName']})" if stage.get("indexName") else "")
+            for stage in stages
+        ),
+        "collscan": any(stage.get("stage") == "COLLSCAN" for stage in stages),
+        "indexes": index_names,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "explain_ms": stats.get("executionTimeMillis")
+    }
+
+class SlowQueryProfiler(monitoring.CommandListener):
+    """Command listener that explains slow commands; explains run on the event loop."""
+    
+    def __init__(self, slow_ms: float, cooldown: float, max_concurrent: int, max_shapes: int):
+        self.slow_seconds = slow_ms / 1000
+        self.cooldown = cooldown
+        self.max_concurrent = max_concurrent
+        self._commands: Dict[Tuple[Any, int], Tuple[str, dict]] = {}
+        # Shapes explained within the cooldown; bounded, so one-off shapes don't pile up
+        self._recently_explained = TTLCache(maxsize=max_shapes, ttl=cooldown)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: set = set()
+        self.slow_commands = 0
+        self.explained = 0
+        self.skipped = 0
+        self.explain_errors = 0
+    
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+    
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if collection == PROFILER_COLLECTION:
+            return
+        with self._lock:
+            self._commands[(event.connection_id, event.request_id)] = (event.database_name, dict(event.command))
+    
+    def _pop(self, event) -> Optional[Tuple[str, dict]]:
+        with self._lock:
+            return self._commands.pop((event.connection_id, event.request_id), None)
+    
+    def succeeded(self, event):
+        started = self._pop(event)
+        if started is None or event.duration_micros / 1e6 < self.slow_seconds:
+            return
+        self.slow_commands += 1
+        if self._loop is None or self._loop.is_closed():
+            return
+        database_name, command = started
+        self._loop.call_soon_threadsafe(
+            self._schedule, database_name, event.command_name, command, event.duration_micros / 1000
+        )
+    
+    def failed(self, event):
+        self._pop(event)
+    
+    def _schedule(self, database_name: str, command_name: str, command: dict, duration_ms: float):
+        collection = command.get(command_name)
+        shape = redact_query_shape(command_filter(command_name, command))
+        shape_key = f"{database_name}.{collection}:{command_name}:{orjson.dumps(shape, option=orjson.OPT_SORT_KEYS).decode()}"
+        if shape_key in self._recently_explained or len(self._tasks) >= self.max_concurrent:
+            self.skipped += 1
+            return
+        self._recently_explained[shape_key] = True
+        task = asyncio.create_task(self._explain(database_name, collection, command_name, command, shape, duration_ms))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _explain(self, database_name: str, collection: str, command_name: str,
+                       command: dict, shape: Any, duration_ms: float):
+        entry = {
+            "at": datetime.now(timezone.utc),
+            "database": database_name,
+            "collection": collection,
+            "command": command_name,
+            "duration_ms": round(duration_ms, 3),
+            "filter_shape": shape
+        }
+        bare = explainable_command(command_name, command)
+        try:
+            if bare is None:
+                raise ValueError("command cannot be explained")
+            explain = await client[database_name].command({"explain": bare, "verbosity": "executionStats"})
+            entry.update(summarize_explain(explain))
+            self.explained += 1
+        except Exception as e:
+            entry["explain_error"] = str(e)
+            self.explain_errors += 1
+        
+        if "explain_error" in entry:
+            logging.warning(
+                f"Slow {command_name} on {collection}: {entry['duration_ms']}ms (explain failed: {entry['explain_error']})"
+            )
+        else:
+            logging.warning(
+                f"Slow {command_name} on {collection}: {entry['duration_ms']}ms, plan {entry['plan']}, "
+                f"examined {entry['docs_examined']} docs / {entry['keys_examined']} keys "
+                f"for {entry['returned']} returned{' [COLLSCAN]' if entry['collscan'] else ''}"
+            )
+        try:
+            await client[database_name][PROFILER_COLLECTION].insert_one(entry)
+        except Exception as e:
+            logging.error(f"Could not store slow query profile: {str(e)}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": PROFILER_ENABLED,
+            "slow_ms": self.slow_seconds * 1000,
+            "slow_commands": self.slow_commands,
+            "explained": self.explained,
+            "skipped": self.skipped,
+            "explain_errors": self.explain_errors,
+            "explains_in_flight": len(self._tasks),
+            "shapes_tracked": len(self._recently_explained)
+        }
+
+slow_query_profiler = SlowQueryProfiler(
+    slow_ms=PROFILER_SLOW_MS,
+    cooldown=PROFILER_COOLDOWN_SECONDS,
+    max_concurrent=PROFILER_MAX_CONCURRENT_EXPLAINS,
+    max_shapes=PROFILER_MAX_SHAPES
+)
+
+async def ensure_profiler_collection():
+    """Create the capped _profiler collection (a plain existing one is left alone)."""
+    try:
+        await db.create_collection(PROFILER_COLLECTION, capped=True, size=PROFILER_COLLECTION_MAX_BYTES)
+    except CollectionInvalid:
+        pass
+    except OperationFailure as e:
+        logging.error(f"Could not create {PROFILER_COLLECTION}: {str(e)}")
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+command_listeners = []
+if METRICS_ENABLED:
+    command_listeners.append(mongo_command_metrics)
+if PROFILER_ENABLED:
+    command_listeners.append(slow_query_profiler)
+client = AsyncIOMotorClient(mongo_url, event_listeners=command_listeners)
 db = client[os.environ['DB_NAME']]
 
 # JWT Configuration
@@ -49,8 +582,91 @@ SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Principal cache configuration (resolved users keyed by token subject)
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.environ.get("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.environ.get("PRINCIPAL_CACHE_MAX_SIZE", "10000"))
+
+# Password hashing configuration
+PASSWORD_HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR", "thread")  # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_CONCURRENCY = int(os.environ.get("PASSWORD_HASH_MAX_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+PASSWORD_BCRYPT_ROUNDS = int(os.environ.get("PASSWORD_BCRYPT_ROUNDS", "12"))
+
+# Currency rate configuration
+CURRENCY_API_URL = os.environ.get("CURRENCY_API_URL", "https://api.exchangerate-api.com/v4/latest")
+CURRENCY_RATES_TTL_SECONDS = int(os.environ.get("CURRENCY_RATES_TTL_SECONDS", "3600"))
+CURRENCY_API_TIMEOUT_SECONDS = float(os.environ.get("CURRENCY_API_TIMEOUT_SECONDS", "5"))
+CURRENCY_API_RETRY_SECONDS = int(os.environ.get("CURRENCY_API_RETRY_SECONDS", "60"))
+
+# Country/currency dataset configuration
+COUNTRIES_DATA_PATH = Path(os.environ.get("COUNTRIES_DATA_PATH", ROOT_DIR / "data" / "countries.json"))
+COUNTRIES_REFRESH_URL = os.environ.get("COUNTRIES_REFRESH_URL", "https://restcountries.com/v3.1/all?fields=name,cca2,currencies")
+COUNTRIES_REFRESH_INTERVAL_HOURS = float(os.environ.get("COUNTRIES_REFRESH_INTERVAL_HOURS", "0"))  # 0 disables
+
+# Expense list pagination
+EXPENSE_PAGE_DEFAULT_LIMIT = int(os.environ.get("EXPENSE_PAGE_DEFAULT_LIMIT", "50"))
+EXPENSE_PAGE_MAX_LIMIT = int(os.environ.get("EXPENSE_PAGE_MAX_LIMIT", "500"))
+
+# Expense search
+SEARCH_DEFAULT_LIMIT = int(os.environ.get("SEARCH_DEFAULT_LIMIT", "20"))
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", "100"))
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", "1000"))  # Deepest result a page can reach
+
+# Expense export
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+
+# Bulk expense import
+BULK_IMPORT_MAX_ROWS = int(os.environ.get("BULK_IMPORT_MAX_ROWS", "5000"))
+BULK_IMPORT_CHUNK_SIZE = int(os.environ.get("BULK_IMPORT_CHUNK_SIZE", "500"))
+BULK_IMPORT_MAX_BYTES = int(os.environ.get("BULK_IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# Batch approvals
+APPROVE_BATCH_MAX_SIZE = int(os.environ.get("APPROVE_BATCH_MAX_SIZE", "500"))
+
+# Org hierarchy cache (per-company subtrees, invalidated by companies.org_version)
+ORG_CACHE_VERSION_CHECK_SECONDS = float(os.environ.get("ORG_CACHE_VERSION_CHECK_SECONDS", "5"))
+
+# Expense event streams (SSE)
+EVENTS_FANOUT = os.environ.get("EVENTS_FANOUT", "local")  # "local" or "change_stream" (needs a replica set)
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get("EVENTS_MAX_SUBSCRIBERS", "10000"))
+EVENTS_RECONNECT_MS = 5000
+EVENTS_TOKEN_TTL_SECONDS = int(os.environ.get("EVENTS_TOKEN_TTL_SECONDS", "60"))  # ?token= stream tokens
+
+# Receipt OCR job queue
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "fake")  # "fake" (offline) or "llm"
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "4"))
+OCR_MAX_ATTEMPTS = int(os.environ.get("OCR_MAX_ATTEMPTS", "3"))
+OCR_RETRY_BACKOFF_SECONDS = float(os.environ.get("OCR_RETRY_BACKOFF_SECONDS", "5"))
+OCR_JOB_LEASE_SECONDS = int(os.environ.get("OCR_JOB_LEASE_SECONDS", "300"))
+OCR_POLL_INTERVAL_SECONDS = float(os.environ.get("OCR_POLL_INTERVAL_SECONDS", "2"))
+OCR_FAKE_LATENCY_SECONDS = float(os.environ.get("OCR_FAKE_LATENCY_SECONDS", "0"))
+
+# Receipt storage (content-addressed by SHA-256)
+RECEIPT_STORE_BACKEND = os.environ.get("RECEIPT_STORE_BACKEND", "local")  # "local" or "gridfs"
+RECEIPT_STORE_DIR = Path(os.environ.get("RECEIPT_STORE_DIR", str(ROOT_DIR / "var" / "receipts")))
+RECEIPT_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Receipt image preprocessing (runs in a process pool)
+RECEIPT_PREPROCESS_WORKERS = int(os.environ.get("RECEIPT_PREPROCESS_WORKERS", "2"))
+RECEIPT_PREVIEW_MAX_SIDE = int(os.environ.get("RECEIPT_PREVIEW_MAX_SIDE", "2000"))  # OCR-friendly resolution
+RECEIPT_PREVIEW_JPEG_QUALITY = int(os.environ.get("RECEIPT_PREVIEW_JPEG_QUALITY", "85"))
+RECEIPT_THUMBNAIL_MAX_SIDE = int(os.environ.get("RECEIPT_THUMBNAIL_MAX_SIDE", "320"))
+
+# OCR result cache (keyed by receipt SHA-256 + OCR model/prompt version)
+OCR_CACHE_TTL_SECONDS = int(os.environ.get("OCR_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", "100000"))
+
+# Run migrations and ensure indexes when the app starts
+DB_BOOTSTRAP_ON_STARTUP = os.environ.get("DB_BOOTSTRAP_ON_STARTUP", "true").lower() == "true"
+# A migration claim whose worker stopped heartbeating this long ago may be taken over
+MIGRATION_CLAIM_TIMEOUT_SECONDS = int(os.environ.get("MIGRATION_CLAIM_TIMEOUT_SECONDS", "300"))
+MIGRATION_POLL_SECONDS = float(os.environ.get("MIGRATION_POLL_SECONDS", "2"))
+
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # Create the main app without a prefix
 app = FastAPI(title="Expense Management System", version="1.0.0")
@@ -66,6 +682,7 @@ class User(BaseModel):
     role: str  # "admin", "manager", "employee"
     company_id: str
     manager_id: Optional[str] = None
+    ancestor_ids: List[str] = []  # Management chain, top of the org first, direct manager last
     is_manager_approver: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -90,13 +707,21 @@ class Company(BaseModel):
 class Expense(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     employee_id: str
+    company_id: Optional[str] = None  # Owner's company, stamped at creation
+    manager_id: Optional[str] = None  # Owner's manager, kept in sync on re-parenting
+    ancestor_ids: List[str] = []  # Owner's management chain, kept in sync on re-parenting
     amount: float
     currency: str
     category: str
     description: str
+    merchant: Optional[str] = None  # Merchant name read from the receipt by OCR
     date: datetime
     status: str = "pending"  # pending, approved, rejected
     receipt_url: Optional[str] = None
+    receipt_sha256: Optional[str] = None  # Content hash of the uploaded receipt, also its blob key
+    receipt_content_type: Optional[str] = None
+    receipt_variants: Dict[str, str] = {}  # Derived images ("preview", "thumbnail") -> blob SHA-256
+    possible_duplicate_of: List[str] = []  # Company expenses with the same receipt
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     approval_history: List[Dict[str, Any]] = []
 
@@ -111,6 +736,11 @@ class ApprovalAction(BaseModel):
     action: str  # "approve" or "reject"
     comment: Optional[str] = None
 
+class BatchApprovalAction(BaseModel):
+    expense_ids: List[str]
+    action: str  # "approve" or "reject"
+    comment: Optional[str] = None
+
 # Admin User Management Models
 class UserCreateByAdmin(BaseModel):
     email: EmailStr
@@ -124,6 +754,8 @@ class UserUpdateByAdmin(BaseModel):
     role: Optional[str] = None
     manager_id: Optional[str] = None
     is_manager_approver: Optional[bool] = None
+    is_active: Optional[bool] = None
+    password: Optional[str] = None
 
 class UserResponse(BaseModel):
     id: str
@@ -147,20 +779,183 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# Principal Cache
+class PrincipalCache:
+    """
+    Bounded, TTL-limited in-process cache of resolved users keyed by token subject.
+    Saves the users lookup on every authenticated request; entries are dropped
+    explicitly when an admin changes the user, and expire after the TTL otherwise.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subject: str) -> Optional["User"]:
+        user = self._cache.get(subject)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def set(self, subject: str, user: "User"):
+        self._cache[subject] = user
+
+    def invalidate(self, subject: str):
+        self._cache.pop(subject, None)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": len(self._cache),
+            "max_size": self._cache.maxsize,
+            "ttl_seconds": self._cache.ttl
+        }
+
+principal_cache = PrincipalCache(maxsize=PRINCIPAL_CACHE_MAX_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+def decode_token_subject(token: str, scope: Optional[str] = None) -> str:
+    """
+    The email a token was issued to. Session tokens carry no scope; single-purpose
+    tokens (scope "events") are only accepted where that scope is asked for.
+    """
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    email = payload.get("sub")
+    if email is None or payload.get("scope") != scope:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return email
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await load_principal(decode_token_subject(credentials.credentials))
+
+async def load_principal(email: str) -> "User":
+    """The active user behind a token subject, from principal_cache or the users collection."""
+    cached_user = principal_cache.get(email)
+    if cached_user is not None:
+        return cached_user
     
     user = await db.users.find_one({"email": email})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=401, detail="User account is disabled")
+    
+    current_user = User(**user)
+    principal_cache.set(email, current_user)
+    return current_user
+
+def create_event_stream_token(email: str) -> str:
+    """A short-lived token that only opens /api/events, safe-ish to put in a URL."""
+    return create_access_token({"sub": email, "scope": "events"}, timedelta(seconds=EVENTS_TOKEN_TTL_SECONDS))
+
+async def get_event_stream_user(
+    token: Optional[str] = Query(None, description="Stream token from POST /api/events/token, for EventSource clients"),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """
+    Like get_current_user, but also accepts a stream token as a query parameter.
+    Session tokens are refused there: URLs end up in access and proxy logs.
+    """
+    if credentials is not None:
+        return await get_current_user(credentials)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await load_principal(decode_token_subject(token, scope="events"))
+
+# Password Hashing Service
+def _hash_password(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+def _verify_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.verify(password, hashed_password)
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a worker pool so the event loop
+    stays responsive. A semaphore caps in-flight calls; callers beyond the cap
+    wait in line and are reported as queued.
+    """
+
+    def __init__(self, executor_kind: str, workers: int, max_concurrency: int, rounds: int):
+        if executor_kind not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash executor: {executor_kind}")
+        self.executor_kind = executor_kind
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.rounds = rounds
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.max_queue_depth = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(_verify_password, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "bcrypt_rounds": self.rounds,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "max_queue_depth": self.max_queue_depth
+        }
+
+password_hasher = PasswordHasher(
+    executor_kind=PASSWORD_HASH_EXECUTOR,
+    workers=PASSWORD_HASH_WORKERS,
+    max_concurrency=PASSWORD_HASH_MAX_CONCURRENCY,
+    rounds=PASSWORD_BCRYPT_ROUNDS
+)
 
 # Role-Based Permission System
 def require_role(*allowed_roles: str):
@@ -243,8 +1038,8 @@ async def can_user_access_expense(user: User, expense_id: str) -> bool:
         # Manager can access their own expenses or their team's expenses
         if expense["employee_id"] == user.id:
             return True
-        # Check if the expense employee reports to this manager
-        return expense_employee.get("manager_id") == user.id
+        # Check if the expense employee is anywhere below this manager
+        return user.id in expense_employee.get("ancestor_ids", [])
     elif user.role == "employee":
         # Employee can only access their own expenses
         return expense["employee_id"] == user.id
@@ -274,7 +1069,7 @@ async def get_company_safe_expense(expense_id: str, user: User) -> Optional[dict
     if user.role == "admin":
         return expense
     elif user.role == "manager":
-        if expense["employee_id"] == user.id or expense_employee.get("manager_id") == user.id:
+        if expense["employee_id"] == user.id or user.id in expense_employee.get("ancestor_ids", []):
             return expense
     elif user.role == "employee" and expense["employee_id"] == user.id:
         return expense
@@ -291,24 +1086,32 @@ async def get_company_safe_user(user_id: str, current_user: User) -> Optional[di
     })
     return user
 
-async def get_accessible_user_ids(current_user: User) -> List[str]:
+def expense_visibility_query(current_user: User) -> dict:
     """
-    Get list of user IDs that current user can access based on role + company.
+    Mongo filter for the expenses a user can see, using the company_id and
+    ancestor_ids stamped on each expense instead of a list of user IDs.
     """
     if current_user.role == "admin":
-        # Admin sees all users in their company
-        users = await db.users.find({"company_id": current_user.company_id}).to_list(1000)
-        return [user["id"] for user in users]
+        # Admin sees every expense in their company
+        return {"company_id": current_user.company_id}
     elif current_user.role == "manager":
-        # Manager sees their team + themselves
-        team_users = await db.users.find({
+        # Manager sees their whole subtree + themselves
+        return {
             "company_id": current_user.company_id,
-            "manager_id": current_user.id
-        }).to_list(1000)
-        return [user["id"] for user in team_users] + [current_user.id]
+            "$or": [{"ancestor_ids": current_user.id}, {"employee_id": current_user.id}]
+        }
     else:
         # Employee sees only themselves
-        return [current_user.id]
+        return {"employee_id": current_user.id}
+
+async def get_owner_chain(user_id: str) -> Dict[str, Any]:
+    """
+    An expense owner's current manager_id and ancestor_ids, read from users at
+    write time. The cached principal can predate a re-parent made on another
+    worker, and stamping from it would hide the expense from the new manager.
+    """
+    owner = await db.users.find_one({"id": user_id}, {"_id": 0, "manager_id": 1, "ancestor_ids": 1}) or {}
+    return {"manager_id": owner.get("manager_id"), "ancestor_ids": owner.get("ancestor_ids") or []}
 
 async def validate_cross_company_access(target_company_id: str, current_user: User) -> bool:
     """
@@ -377,169 +1180,1908 @@ async def get_direct_reports(manager_user: User) -> List[str]:
     reports = await reports_cursor.to_list(length=None)
     return [report["id"] for report in reports]
 
-async def get_manager_accessible_users(manager_user: User) -> List[str]:
-    """
-    Get all user IDs that a manager can access (themselves + direct reports).
-    Includes the manager's own ID plus all their direct reports.
-    """
-    accessible_ids = [manager_user.id]  # Manager can always access themselves
-    
-    if manager_user.role in ["admin", "manager"]:
-        direct_reports = await get_direct_reports(manager_user)
-        accessible_ids.extend(direct_reports)
-    
-    return accessible_ids
-
-# Currency conversion
-async def get_currency_rates(base_currency: str = "USD"):
-    try:
-        response = requests.get(f"https://api.exchangerate-api.com/v4/latest/{base_currency}")
-        if response.status_code == 200:
-            return response.json()["rates"]
-    except:
-        pass
-    return {"USD": 1.0}  # Fallback
+# Org Hierarchy
+# Every user stores ancestor_ids, the chain of managers above them (top first).
+# "Everyone under X" is then one indexed query on ancestor_ids, and expenses and
+# rollups carry the owner's chain so visibility filters stay equality matches.
+# companies.org_version is bumped on every hierarchy change; OrgCache compares
+# it to drop stale subtrees.
+class OrgCycleError(ValueError):
+    """Raised when a manager assignment would make a user their own ancestor."""
 
-# OCR Function
-async def extract_receipt_data(image_file: UploadFile):
-    try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            content = await image_file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        # Initialize LLM chat for OCR
-        chat = LlmChat(
-            api_key=os.environ.get("EMERGENT_LLM_KEY"),
-            session_id=f"receipt_ocr_{uuid.uuid4()}",
-            system_message="You are an OCR assistant that extracts expense information from receipt images."
-        ).with_model("openai", "gpt-4o")
+async def ancestor_ids_for_manager(manager_id: Optional[str], company_id: str) -> List[str]:
+    """The ancestor_ids a user gets when reporting to manager_id."""
+    if not manager_id:
+        return []
+    manager = await db.users.find_one(
+        {"id": manager_id, "company_id": company_id},
+        {"_id": 0, "ancestor_ids": 1}
+    )
+    if manager is None:
+        return []
+    return (manager.get("ancestor_ids") or []) + [manager_id]
 
-        # Create file content for the image
-        image_file_content = FileContentWithMimeType(
-            file_path=temp_file_path,
-            mime_type="image/jpeg"
-        )
+def check_org_cycle(user_id: str, new_ancestor_ids: List[str]):
+    if user_id in new_ancestor_ids:
+        raise OrgCycleError("Manager assignment would create a reporting cycle")
 
-        # Send message with image
-        user_message = UserMessage(
-            text="""Extract the following information from this receipt image and return as JSON:
-            {
-                "amount": <total amount as float>,
-                "date": <date in YYYY-MM-DD format>,
-                "merchant_name": <restaurant/store name>,
-                "description": <brief description of purchase>,
-                "category": <expense category like 'meals', 'travel', 'office supplies', etc>
-            }
-            Return only valid JSON without any additional text.""",
-            file_contents=[image_file_content]
-        )
+def compute_company_ancestors(users: List[dict]) -> Dict[str, List[str]]:
+    """
+    ancestor_ids for every user of a company from their manager_id links.
+    A chain that loops back on itself is cut where the loop starts and logged.
+    """
+    managers = {user["id"]: user.get("manager_id") for user in users}
+    ancestors: Dict[str, List[str]] = {}
+    for user_id in managers:
+        chain = []
+        seen = {user_id}
+        manager_id = managers.get(user_id)
+        while manager_id and manager_id in managers:
+            if manager_id in seen:
+                logging.warning(f"Reporting cycle at user {manager_id}; chain of {user_id} cut there")
+                break
+            seen.add(manager_id)
+            chain.append(manager_id)
+            manager_id = managers.get(manager_id)
+        ancestors[user_id] = list(reversed(chain))
+    return ancestors
 
-        response = await chat.send_message(user_message)
-        
-        # Clean up temp file
-        os.unlink(temp_file_path)
-        
-        # Parse the JSON response
-        try:
-            extracted_data = json.loads(response)
-            return extracted_data
-        except json.JSONDecodeError:
-            # Try to extract JSON from response if wrapped in other text
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-            else:
-                raise ValueError("Could not parse JSON from OCR response")
-                
-    except Exception as e:
-        logging.error(f"OCR extraction failed: {str(e)}")
-        return {"error": str(e)}
+async def bump_org_version(company_id: str):
+    await db.companies.update_one({"id": company_id}, {"$inc": {"org_version": 1}})
+    org_cache.invalidate(company_id)
 
-# API Routes
-@api_router.post("/auth/register")
-async def register_user(user_data: UserCreate):
-    """Register new user with company isolation checks."""
+async def reparent_user(user: dict, new_ancestor_ids: List[str]):
+    """
+    Propagate a changed management chain from user to their whole subtree, and
+    re-stamp the affected expenses and rollups. The user's own manager_id and
+    ancestor_ids must already be saved.
+    """
+    company_id = user["company_id"]
+    descendants = await db.users.find(
+        {"company_id": company_id, "ancestor_ids": user["id"]},
+        {"_id": 0, "id": 1, "email": 1, "ancestor_ids": 1}
+    ).to_list(None)
     
-    # Check if user already exists (email must be unique globally)
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
+    chains = {user["id"]: new_ancestor_ids}
+    for descendant in descendants:
+        below = descendant["ancestor_ids"][descendant["ancestor_ids"].index(user["id"]):]
+        chains[descendant["id"]] = new_ancestor_ids + below
     
-    # Get country and currency data
-    try:
-        countries_response = requests.get("https://restcountries.com/v3.1/all?fields=name,currencies")
-        countries_data = countries_response.json()
-        
-        # Find currency for selected country
-        currency = "USD"  # Default
-        for country in countries_data:
-            if country["name"]["common"] == user_data.country:
-                if "currencies" in country:
-                    currency = list(country["currencies"].keys())[0]
-                break
-    except:
-        currency = "USD"
+    if descendants:
+        await db.users.bulk_write([
+            UpdateOne({"id": user_id}, {"$set": {"ancestor_ids": chains[user_id]}})
+            for user_id in chains if user_id != user["id"]
+        ], ordered=False)
     
-    # Create company (first user becomes admin)
-    company_name = user_data.company_name or f"{user_data.full_name}'s Company"
-    company = Company(
-        name=company_name,
-        currency=currency,
-        country=user_data.country
-    )
-    await db.companies.insert_one(company.dict())
+    owner_updates = []
+    for user_id, chain in chains.items():
+        stamp = {"ancestor_ids": chain}
+        if user_id == user["id"]:
+            stamp["manager_id"] = new_ancestor_ids[-1] if new_ancestor_ids else None
+        owner_updates.append(UpdateMany({"employee_id": user_id, "company_id": company_id}, {"$set": stamp}))
+    await db.expenses.bulk_write(owner_updates, ordered=False)
+    await db.expense_rollups.bulk_write(owner_updates, ordered=False)
     
-    # Create user (always admin for new company registration)
-    hashed_password = bcrypt.hash(user_data.password)
-    user = User(
-        email=user_data.email,
-        full_name=user_data.full_name,
-        role="admin",  # First user is admin
-        company_id=company.id
-    )
+    for descendant in descendants:
+        principal_cache.invalidate(descendant["email"])
+    await bump_org_version(company_id)
+    await bump_data_versions(company_id, chains)
+
+class OrgCache:
+    """
+    Per-company cache of "all users under X" lists. Each company entry remembers
+    the org_version it was built for; the version is re-read at most every
+    ORG_CACHE_VERSION_CHECK_SECONDS, and local changes invalidate immediately.
+    """
     
-    # Store user with hashed password
-    user_dict = user.dict()
-    user_dict["password"] = hashed_password
-    await db.users.insert_one(user_dict)
+    def __init__(self, version_check_seconds: float):
+        self.version_check_seconds = version_check_seconds
+        self._companies: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
     
-    # Create access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
+    async def _entry(self, company_id: str) -> Dict[str, Any]:
+        entry = self._companies.get(company_id)
+        now = time.monotonic()
+        if entry and now - entry["checked_at"] < self.version_check_seconds:
+            return entry
+        company = await db.companies.find_one({"id": company_id}, {"_id": 0, "org_version": 1}) or {}
+        version = company.get("org_version", 0)
+        if not entry or entry["version"] != version:
+            entry = {"version": version, "subtrees": {}}
+            self._companies[company_id] = entry
+        entry["checked_at"] = now
+        return entry
     
-    return {"access_token": access_token, "token_type": "bearer", "user": user}
-
-@api_router.post("/auth/login")
-async def login_user(login_data: UserLogin):
-    """Login user with company information included."""
+    async def subtree(self, company_id: str, user_id: str) -> List[str]:
+        """Ids of every user below user_id (direct and indirect reports)."""
+        entry = await self._entry(company_id)
+        subtree = entry["subtrees"].get(user_id)
+        if subtree is not None:
+            self.hits += 1
+            return subtree
+        self.misses += 1
+        users = await db.users.find(
+            {"company_id": company_id, "ancestor_ids": user_id},
+            {"_id": 0, "id": 1}
+        ).to_list(None)
+        subtree = [user["id"] for user in users]
+        entry["subtrees"][user_id] = subtree
+        return subtree
     
-    # Find user by email (no company filter needed for login)
-    user_doc = await db.users.find_one({"email": login_data.email})
-    if not user_doc or not bcrypt.verify(login_data.password, user_doc["password"]):
-        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    def invalidate(self, company_id: str):
+        self._companies.pop(company_id, None)
     
-    user = User(**user_doc)
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "companies": len(self._companies),
+            "version_check_seconds": self.version_check_seconds
+        }
+
+org_cache = OrgCache(version_check_seconds=ORG_CACHE_VERSION_CHECK_SECONDS)
+
+async def resolve_expense_for_approval(expense_id: str, approver: User) -> dict:
+    """
+    Load an expense together with its owner in one aggregation and check that
+    the approver may act on it. Raises 404 for missing/cross-company expenses
+    and 403 when a manager is not above the owner in the org.
+    """
+    pipeline = [
+        {"$match": {"id": expense_id}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "employee_id",
+            "foreignField": "id",
+            "as": "owner"
+        }},
+        {"$unwind": "$owner"},
+        {"$match": {"owner.company_id": approver.company_id}},
+        {"$project": {
+            "_id": 0, "id": 1, "employee_id": 1, "company_id": 1, "manager_id": 1, "ancestor_ids": 1,
+            "amount": 1, "currency": 1, "date": 1, "status": 1,
+            "owner_ancestor_ids": "$owner.ancestor_ids"
+        }}
+    ]
+    matches = await db.expenses.aggregate(pipeline).to_list(1)
+    if not matches:
+        raise HTTPException(status_code=404, detail="Expense not found or access denied")
     
-    # Verify user's company still exists (additional security)
-    company = await db.companies.find_one({"id": user.company_id})
-    if not company:
+    expense = matches[0]
+    if approver.role == "manager" and approver.id != expense["employee_id"] \
+            and approver.id not in (expense.get("owner_ancestor_ids") or []):
+        # Manager can only approve expenses from people below them
         raise HTTPException(
-            status_code=401, 
-            detail="User's company no longer exists. Contact administrator."
+            status_code=403,
+            detail="You can only approve expenses from your team"
         )
-    
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+    return expense
+
+# Data Versions & Conditional GETs
+# companies.data_version and users.data_version are bumped after every write that
+# changes what a list or stats endpoint returns: the company's on any expense or
+# user write in it, and each expense owner's on writes to their expenses. ETags
+# are derived from the version covering the caller's scope (their own user
+# document for employees, the company for managers and admins), so a matching
+# If-None-Match is answered with 304 after one lookup by id, before any expense
+# query runs. Bumps come after the write they cover: a response read
+# concurrently may carry an older version (one extra refetch), never a newer one.
+DATA_CACHE_CONTROL = "private, no-cache"
+
+async def bump_data_versions(company_id: str, user_ids: Iterable[Optional[str]] = ()):
+    """Mark the company's data, and that of the given expense owners, as changed."""
+    await db.companies.update_one({"id": company_id}, {"$inc": {"data_version": 1}})
+    user_ids = sorted({user_id for user_id in user_ids if user_id})
+    if user_ids:
+        await db.users.update_many({"id": {"$in": user_ids}}, {"$inc": {"data_version": 1}})
+
+async def get_data_version(current_user: User) -> int:
+    if current_user.role == "employee":
+        # Employees only ever see their own expenses
+        document = await db.users.find_one({"id": current_user.id}, {"_id": 0, "data_version": 1})
+    else:
+        document = await db.companies.find_one({"id": current_user.company_id}, {"_id": 0, "data_version": 1})
+    return (document or {}).get("data_version", 0)
+
+async def data_version_etag(request: Request, current_user: User, *extra: Any) -> str:
+    """ETag for a response that depends only on the caller, the URL and the data version."""
+    version = await get_data_version(current_user)
+    key = "|".join(str(part) for part in (
+        request.url.path, request.url.query, current_user.id, current_user.role, version, *extra
+    ))
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, so W/ prefixes and lists of tags are honoured)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL})
+    return None
+
+def currency_rates_epoch() -> int:
+    """Changes once per rate TTL, so ETags of converted totals expire with the rates."""
+    return int(time.time() // max(CURRENCY_RATES_TTL_SECONDS, 1))
+
+# Expense Events
+# Writers publish expense.created / expense.status_changed to an in-process
+# broker, which fans each event out to the open /api/events streams of the same
+# company whose audience it is: admins, everyone above the owner in the org,
+# and the owner. Each event is serialized once and the same bytes go to every
+# subscriber. With EVENTS_FANOUT=change_stream writers don't publish; every
+# worker tails the expenses change stream instead, so a write in one process
+# reaches subscribers connected to any other.
+# Subscribers get a bounded queue. One that falls EVENTS_QUEUE_SIZE events
+# behind is sent "resync" and disconnected rather than buffered; the client
+# reconnects and refetches. Idle streams cost one queue and a heartbeat
+# comment every EVENTS_HEARTBEAT_SECONDS.
+EXPENSE_EVENT_FIELDS = ("id", "employee_id", "status", "amount", "currency", "date")
+
+def expense_event(event_type: str, expense: dict) -> dict:
+    data = {field: expense.get(field) for field in EXPENSE_EVENT_FIELDS}
+    return {
+        "company_id": expense["company_id"],
+        "audience": {expense["employee_id"], *(expense.get("ancestor_ids") or [])},
+        "message": f"event: {event_type}\ndata: {orjson.dumps(data).decode()}\n\n"
+    }
+
+class EventSubscription:
+    def __init__(self, user: User, queue_size: int):
+        self.user_id = user.id
+        self.company_id = user.company_id
+        self.is_admin = user.role == "admin"
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+class EventBroker:
+    """In-process pub/sub of expense events, keyed by company."""
+    
+    def __init__(self, queue_size: int, max_subscribers: int):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[str, set] = {}
+        self.subscriber_count = 0
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+    
+    def has_capacity(self) -> bool:
+        return self.subscriber_count < self.max_subscribers
+    
+    def subscribe(self, user: User) -> EventSubscription:
+        subscription = EventSubscription(user, self.queue_size)
+        self._subscribers.setdefault(user.company_id, set()).add(subscription)
+        self.subscriber_count += 1
+        return subscription
+    
+    def unsubscribe(self, subscription: EventSubscription):
+        company_subscribers = self._subscribers.get(subscription.company_id)
+        if company_subscribers and subscription in company_subscribers:
+            company_subscribers.discard(subscription)
+            self.subscriber_count -= 1
+            if not company_subscribers:
+                del self._subscribers[subscription.company_id]
+    
+    def publish(self, event: dict):
+        self.published += 1
+        for subscription in self._subscribers.get(event["company_id"], ()):
+            if subscription.overflowed:
+                continue
+            if not subscription.is_admin and subscription.user_id not in event["audience"]:
+                continue
+            try:
+                subscription.queue.put_nowait(event["message"])
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # Too slow to keep up: make it resync instead of buffering without bound
+                subscription.overflowed = True
+                self.overflows += 1
+    
+    def close(self):
+        """End every open stream (on shutdown)."""
+        for company_subscribers in self._subscribers.values():
+            for subscription in company_subscribers:
+                try:
+                    subscription.queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    subscription.overflowed = True
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fanout": EVENTS_FANOUT,
+            "subscribers": self.subscriber_count,
+            "companies": len(self._subscribers),
+            "max_subscribers": self.max_subscribers,
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows
+        }
+
+event_broker = EventBroker(queue_size=EVENTS_QUEUE_SIZE, max_subscribers=EVENTS_MAX_SUBSCRIBERS)
+
+def publish_expense_events(event_type: str, expenses: List[dict]):
+    """Publish events for expenses just written (a no-op when the change stream feeds the broker)."""
+    if EVENTS_FANOUT == "change_stream":
+        return
+    for expense in expenses:
+        event_broker.publish(expense_event(event_type, expense))
+
+async def event_stream(user: User, heartbeat: float) -> AsyncIterator[str]:
+    subscription = event_broker.subscribe(user)
+    try:
+        yield f"retry: {EVENTS_RECONNECT_MS}\nevent: ready\ndata: {{}}\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if subscription.overflowed:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            if message is None:
+                return
+            yield message
+    finally:
+        event_broker.unsubscribe(subscription)
+
+async def watch_expense_changes():
+    """Feed the broker from the expenses change stream (EVENTS_FANOUT=change_stream)."""
+    pipeline = [{"$match": {"$or": [
+        {"operationType": "insert"},
+        {"operationType": "update", "updateDescription.updatedFields.status": {"$exists": True}}
+    ]}}]
+    resume_token = None
+    while True:
+        try:
+            async with db.expenses.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    expense = change.get("fullDocument")
+                    if not expense:
+                        continue
+                    event_type = "expense.created" if change["operationType"] == "insert" else "expense.status_changed"
+                    event_broker.publish(expense_event(event_type, expense))
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            # Typically the resume point fell off the oplog; start again from now
+            logging.error(f"Expense change stream failed: {str(e)}")
+            resume_token = None
+            await asyncio.sleep(EVENTS_RECONNECT_MS / 1000)
+        except Exception as e:
+            logging.error(f"Expense change stream error: {str(e)}")
+            await asyncio.sleep(EVENTS_RECONNECT_MS / 1000)
+
+# Expense List Pagination
+def encode_expense_cursor(expense: dict) -> str:
+    """Opaque keyset cursor for the (date, id) position of an expense."""
+    position = json.dumps({"d": expense["date"].isoformat(), "i": expense["id"]})
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+def decode_expense_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(position["d"]), position["i"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+class ExpenseFilterParams:
+    """Server-side status/category/date filters shared by expense list and export endpoints."""
+
+    def __init__(
+        self,
+        status: Optional[str] = Query(None, description="pending, approved or rejected"),
+        category: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ):
+        self.status = status
+        self.category = category
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def filters(self) -> dict:
+        query = {}
+        if self.status:
+            query["status"] = self.status
+        if self.category:
+            query["category"] = self.category
+        if self.date_from or self.date_to:
+            query["date"] = {}
+            if self.date_from:
+                query["date"]["$gte"] = self.date_from
+            if self.date_to:
+                query["date"]["$lte"] = self.date_to
+        return query
+
+class ExpensePageParams(ExpenseFilterParams):
+    """
+    Query parameters shared by the expense list endpoints: keyset paging on
+    (date, id), newest first, plus the ExpenseFilterParams filters.
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(EXPENSE_PAGE_DEFAULT_LIMIT, ge=1, le=EXPENSE_PAGE_MAX_LIMIT),
+        after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+        status: Optional[str] = Query(None, description="pending, approved or rejected"),
+        category: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ):
+        super().__init__(status=status, category=category, date_from=date_from, date_to=date_to)
+        self.limit = limit
+        self.after = after
+
+    def keyset(self) -> dict:
+        if not self.after:
+            return {}
+        after_date, after_id = decode_expense_cursor(self.after)
+        return {"$or": [
+            {"date": {"$lt": after_date}},
+            {"date": after_date, "id": {"$lt": after_id}}
+        ]}
+
+# List endpoints skip building an Expense model per row (and FastAPI's second
+# validation pass against response_model): Mongo projects exactly the Expense
+# fields, missing optional fields get the model defaults, and the plain dicts
+# are encoded with orjson.
+EXPENSE_LIST_PROJECTION = {"_id": 0, **{field: 1 for field in Expense.model_fields}}
+EXPENSE_ROW_DEFAULTS = {
+    name: field.default for name, field in Expense.model_fields.items()
+    if not field.is_required() and field.default_factory is None
+}
+
+def expense_rows(expenses: List[dict]) -> List[dict]:
+    """Fill model defaults into projected expense documents, matching Expense's output shape."""
+    return [{**EXPENSE_ROW_DEFAULTS, **expense} for expense in expenses]
+
+async def fetch_expense_page(query: dict, page: ExpensePageParams) -> Tuple[List[dict], Optional[str]]:
+    """
+    Run one page of an expense query. Returns the page as plain expense rows
+    and the cursor for the next one (None on the last page).
+    """
+    clauses = [clause for clause in (query, page.filters(), page.keyset()) if clause]
+    full_query = {"$and": clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+    
+    cursor = db.expenses.find(full_query, EXPENSE_LIST_PROJECTION).sort([("date", -1), ("id", -1)]).limit(page.limit + 1)
+    expenses = await cursor.to_list(page.limit + 1)
+    
+    next_cursor = None
+    if len(expenses) > page.limit:
+        expenses = expenses[:page.limit]
+        next_cursor = encode_expense_cursor(expenses[-1])
+    return expense_rows(expenses), next_cursor
+
+# Expense Search
+# The company_text_search index is prefixed by company_id, so every search must
+# match company_id by equality; Mongo then reads only that tenant's postings for
+# the search terms instead of every company's. Visibility and the list filters
+# are applied on top. One $facet round trip returns the ranked page, the total
+# and the category/status/month counts over all matches. Relevance has no
+# stable keyset, so pages are numbered and can reach at most SEARCH_MAX_RESULTS
+# deep.
+def expense_search_pipeline(match: dict, skip: int, limit: int) -> List[dict]:
+    def counts(key: Any, sort: dict) -> List[dict]:
+        return [
+            {"$group": {"_id": key, "count": {"$sum": 1}}},
+            {"$sort": sort},
+            {"$project": {"_id": 0, "value": "$_id", "count": 1}}
+        ]
+    
+    return [
+        {"$match": match},
+        {"$facet": {
+            "results": [
+                {"$sort": {"score": {"$meta": "textScore"}, "date": -1, "id": -1}},
+                {"$skip": skip},
+                {"$limit": limit},
+                {"$project": {**EXPENSE_LIST_PROJECTION, "score": {"$meta": "textScore"}}}
+            ],
+            "total": [{"$count": "count"}],
+            "category": counts("$category", {"count": -1, "_id": 1}),
+            "status": counts("$status", {"count": -1, "_id": 1}),
+            "month": counts({"$dateToString": {"format": "%Y-%m", "date": "$date"}}, {"_id": -1})
+        }}
+    ]
+
+async def search_expenses(current_user: User, q: str, filters: ExpenseFilterParams,
+                          page: int, limit: int) -> Dict[str, Any]:
+    """Relevance-ranked page of the caller's visible expenses matching q, with facet counts."""
+    skip = (page - 1) * limit
+    if skip >= SEARCH_MAX_RESULTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Search pages stop at the first {SEARCH_MAX_RESULTS} matches; refine the query"
+        )
+    limit = min(limit, SEARCH_MAX_RESULTS - skip)
+    
+    match = {
+        **expense_visibility_query(current_user),
+        "company_id": current_user.company_id,
+        **filters.filters(),
+        "$text": {"$search": q}
+    }
+    facets = (await db.expenses.aggregate(expense_search_pipeline(match, skip, limit)).to_list(1))[0]
+    
+    total = facets["total"][0]["count"] if facets["total"] else 0
+    return {
+        "query": q,
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "has_more": skip + len(facets["results"]) < min(total, SEARCH_MAX_RESULTS),
+        "results": expense_rows(facets["results"]),
+        "facets": {name: facets[name] for name in ("category", "status", "month")}
+    }
+
+# Currency conversion
+class CurrencyRatesUnavailable(Exception):
+    """Raised when no fresh or persisted rates exist for a base currency."""
+
+class CurrencyRateService:
+    """
+    Exchange rates per base currency, fetched with a non-blocking client and
+    cached for CURRENCY_RATES_TTL_SECONDS. Concurrent refreshes of the same base
+    share one upstream request. Every good response is persisted to the
+    currency_rates collection so cold starts and offline runs serve the last
+    snapshot immediately while a refresh runs in the background.
+    """
+
+    def __init__(self, api_url: str, ttl: int, timeout: float, retry_after: int = 60):
+        self.api_url = api_url.rstrip("/")
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._rates: Dict[str, Dict[str, Any]] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._refreshes: Dict[str, asyncio.Task] = {}
+        self._http: Optional[httpx.AsyncClient] = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.upstream_fetches = 0
+        self.upstream_failures = 0
+
+    def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=self.timeout)
+        return self._http
+
+    def _is_fresh(self, snapshot: Dict[str, Any]) -> bool:
+        return time.time() - snapshot["fetched_at"].timestamp() < self.ttl
+
+    async def _fetch(self, base_currency: str) -> Dict[str, Any]:
+        # Don't hammer (or wait on) an upstream that just failed
+        if time.time() - self._failed_at.get(base_currency, 0) < self.retry_after:
+            raise CurrencyRatesUnavailable(base_currency)
+        
+        self.upstream_fetches += 1
+        try:
+            response = await self._get_http().get(f"{self.api_url}/{base_currency}")
+            response.raise_for_status()
+            rates = response.json()["rates"]
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            self.upstream_failures += 1
+            self._failed_at[base_currency] = time.time()
+            logging.warning(f"Currency rate refresh for {base_currency} failed: {str(e)}")
+            raise CurrencyRatesUnavailable(base_currency) from e
+        
+        snapshot = {
+            "base": base_currency,
+            "rates": rates,
+            "fetched_at": datetime.now(timezone.utc)
+        }
+        self._rates[base_currency] = snapshot
+        try:
+            await db.currency_rates.update_one(
+                {"base": base_currency},
+                {"$set": snapshot},
+                upsert=True
+            )
+        except Exception as e:
+            logging.warning(f"Could not persist {base_currency} rate snapshot: {str(e)}")
+        return dict(snapshot)
+
+    def _refresh(self, base_currency: str) -> asyncio.Task:
+        """Start (or join) the single in-flight refresh for a base currency."""
+        task = self._refreshes.get(base_currency)
+        if task is None:
+            task = asyncio.create_task(self._fetch(base_currency))
+            self._refreshes[base_currency] = task
+            task.add_done_callback(lambda t: self._finish_refresh(base_currency, t))
+        return task
+
+    def _finish_refresh(self, base_currency: str, task: asyncio.Task):
+        self._refreshes.pop(base_currency, None)
+        if not task.cancelled():
+            task.exception()  # Mark background failures as retrieved
+
+    async def _load_persisted(self, base_currency: str) -> Optional[Dict[str, Any]]:
+        snapshot = await db.currency_rates.find_one({"base": base_currency}, {"_id": 0})
+        if snapshot:
+            if snapshot["fetched_at"].tzinfo is None:
+                snapshot["fetched_at"] = snapshot["fetched_at"].replace(tzinfo=timezone.utc)
+            self._rates[base_currency] = snapshot
+        return snapshot
+
+    async def get_snapshot(self, base_currency: str = "USD") -> Dict[str, Any]:
+        base_currency = base_currency.upper()
+        snapshot = self._rates.get(base_currency) or await self._load_persisted(base_currency)
+        
+        if snapshot and self._is_fresh(snapshot):
+            self.hits += 1
+            return snapshot
+        
+        if snapshot:
+            # Serve stale-but-valid rates now, refresh in the background
+            self.stale_hits += 1
+            self._refresh(base_currency)
+            return snapshot
+        
+        self.misses += 1
+        return await asyncio.shield(self._refresh(base_currency))
+
+    async def get_rates(self, base_currency: str = "USD") -> Dict[str, float]:
+        snapshot = await self.get_snapshot(base_currency)
+        return snapshot["rates"]
+
+    async def close(self):
+        for task in list(self._refreshes.values()):
+            task.cancel()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "upstream_fetches": self.upstream_fetches,
+            "upstream_failures": self.upstream_failures,
+            "cached_bases": sorted(self._rates.keys()),
+            "ttl_seconds": self.ttl
+        }
+
+currency_rate_service = CurrencyRateService(
+    api_url=CURRENCY_API_URL,
+    ttl=CURRENCY_RATES_TTL_SECONDS,
+    timeout=CURRENCY_API_TIMEOUT_SECONDS,
+    retry_after=CURRENCY_API_RETRY_SECONDS
+)
+
+async def get_currency_rates(base_currency: str = "USD"):
+    try:
+        return await currency_rate_service.get_rates(base_currency)
+    except CurrencyRatesUnavailable:
+        logging.error(f"No exchange rates available for {base_currency}, using identity rate")
+        return {base_currency.upper(): 1.0}  # Fallback
+
+# Country/currency index
+class CountryIndex:
+    """
+    In-memory country -> currency index built from the bundled dataset.
+    Lookups accept ISO alpha-2 codes or common names. The serialized
+    /api/countries payload is rendered once per index version.
+    """
+
+    def __init__(self, countries: List[Dict[str, str]]):
+        self.countries = sorted(countries, key=lambda c: c["name"])
+        self._by_code = {c["code"].upper(): c for c in self.countries}
+        self._by_name = {c["name"].lower(): c for c in self.countries}
+        self.payload = json.dumps(self.countries, ensure_ascii=False).encode("utf-8")
+        self.etag = '"' + hashlib.sha256(self.payload).hexdigest()[:16] + '"'
+
+    @classmethod
+    def from_file(cls, path: Path) -> "CountryIndex":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_restcountries(cls, data: List[Dict[str, Any]]) -> "CountryIndex":
+        countries = []
+        for country in data:
+            currencies = list(country.get("currencies") or {})
+            if country.get("cca2") and currencies:
+                countries.append({
+                    "code": country["cca2"],
+                    "name": country["name"]["common"],
+                    "currency": currencies[0]
+                })
+        return cls(countries)
+
+    def get(self, country: str) -> Optional[Dict[str, str]]:
+        return self._by_code.get(country.upper()) or self._by_name.get(country.lower())
+
+    def currency_for(self, country: str, default: str = "USD") -> str:
+        entry = self.get(country)
+        return entry["currency"] if entry else default
+
+country_index = CountryIndex.from_file(COUNTRIES_DATA_PATH)
+
+async def refresh_country_index_periodically():
+    """Background refresh of the country index; never runs on the request path."""
+    global country_index
+    interval = COUNTRIES_REFRESH_INTERVAL_HOURS * 3600
+    async with httpx.AsyncClient(timeout=30) as http:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                response = await http.get(COUNTRIES_REFRESH_URL)
+                response.raise_for_status()
+                refreshed = CountryIndex.from_restcountries(response.json())
+                if refreshed.countries:
+                    country_index = refreshed
+                    logging.info(f"Country index refreshed ({len(refreshed.countries)} countries)")
+            except Exception as e:
+                logging.warning(f"Country index refresh failed, keeping current data: {str(e)}")
+
+# Receipt Storage
+# Receipts are stored once per distinct content, named by their SHA-256.
+# Uploads are streamed in chunks into a temporary blob while hashing and
+# then published under the hash; an upload whose hash already exists is
+# dropped, so identical receipts share one blob.
+class BlobInfo(BaseModel):
+    sha256: str
+    size: int
+
+class BytesReader:
+    """Async read(size) over in-memory bytes, so derived files can be saved like uploads."""
+    
+    def __init__(self, data: bytes):
+        self._buffer = io.BytesIO(data)
+    
+    async def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+# Receipts are served back on the app's origin, so their type comes from the
+# file's leading bytes, never from the uploader's Content-Type: only images and
+# PDFs are accepted, and anything else is served as an opaque download.
+RECEIPT_CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/tiff": ".tiff",
+    "image/heic": ".heic",
+    "application/pdf": ".pdf"
+}
+RECEIPT_SNIFF_BYTES = 16
+
+def sniff_receipt_content_type(head: bytes) -> Optional[str]:
+    """Content type of a receipt from its first RECEIPT_SNIFF_BYTES bytes, or None if unsupported."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    return None
+
+class LocalBlobStore:
+    """Blobs as files under root/ab/cd/<sha256>."""
+    
+    def __init__(self, root: Path):
+        self.root = root
+    
+    def path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+    
+    async def save(self, upload: UploadFile) -> BlobInfo:
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = tmp_dir / f"{uuid.uuid4()}.upload"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as blob_file:
+                while chunk := await upload.read(RECEIPT_UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await blob_file.write(chunk)
+            sha256 = digest.hexdigest()
+            target = self.path(sha256)
+            if target.exists():
+                return BlobInfo(sha256=sha256, size=size)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            await aiofiles.os.replace(tmp_path, target)
+            return BlobInfo(sha256=sha256, size=size)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    
+    async def size(self, sha256: str) -> Optional[int]:
+        try:
+            return (await aiofiles.os.stat(self.path(sha256))).st_size
+        except FileNotFoundError:
+            return None
+    
+    async def read_range(self, sha256: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Yield bytes start..end (inclusive) in chunks."""
+        async with aiofiles.open(self.path(sha256), "rb") as blob_file:
+            await blob_file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await blob_file.read(min(RECEIPT_UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    
+    @asynccontextmanager
+    async def local_path(self, sha256: str):
+        yield str(self.path(sha256))
+
+class GridFSBlobStore:
+    """Blobs in the receipts GridFS bucket, one file per hash named by the hash."""
+    
+    bucket_name = "receipts"
+    
+    def bucket(self) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(db, bucket_name=self.bucket_name)
+    
+    async def save(self, upload: UploadFile) -> BlobInfo:
+        bucket = self.bucket()
+        digest = hashlib.sha256()
+        size = 0
+        grid_in = bucket.open_upload_stream(f"tmp-{uuid.uuid4()}")
+        try:
+            while chunk := await upload.read(RECEIPT_UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                await grid_in.write(chunk)
+            await grid_in.close()
+        except Exception:
+            await grid_in.abort()
+            raise
+        
+        sha256 = digest.hexdigest()
+        existing = await bucket.find({"filename": sha256}, limit=1).to_list(1)
+        if existing:
+            await bucket.delete(grid_in._id)
+        else:
+            await bucket.rename(grid_in._id, sha256)
+        return BlobInfo(sha256=sha256, size=size)
+    
+    async def size(self, sha256: str) -> Optional[int]:
+        files = await self.bucket().find({"filename": sha256}, limit=1).to_list(1)
+        return files[0].length if files else None
+    
+    async def read_range(self, sha256: str, start: int, end: int) -> AsyncIterator[bytes]:
+        grid_out = await self.bucket().open_download_stream_by_name(sha256)
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(RECEIPT_UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    
+    @asynccontextmanager
+    async def local_path(self, sha256: str):
+        """Materialize the blob in a temp file for consumers that need a path (OCR)."""
+        with tempfile.NamedTemporaryFile(suffix=".receipt", delete=False) as temp_file:
+            temp_path = temp_file.name
+        try:
+            async with aiofiles.open(temp_path, "wb") as out:
+                size = await self.size(sha256)
+                async for chunk in self.read_range(sha256, 0, size - 1):
+                    await out.write(chunk)
+            yield temp_path
+        finally:
+            os.unlink(temp_path)
+
+# Receipt Preprocessing
+# Phone photos are EXIF-oriented, downscaled and recompressed into a "preview"
+# used for OCR and the approvals UI, plus a small "thumbnail". Both are stored
+# as blobs next to the original; receipt_variants maps the original's hash to
+# theirs so duplicate uploads reuse them.
+def _preprocess_receipt_image(image_path: str, preview_max_side: int, preview_quality: int,
+                              thumbnail_max_side: int) -> Optional[Dict[str, Any]]:
+    """CPU-bound; runs in the preprocessing process pool. Returns None for non-images."""
+    try:
+        with Image.open(image_path) as original:
+            image = ImageOps.exif_transpose(original)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            original_size = image.size
+            
+            image.thumbnail((preview_max_side, preview_max_side), Image.LANCZOS)
+            preview = io.BytesIO()
+            image.save(preview, format="JPEG", quality=preview_quality, optimize=True)
+            preview_size = image.size
+            
+            image.thumbnail((thumbnail_max_side, thumbnail_max_side), Image.LANCZOS)
+            thumbnail = io.BytesIO()
+            image.save(thumbnail, format="JPEG", quality=75, optimize=True)
+    except (UnidentifiedImageError, OSError):
+        return None
+    return {
+        "preview": preview.getvalue(),
+        "thumbnail": thumbnail.getvalue(),
+        "original_dimensions": list(original_size),
+        "preview_dimensions": list(preview_size)
+    }
+
+class ReceiptPreprocessor:
+    """Runs _preprocess_receipt_image on a process pool so the event loop stays free."""
+    
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.processed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+    
+    async def preprocess(self, image_path: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), _preprocess_receipt_image, image_path,
+            RECEIPT_PREVIEW_MAX_SIDE, RECEIPT_PREVIEW_JPEG_QUALITY, RECEIPT_THUMBNAIL_MAX_SIDE
+        )
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "original_bytes": self.bytes_in,
+            "preview_bytes": self.bytes_out
+        }
+
+receipt_preprocessor = ReceiptPreprocessor(workers=RECEIPT_PREPROCESS_WORKERS)
+
+async def get_receipt_variants(sha256: str) -> Dict[str, str]:
+    """Preview/thumbnail blob hashes for a receipt, generating and storing them on first use."""
+    known = await db.receipt_variants.find_one({"_id": sha256})
+    if known:
+        return known["variants"]
+    
+    async with receipt_store.local_path(sha256) as image_path:
+        derived = await receipt_preprocessor.preprocess(image_path)
+    if derived is None:
+        # Not an image Pillow can read (e.g. a PDF); OCR gets the original
+        receipt_preprocessor.skipped += 1
+        variants = {}
+    else:
+        variants = {}
+        for name in ("preview", "thumbnail"):
+            blob = await receipt_store.save(BytesReader(derived[name]))
+            variants[name] = blob.sha256
+        receipt_preprocessor.processed += 1
+        receipt_preprocessor.bytes_in += await receipt_store.size(sha256) or 0
+        receipt_preprocessor.bytes_out += len(derived["preview"])
+    
+    await db.receipt_variants.update_one(
+        {"_id": sha256},
+        {"$set": {
+            "variants": variants,
+            "original_dimensions": derived and derived["original_dimensions"],
+            "preview_dimensions": derived and derived["preview_dimensions"],
+            "created_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+    return variants
+
+def build_receipt_store():
+    if RECEIPT_STORE_BACKEND == "gridfs":
+        return GridFSBlobStore()
+    return LocalBlobStore(RECEIPT_STORE_DIR)
+
+receipt_store = build_receipt_store()
+
+# Receipt OCR
+# Uploads are stored in the receipt store and queued as ocr_jobs documents; a pool of
+# asyncio workers claims jobs with a lease, runs the OCR backend, and creates
+# the expense when extraction succeeds. Failed attempts are retried with
+# exponential backoff up to OCR_MAX_ATTEMPTS.
+OCR_PROMPT = """Extract the following information from this receipt image and return as JSON:
+            {
+                "amount": <total amount as float>,
+                "date": <date in YYYY-MM-DD format>,
+                "merchant_name": <restaurant/store name>,
+                "description": <brief description of purchase>,
+                "category": <expense category like 'meals', 'travel', 'office supplies', etc>
+            }
+            Return only valid JSON without any additional text."""
+
+def parse_ocr_response(response: str) -> dict:
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError:
+        # Try to extract JSON from response if wrapped in other text
+        import re
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+        raise ValueError("Could not parse JSON from OCR response")
+
+OCR_PROMPT_VERSION = hashlib.sha256(OCR_PROMPT.encode()).hexdigest()[:12]
+
+class LlmOcrBackend:
+    """Receipt OCR through the LLM chat integration."""
+    
+    model_version = "openai/gpt-4o"
+    
+    async def extract(self, image_path: str, mime_type: str) -> dict:
+        chat = LlmChat(
+            api_key=os.environ.get("EMERGENT_LLM_KEY"),
+            session_id=f"receipt_ocr_{uuid.uuid4()}",
+            system_message="You are an OCR assistant that extracts expense information from receipt images."
+        ).with_model("openai", "gpt-4o")
+        
+        user_message = UserMessage(
+            text=OCR_PROMPT,
+            file_contents=[FileContentWithMimeType(file_path=image_path, mime_type=mime_type)]
+        )
+        response = await chat.send_message(user_message)
+        return parse_ocr_response(response)
+
+class FakeOcrBackend:
+    """
+    Offline OCR stand-in: derives a stable extraction from the file bytes so
+    the same receipt always yields the same result.
+    """
+    
+    model_version = "fake/1"
+    
+    def __init__(self, latency_seconds: float = 0.0):
+        self.latency_seconds = latency_seconds
+    
+    async def extract(self, image_path: str, mime_type: str) -> dict:
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        async with aiofiles.open(image_path, "rb") as image_file:
+            digest = hashlib.sha256(await image_file.read()).hexdigest()
+        seed = int(digest[:8], 16)
+        category = ["meals", "travel", "office", "general"][seed % 4]
+        return {
+            "amount": round(5 + (seed % 50000) / 100, 2),
+            "date": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            "merchant_name": f"Merchant {digest[:6].upper()}",
+            "description": f"{category.title()} receipt",
+            "category": category
+        }
+
+def build_ocr_backend():
+    if OCR_BACKEND == "llm":
+        return LlmOcrBackend()
+    return FakeOcrBackend(latency_seconds=OCR_FAKE_LATENCY_SECONDS)
+
+ocr_backend = build_ocr_backend()
+
+class OcrResultCache:
+    """
+    OCR results in the ocr_results collection, keyed by the receipt's SHA-256
+    and the OCR model/prompt version so a backend or prompt change never serves
+    stale extractions. last_used_at is bumped on every hit; a TTL index on it
+    expires idle entries and inserts trim the least recently used ones beyond
+    max_entries.
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def key(sha256: str) -> str:
+        return f"{sha256}:{ocr_backend.model_version}:{OCR_PROMPT_VERSION}"
+    
+    async def get(self, sha256: str, track: bool = True) -> Optional[dict]:
+        """Cached OCR data for a receipt hash; track=False skips the hit/miss counters."""
+        entry = await db.ocr_results.find_one_and_update(
+            {"_id": self.key(sha256)},
+            {"$set": {"last_used_at": datetime.now(timezone.utc)}, "$inc": {"hits": 1}},
+            projection={"ocr_data": 1}
+        )
+        if entry is None:
+            self.misses += track
+            return None
+        self.hits += track
+        return entry["ocr_data"]
+    
+    async def set(self, sha256: str, ocr_data: dict):
+        now = datetime.now(timezone.utc)
+        await db.ocr_results.update_one(
+            {"_id": self.key(sha256)},
+            {
+                "$set": {"ocr_data": ocr_data, "last_used_at": now},
+                "$setOnInsert": {
+                    "sha256": sha256,
+                    "model_version": ocr_backend.model_version,
+                    "prompt_version": OCR_PROMPT_VERSION,
+                    "hits": 0,
+                    "created_at": now
+                }
+            },
+            upsert=True
+        )
+        await self._trim()
+    
+    async def _trim(self):
+        overflow = await db.ocr_results.estimated_document_count() - self.max_entries
+        if overflow <= 0:
+            return
+        oldest = await db.ocr_results.find({}, {"_id": 1}).sort("last_used_at", ASCENDING).limit(overflow).to_list(None)
+        result = await db.ocr_results.delete_many({"_id": {"$in": [entry["_id"] for entry in oldest]}})
+        self.evictions += result.deleted_count
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "max_entries": self.max_entries,
+            "ttl_seconds": OCR_CACHE_TTL_SECONDS,
+            "model_version": ocr_backend.model_version,
+            "prompt_version": OCR_PROMPT_VERSION
+        }
+
+ocr_result_cache = OcrResultCache(max_entries=OCR_CACHE_MAX_ENTRIES)
+
+def new_receipt_job(
+    user: User,
+    receipt_sha256: str,
+    content_type: str,
+    overrides: Dict[str, Any]
+) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": OCR_MAX_ATTEMPTS,
+        "employee_id": user.id,
+        "company_id": user.company_id,
+        "receipt_sha256": receipt_sha256,
+        "content_type": content_type,
+        "overrides": overrides,
+        # Reserved up front so a retried job never creates a second expense
+        "expense_id": str(uuid.uuid4()),
+        "ocr_data": None,
+        "cached": False,
+        "error": None,
+        "run_after": now,
+        "lease_expires_at": None,
+        "created_at": now,
+        "updated_at": now
+    }
+
+async def enqueue_receipt_job(job: dict) -> dict:
+    await db.ocr_jobs.insert_one(job)
+    job.pop("_id", None)
+    ocr_worker_pool.notify()
+    return job
+
+async def complete_receipt_job_from_cache(job: dict, ocr_data: dict) -> dict:
+    """Record a job that was answered from the OCR cache and create its expense now."""
+    job.update({"status": "succeeded", "ocr_data": ocr_data, "cached": True})
+    await db.ocr_jobs.insert_one(job)
+    job.pop("_id", None)
+    return await create_expense_from_receipt_job(job, ocr_data)
+
+async def claim_ocr_job() -> Optional[dict]:
+    """Lease the oldest runnable job: queued and due, or running with an expired lease."""
+    now = datetime.now(timezone.utc)
+    return await db.ocr_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "run_after": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "lease_expires_at": now + timedelta(seconds=OCR_JOB_LEASE_SECONDS),
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("run_after", ASCENDING)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def find_duplicate_receipts(company_id: str, receipt_sha256: str, exclude_id: str) -> List[str]:
+    """Expense ids in the company that were submitted with the same receipt bytes."""
+    duplicates = await db.expenses.find(
+        {"company_id": company_id, "receipt_sha256": receipt_sha256, "id": {"$ne": exclude_id}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+    return [expense["id"] for expense in duplicates]
+
+async def create_expense_from_receipt_job(job: dict, ocr_data: dict) -> dict:
+    overrides = job.get("overrides") or {}
+    receipt_sha256 = job.get("receipt_sha256")
+    duplicates = await find_duplicate_receipts(job["company_id"], receipt_sha256, job["expense_id"]) if receipt_sha256 else []
+    # Form data takes priority over OCR data
+    expense = Expense(
+        id=job["expense_id"],
+        employee_id=job["employee_id"],
+        company_id=job["company_id"],
+        # The chain may have changed while the job was queued
+        **await get_owner_chain(job["employee_id"]),
+        amount=overrides.get("amount") or ocr_data.get("amount", 0.0),
+        category=overrides.get("category") or ocr_data.get("category", "general"),
+        description=overrides.get("description") or ocr_data.get("description", "Receipt upload"),
+        merchant=ocr_data.get("merchant_name"),
+        date=datetime.now(timezone.utc),
+        currency="USD",  # Default for now
+        receipt_url=f"/api/expenses/{job['expense_id']}/receipt",
+        receipt_sha256=receipt_sha256,
+        receipt_content_type=job["content_type"],
+        receipt_variants=await get_receipt_variants(receipt_sha256) if receipt_sha256 else {},
+        possible_duplicate_of=duplicates
+    )
+    expense_doc = expense.dict()
+    try:
+        await db.expenses.insert_one(expense_doc)
+    except DuplicateKeyError:
+        # A previous attempt already created it before its lease expired
+        return expense.dict()
+    await record_expense_rollup(expense_doc, None, expense.status)
+    await bump_data_versions(expense.company_id, [expense.employee_id])
+    publish_expense_events("expense.created", [expense_doc])
+    return expense.dict()
+
+async def run_ocr_job(job: dict):
+    try:
+        # Another job may have cached this receipt while this one was queued
+        ocr_data = await ocr_result_cache.get(job["receipt_sha256"], track=False)
+        if ocr_data is None:
+            variants = await get_receipt_variants(job["receipt_sha256"])
+            if "preview" in variants:
+                ocr_blob, ocr_content_type = variants["preview"], "image/jpeg"
+            else:
+                ocr_blob, ocr_content_type = job["receipt_sha256"], job["content_type"]
+            async with receipt_store.local_path(ocr_blob) as image_path:
+                ocr_data = await ocr_backend.extract(image_path, ocr_content_type)
+            await ocr_result_cache.set(job["receipt_sha256"], ocr_data)
+        await create_expense_from_receipt_job(job, ocr_data)
+    except Exception as e:
+        final = job["attempts"] >= job["max_attempts"]
+        logging.warning(f"OCR job {job['id']} attempt {job['attempts']} failed: {str(e)}")
+        update = {"error": str(e), "lease_expires_at": None, "updated_at": datetime.now(timezone.utc)}
+        if final:
+            update["status"] = "failed"
+        else:
+            update["status"] = "queued"
+            update["run_after"] = datetime.now(timezone.utc) + timedelta(
+                seconds=OCR_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+            )
+        await db.ocr_jobs.update_one({"id": job["id"]}, {"$set": update})
+        return
+    
+    await db.ocr_jobs.update_one({"id": job["id"]}, {"$set": {
+        "status": "succeeded",
+        "ocr_data": ocr_data,
+        "error": None,
+        "lease_expires_at": None,
+        "updated_at": datetime.now(timezone.utc)
+    }})
+
+class OcrWorkerPool:
+    """
+    Fixed number of asyncio workers draining ocr_jobs. Enqueueing wakes idle
+    workers; otherwise they poll so retries and expired leases are picked up.
+    """
+    
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.errors = 0
+    
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def notify(self):
+        self._wakeup.set()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": len(self._tasks),
+            "processed": self.processed,
+            "errors": self.errors
+        }
+    
+    async def _work(self):
+        while True:
+            try:
+                job = await claim_ocr_job()
+                if job:
+                    await run_ocr_job(job)
+                    self.processed += 1
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"OCR worker error: {str(e)}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+ocr_worker_pool = OcrWorkerPool(workers=OCR_WORKERS, poll_interval=OCR_POLL_INTERVAL_SECONDS)
+
+# Expense Rollups
+# expense_rollups holds one document per (company_id, employee_id, status, month, currency)
+# with the count and amount sum of matching expenses, plus the owner's manager_id and
+# ancestor_ids so the same visibility filter as expenses applies. Writers keep it current with $inc.
+ROLLUP_KEY_FIELDS = ("company_id", "employee_id", "status", "month", "currency")
+
+def rollup_month(date: datetime) -> str:
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return date.strftime("%Y-%m")
+
+def rollup_key(expense: dict, status_name: str) -> dict:
+    return {
+        "company_id": expense.get("company_id"),
+        "employee_id": expense["employee_id"],
+        "status": status_name,
+        "month": rollup_month(expense["date"]),
+        "currency": expense.get("currency") or "USD"
+    }
+
+async def apply_rollup_transitions(transitions: List[Tuple[dict, Optional[str], Optional[str]]]):
+    """
+    Move expenses between rollup buckets. Each transition is (expense, old_status,
+    new_status); old_status is None for a new expense. Changes are merged into one
+    $inc per bucket and sent in a single bulk_write. Failures are logged, not raised;
+    the expense writes have already happened and `python server.py rollups-rebuild`
+    repairs drift.
+    """
+    buckets: Dict[tuple, Dict[str, Any]] = {}
+    for expense, old_status, new_status in transitions:
+        if old_status == new_status:
+            continue
+        for status_name, sign in ((old_status, -1), (new_status, 1)):
+            if status_name is None:
+                continue
+            key = rollup_key(expense, status_name)
+            bucket = buckets.setdefault(tuple(key.values()), {
+                "filter": key, "count": 0, "amount": 0.0,
+                "owner": {"manager_id": expense.get("manager_id"), "ancestor_ids": expense.get("ancestor_ids") or []}
+            })
+            bucket["count"] += sign
+            bucket["amount"] += sign * expense["amount"]
+    
+    operations = [
+        UpdateOne(
+            bucket["filter"],
+            {"$inc": {"count": bucket["count"], "amount": bucket["amount"]},
+             "$set": bucket["owner"]},
+            upsert=True
+        )
+        for bucket in buckets.values()
+    ]
+    if not operations:
+        return
+    try:
+        await db.expense_rollups.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logging.error(f"Rollup update for {len(transitions)} expenses failed: {str(e)}")
+
+async def record_expense_rollup(expense: dict, old_status: Optional[str], new_status: Optional[str]):
+    await apply_rollup_transitions([(expense, old_status, new_status)])
+
+async def record_new_expense_rollups(expenses: List[dict]):
+    await apply_rollup_transitions([(expense, None, expense["status"]) for expense in expenses])
+
+def rollup_rebuild_pipeline() -> List[dict]:
+    """Recompute every rollup document from the expenses collection."""
+    return [
+        {"$group": {
+            "_id": {
+                "company_id": "$company_id",
+                "employee_id": "$employee_id",
+                "status": "$status",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+                "currency": {"$ifNull": ["$currency", "USD"]}
+            },
+            "count": {"$sum": 1},
+            "amount": {"$sum": "$amount"},
+            "manager_id": {"$last": "$manager_id"},
+            "ancestor_ids": {"$last": {"$ifNull": ["$ancestor_ids", []]}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "company_id": "$_id.company_id",
+            "employee_id": "$_id.employee_id",
+            "status": "$_id.status",
+            "month": "$_id.month",
+            "currency": "$_id.currency",
+            "count": 1,
+            "amount": 1,
+            "manager_id": 1,
+            "ancestor_ids": 1
+        }}
+    ]
+
+async def rebuild_expense_rollups():
+    """
+    Replace expense_rollups with a fresh computation ($out swaps it in atomically).
+    Expense writes made while the aggregation runs are lost in the swap, so stop
+    writers first. Migrations 3 and 4 call it during startup, before the worker
+    serves requests; deploys that apply them should stop the old workers first.
+    """
+    await db.expenses.aggregate(rollup_rebuild_pipeline() + [{"$out": "expense_rollups"}]).to_list(None)
+    await db.expense_rollups.create_indexes(REQUIRED_INDEXES["expense_rollups"])
+
+async def recount_rollup_bucket(key: dict) -> Tuple[dict, dict]:
+    """Expected and stored totals of one rollup bucket, read back to back."""
+    start = datetime.strptime(key["month"], "%Y-%m").replace(tzinfo=timezone.utc)
+    end = (start + timedelta(days=32)).replace(day=1)
+    currency = [key["currency"], None] if key["currency"] == "USD" else [key["currency"]]
+    result = await db.expenses.aggregate([
+        {"$match": {
+            "company_id": key["company_id"], "employee_id": key["employee_id"], "status": key["status"],
+            "date": {"$gte": start, "$lt": end}, "currency": {"$in": currency}
+        }},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    stored = await db.expense_rollups.find_one(key, {"_id": 0, "count": 1, "amount": 1})
+    return (result[0] if result else {"count": 0, "amount": 0}), (stored or {"count": 0, "amount": 0})
+
+async def verify_expense_rollups(tolerance: float = 0.01) -> Dict[str, Any]:
+    """
+    Compare expense_rollups with a fresh computation and list every drifted bucket,
+    and every bucket whose manager_id/ancestor_ids differ from its owner's current
+    chain (those drop out of managers' stats; `backfill-expenses` re-stamps them).
+    The full pass and the rollup read are not one snapshot, so writes landing in
+    between look like drift; each suspect bucket is rechecked on its own and only
+    reported if it is still off.
+    """
+    def key_of(doc: dict) -> tuple:
+        return tuple(doc.get(field) for field in ROLLUP_KEY_FIELDS)
+    
+    def drifted(want: dict, have: dict) -> bool:
+        return want["count"] != have["count"] or abs(want["amount"] - have["amount"]) > tolerance
+    
+    def chain_of(doc: dict) -> dict:
+        return {"manager_id": doc.get("manager_id"), "ancestor_ids": doc.get("ancestor_ids") or []}
+    
+    expected = {key_of(doc): doc async for doc in db.expenses.aggregate(rollup_rebuild_pipeline())}
+    actual = {key_of(doc): doc async for doc in db.expense_rollups.find({}, {"_id": 0})}
+    
+    drift = []
+    for key in expected.keys() | actual.keys():
+        want = expected.get(key, {"count": 0, "amount": 0})
+        have = actual.get(key, {"count": 0, "amount": 0})
+        if drifted(want, have):
+            want, have = await recount_rollup_bucket(dict(zip(ROLLUP_KEY_FIELDS, key)))
+        if drifted(want, have):
+            drift.append({
+                **dict(zip(ROLLUP_KEY_FIELDS, key)),
+                "expected": {"count": want["count"], "amount": want["amount"]},
+                "actual": {"count": have["count"], "amount": have["amount"]}
+            })
+    
+    owners = db.users.find(
+        {"id": {"$in": list({doc["employee_id"] for doc in actual.values()})}},
+        {"_id": 0, "id": 1, "manager_id": 1, "ancestor_ids": 1}
+    )
+    chains = {owner["id"]: chain_of(owner) async for owner in owners}
+    chain_drift = []
+    for key, doc in actual.items():
+        if doc["employee_id"] not in chains or chain_of(doc) == chains[doc["employee_id"]]:
+            continue
+        # A reparent saves users before rollups; re-read both before reporting
+        bucket = dict(zip(ROLLUP_KEY_FIELDS, key))
+        want = await get_owner_chain(doc["employee_id"])
+        have = chain_of(await db.expense_rollups.find_one(bucket, {"_id": 0, "manager_id": 1, "ancestor_ids": 1}) or want)
+        if have != want:
+            chain_drift.append({**bucket, "expected": want, "actual": have})
+    return {
+        "buckets": len(expected), "drifted": len(drift), "drift": drift,
+        "stale_chains": len(chain_drift), "chain_drift": chain_drift
+    }
+
+# Database Indexes & Migrations
+# Declared indexes, ensured idempotently on startup and checked by `python server.py index-report`.
+REQUIRED_INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("company_id", ASCENDING), ("manager_id", ASCENDING), ("is_active", ASCENDING)],
+            name="company_manager_active"
+        ),
+        IndexModel([("company_id", ASCENDING), ("ancestor_ids", ASCENDING)], name="company_ancestors"),
+    ],
+    "companies": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "expenses": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("employee_id", ASCENDING), ("status", ASCENDING), ("date", DESCENDING)],
+            name="employee_status_date"
+        ),
+        IndexModel(
+            [("company_id", ASCENDING), ("status", ASCENDING), ("date", DESCENDING)],
+            name="company_status_date"
+        ),
+        IndexModel(
+            [("company_id", ASCENDING), ("manager_id", ASCENDING), ("status", ASCENDING), ("date", DESCENDING)],
+            name="company_manager_status_date"
+        ),
+        IndexModel(
+            [("company_id", ASCENDING), ("ancestor_ids", ASCENDING), ("status", ASCENDING), ("date", DESCENDING)],
+            name="company_ancestors_status_date"
+        ),
+        IndexModel([("company_id", ASCENDING), ("receipt_sha256", ASCENDING)], name="company_receipt_sha256", sparse=True),
+        # Full-text search, prefixed by company so a search only walks its own tenant's postings
+        IndexModel(
+            [("company_id", ASCENDING), ("merchant", TEXT), ("description", TEXT), ("category", TEXT)],
+            name="company_text_search",
+            weights={"merchant": 10, "description": 5, "category": 2}
+        ),
+    ],
+    "currency_rates": [
+        IndexModel([("base", ASCENDING)], name="base_unique", unique=True),
+    ],
+    "ocr_results": [
+        IndexModel([("last_used_at", ASCENDING)], name="last_used_ttl", expireAfterSeconds=OCR_CACHE_TTL_SECONDS),
+    ],
+    "ocr_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("run_after", ASCENDING)], name="status_run_after"),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease"),
+    ],
+    "expense_rollups": [
+        IndexModel([(field, ASCENDING) for field in ROLLUP_KEY_FIELDS], name="rollup_key_unique", unique=True),
+        IndexModel([("company_id", ASCENDING), ("manager_id", ASCENDING)], name="company_manager"),
+        IndexModel([("company_id", ASCENDING), ("ancestor_ids", ASCENDING)], name="company_ancestors"),
+    ],
+}
+
+async def ensure_indexes():
+    """Create any declared index that is missing. Safe to run on every startup."""
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            logging.error(f"Could not ensure indexes on {collection_name}: {str(e)}")
+
+async def migration_0001_backfill_user_active_flag():
+    """Self-registered users were stored without is_active; team queries filter on it."""
+    await db.users.update_many({"is_active": {"$exists": False}}, {"$set": {"is_active": True}})
+
+async def backfill_expense_ownership() -> int:
+    """
+    Stamp every expense with its owner's current company_id, manager_id and
+    ancestor_ids. Returns the number of expenses changed. Safe to re-run to repair drift.
+    """
+    modified = 0
+    users = db.users.find({}, {"_id": 0, "id": 1, "company_id": 1, "manager_id": 1, "ancestor_ids": 1})
+    async for user in users:
+        owner = {
+            "company_id": user.get("company_id"),
+            "manager_id": user.get("manager_id"),
+            "ancestor_ids": user.get("ancestor_ids") or []
+        }
+        result = await db.expenses.update_many(
+            {"employee_id": user["id"], "$or": [{key: {"$ne": value}} for key, value in owner.items()]},
+            {"$set": owner}
+        )
+        modified += result.modified_count
+        chain = {key: owner[key] for key in ("manager_id", "ancestor_ids")}
+        await db.expense_rollups.update_many(
+            {"employee_id": user["id"], "$or": [{key: {"$ne": value}} for key, value in chain.items()]},
+            {"$set": chain}
+        )
+    if modified:
+        await db.companies.update_many({}, {"$inc": {"data_version": 1}})
+        await db.users.update_many({}, {"$inc": {"data_version": 1}})
+    return modified
+
+async def migration_0002_denormalize_expense_ownership():
+    """Expenses carry company_id/manager_id so visibility is an indexed equality match."""
+    await backfill_expense_ownership()
+
+async def migration_0003_build_expense_rollups():
+    """Dashboard stats read from expense_rollups; seed it from existing expenses."""
+    await rebuild_expense_rollups()
+
+async def rebuild_org_paths() -> int:
+    """
+    Recompute ancestor_ids for every user from manager_id, company by company.
+    Returns the number of users changed. Safe to re-run to repair drift.
+    """
+    modified = 0
+    for company_id in await db.users.distinct("company_id"):
+        users = await db.users.find(
+            {"company_id": company_id},
+            {"_id": 0, "id": 1, "manager_id": 1, "ancestor_ids": 1}
+        ).to_list(None)
+        ancestors = compute_company_ancestors(users)
+        operations = [
+            UpdateOne({"id": user["id"]}, {"$set": {"ancestor_ids": ancestors[user["id"]]}})
+            for user in users if user.get("ancestor_ids") != ancestors[user["id"]]
+        ]
+        if operations:
+            result = await db.users.bulk_write(operations, ordered=False)
+            modified += result.modified_count
+            await bump_org_version(company_id)
+    return modified
+
+async def migration_0004_materialize_org_paths():
+    """Users, expenses and rollups carry ancestor_ids so managers see their whole subtree."""
+    await rebuild_org_paths()
+    await backfill_expense_ownership()
+    await rebuild_expense_rollups()
+
+async def migration_0005_backfill_expense_merchants():
+    """Copy the OCR merchant name onto receipt expenses created before expenses stored it."""
+    cursor = db.ocr_jobs.find(
+        {"status": "succeeded", "ocr_data.merchant_name": {"$nin": [None, ""]}},
+        {"_id": 0, "expense_id": 1, "ocr_data.merchant_name": 1}
+    )
+    operations = []
+    modified = 0
+    async for job in cursor:
+        operations.append(UpdateOne(
+            {"id": job["expense_id"], "merchant": None},
+            {"$set": {"merchant": job["ocr_data"]["merchant_name"]}}
+        ))
+        if len(operations) >= 1000:
+            modified += (await db.expenses.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        modified += (await db.expenses.bulk_write(operations, ordered=False)).modified_count
+    if modified:
+        # Cached search responses may now be missing matches
+        await db.companies.update_many({}, {"$inc": {"data_version": 1}})
+        await db.users.update_many({}, {"$inc": {"data_version": 1}})
+
+# Versioned migrations, applied in order and recorded in schema_migrations.
+# Append new entries; never renumber or edit one that has shipped.
+MIGRATIONS = [
+    (1, "backfill_user_active_flag", migration_0001_backfill_user_active_flag),
+    (2, "denormalize_expense_ownership", migration_0002_denormalize_expense_ownership),
+    (3, "build_expense_rollups", migration_0003_build_expense_rollups),
+    (4, "materialize_org_paths", migration_0004_materialize_org_paths),
+    (5, "backfill_expense_merchants", migration_0005_backfill_expense_merchants),
+]
+
+async def claim_migration(version: int, name: str) -> bool:
+    """
+    Claim a migration version for this worker. A claim left behind by a worker
+    that stopped heartbeating (crashed mid-migration) is taken over.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.schema_migrations.insert_one({
+            "_id": version,
+            "name": name,
+            "started_at": now,
+            "heartbeat_at": now,
+            "applied_at": None
+        })
+        return True
+    except DuplicateKeyError:
+        pass
+    
+    cutoff = now - timedelta(seconds=MIGRATION_CLAIM_TIMEOUT_SECONDS)
+    result = await db.schema_migrations.update_one(
+        {"_id": version, "applied_at": None, "$or": [
+            {"heartbeat_at": {"$lt": cutoff}},
+            {"heartbeat_at": {"$exists": False}, "started_at": {"$lt": cutoff}}
+        ]},
+        {"$set": {"name": name, "started_at": now, "heartbeat_at": now}}
+    )
+    if result.modified_count:
+        logging.warning(f"Took over stale claim on migration {version} ({name})")
+    return result.modified_count == 1
+
+async def heartbeat_migration(version: int):
+    """Keep a running migration's claim fresh so other workers wait instead of taking it over."""
+    while True:
+        await asyncio.sleep(MIGRATION_CLAIM_TIMEOUT_SECONDS / 3)
+        await db.schema_migrations.update_one(
+            {"_id": version, "applied_at": None},
+            {"$set": {"heartbeat_at": datetime.now(timezone.utc)}}
+        )
+
+async def run_migrations() -> List[int]:
+    """
+    Apply pending migrations in version order. Returns the versions applied.
+    A version another worker is running is waited for, never skipped, so later
+    migrations (and this worker's requests) only start once it has finished.
+    """
+    newly_applied = []
+    
+    for version, name, migration in MIGRATIONS:
+        claim = await db.schema_migrations.find_one({"_id": version})
+        while not (claim and claim.get("applied_at")) and not await claim_migration(version, name):
+            logging.info(f"Waiting for another worker to finish migration {version} ({name})")
+            await asyncio.sleep(MIGRATION_POLL_SECONDS)
+            claim = await db.schema_migrations.find_one({"_id": version})
+        if claim and claim.get("applied_at"):
+            continue
+        
+        heartbeat = asyncio.create_task(heartbeat_migration(version))
+        try:
+            await migration()
+        except Exception as e:
+            await db.schema_migrations.delete_one({"_id": version})
+            logging.error(f"Migration {version} ({name}) failed, later migrations skipped: {str(e)}")
+            break
+        finally:
+            heartbeat.cancel()
+        
+        await db.schema_migrations.update_one(
+            {"_id": version},
+            {"$set": {"applied_at": datetime.now(timezone.utc)}}
+        )
+        logging.info(f"Applied migration {version} ({name})")
+        newly_applied.append(version)
+    
+    return newly_applied
+
+async def get_index_report() -> Dict[str, Any]:
+    """
+    Compare declared indexes with what exists. Reports missing declared indexes,
+    existing indexes nobody declared, and indexes with no recorded use since the
+    server last restarted ($indexStats).
+    """
+    report = {}
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        declared = {index.document["name"] for index in indexes}
+        existing = await db[collection_name].index_information()
+        
+        try:
+            usage = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+            unused = sorted(
+                stat["name"] for stat in usage
+                if stat["accesses"]["ops"] == 0 and stat["name"] != "_id_"
+            )
+        except OperationFailure:
+            unused = None  # $indexStats not permitted or not supported
+        
+        report[collection_name] = {
+            "missing": sorted(declared - set(existing)),
+            "undeclared": sorted(set(existing) - declared - {"_id_"}),
+            "unused": unused
+        }
+    
+    applied = await db.schema_migrations.find({"applied_at": {"$ne": None}}).to_list(None)
+    report["migrations"] = {
+        "applied": sorted(doc["_id"] for doc in applied),
+        "pending": [version for version, _, _ in MIGRATIONS if version not in {doc["_id"] for doc in applied}]
+    }
+    return report
+
+# API Routes
+@api_router.post("/auth/register")
+async def register_user(user_data: UserCreate):
+    """Register new user with company isolation checks."""
+    
+    # Check if user already exists (email must be unique globally)
+    existing_user = await db.users.find_one({"email": user_data.email})
+    if existing_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    # Resolve company currency from the bundled country index
+    currency = country_index.currency_for(user_data.country)
+    
+    # Create company (first user becomes admin)
+    company_name = user_data.company_name or f"{user_data.full_name}'s Company"
+    company = Company(
+        name=company_name,
+        currency=currency,
+        country=user_data.country
+    )
+    await db.companies.insert_one(company.dict())
+    
+    # Create user (always admin for new company registration)
+    hashed_password = await password_hasher.hash(user_data.password)
+    user = User(
+        email=user_data.email,
+        full_name=user_data.full_name,
+        role="admin",  # First user is admin
+        company_id=company.id
+    )
+    
+    # Store user with hashed password
+    user_dict = user.dict()
+    user_dict["password"] = hashed_password
+    user_dict["is_active"] = True
+    await db.users.insert_one(user_dict)
+    
+    # Create access token
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.email}, expires_delta=access_token_expires
+    )
+    
+    return {"access_token": access_token, "token_type": "bearer", "user": user}
+
+@api_router.post("/auth/login")
+async def login_user(login_data: UserLogin):
+    """Login user with company information included."""
+    
+    # Find user by email (no company filter needed for login)
+    user_doc = await db.users.find_one({"email": login_data.email})
+    # Admin-created or admin-reset users store "hashed_password", self-registered users "password"
+    stored_hash = (user_doc.get("hashed_password") or user_doc.get("password")) if user_doc else None
+    if not stored_hash or not await password_hasher.verify(login_data.password, stored_hash):
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    
+    user = User(**user_doc)
+    
+    # Verify user's company still exists (additional security)
+    company = await db.companies.find_one({"id": user.company_id})
+    if not company:
+        raise HTTPException(
+            status_code=401, 
+            detail="User's company no longer exists. Contact administrator."
+        )
+    
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.email}, expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer", "user": user}
 
+@api_router.get("/countries")
+async def get_countries(request: Request):
+    """List supported countries with their default currency."""
+    headers = {"Cache-Control": "public, max-age=86400", "ETag": country_index.etag}
+    if request.headers.get("if-none-match") == country_index.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=country_index.payload, media_type="application/json", headers=headers)
+
 @api_router.get("/auth/me", response_model=User)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
@@ -548,70 +3090,455 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 async def create_expense(expense_data: ExpenseCreate, current_user: User = Depends(get_current_user)):
     expense = Expense(
         employee_id=current_user.id,
+        company_id=current_user.company_id,
+        **await get_owner_chain(current_user.id),
         **expense_data.dict()
     )
-    await db.expenses.insert_one(expense.dict())
+    expense_doc = expense.dict()
+    await db.expenses.insert_one(expense_doc)
+    await record_expense_rollup(expense_doc, None, expense.status)
+    await bump_data_versions(current_user.company_id, [current_user.id])
+    publish_expense_events("expense.created", [expense_doc])
     return expense
 
-@api_router.post("/expenses/with-receipt")
+@api_router.post("/expenses/with-receipt", status_code=202)
 async def create_expense_with_receipt(
+    response: Response,
     receipt: UploadFile = File(...),
     amount: Optional[float] = Form(None),
     category: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     current_user: User = Depends(get_current_user)
 ):
-    # Extract data from receipt using OCR
-    ocr_data = await extract_receipt_data(receipt)
-    
-    if "error" in ocr_data:
-        raise HTTPException(status_code=400, detail=f"OCR failed: {ocr_data['error']}")
-    
-    # Use OCR data or form data (form data takes priority)
-    expense_data = {
-        "amount": amount or ocr_data.get("amount", 0.0),
-        "category": category or ocr_data.get("category", "general"),
-        "description": description or ocr_data.get("description", "Receipt upload"),
-        "date": datetime.now(timezone.utc),
-        "currency": "USD"  # Default for now
+    """
+    Queue a receipt for OCR and return the job right away. The expense is
+    created by the OCR worker; poll GET /api/receipt-jobs/{job_id} for it.
+    A receipt already in the OCR cache is answered immediately instead, with
+    status "succeeded" and the created expense. Only images and PDFs are accepted.
+    """
+    content_type = sniff_receipt_content_type(await receipt.read(RECEIPT_SNIFF_BYTES))
+    if content_type is None:
+        raise HTTPException(status_code=415, detail="Receipts must be JPEG, PNG, GIF, WebP, TIFF, HEIC or PDF files")
+    await receipt.seek(0)
+    
+    blob = await receipt_store.save(receipt)
+    overrides = {"amount": amount, "category": category, "description": description}
+    job = new_receipt_job(current_user, blob.sha256, content_type, overrides)
+    
+    ocr_data = await ocr_result_cache.get(blob.sha256)
+    if ocr_data is not None:
+        expense = await complete_receipt_job_from_cache(job, ocr_data)
+        response.status_code = 200
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "expense_id": job["expense_id"],
+            "cached": True,
+            "ocr_data": ocr_data,
+            "expense": expense
+        }
+    
+    await enqueue_receipt_job(job)
+    return {"job_id": job["id"], "status": job["status"], "expense_id": job["expense_id"], "cached": False}
+
+def parse_byte_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=start-end" / "bytes=start-" / "bytes=-suffix" range.
+    Returns None for headers we don't honour (other units, multiple ranges),
+    which means serving the whole file. Unsatisfiable ranges raise 416.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            start, end = max(size - int(end_text), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+@api_router.get("/expenses/{expense_id}/receipt")
+async def get_expense_receipt(
+    expense_id: str,
+    request: Request,
+    variant: str = Query("original", regex="^(original|preview|thumbnail)$"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Serve an expense's receipt, or its downscaled "preview"/"thumbnail", with
+    Range support. Blobs are content-addressed, so the hash is a strong ETag
+    and the response can be cached indefinitely.
+    """
+    expense = await get_company_safe_expense(expense_id, current_user)
+    if not expense or not expense.get("receipt_sha256"):
+        raise HTTPException(status_code=404, detail="Receipt not found or access denied")
+    
+    if variant == "original":
+        sha256 = expense["receipt_sha256"]
+        media_type = expense.get("receipt_content_type")
+        if media_type not in RECEIPT_CONTENT_TYPES:
+            # Stored before uploads were sniffed; never let the browser render it
+            media_type = "application/octet-stream"
+    else:
+        sha256 = (expense.get("receipt_variants") or {}).get(variant)
+        media_type = "image/jpeg"
+        if not sha256:
+            raise HTTPException(status_code=404, detail=f"No {variant} for this receipt")
+    size = await receipt_store.size(sha256)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    
+    etag = f'"{sha256}"'
+    filename = f"receipt-{expense['id']}{RECEIPT_CONTENT_TYPES.get(media_type, '')}"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Disposition": f'inline; filename="{filename}"'
     }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
     
-    expense = Expense(
-        employee_id=current_user.id,
-        **expense_data
-    )
-    await db.expenses.insert_one(expense.dict())
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and size and request.headers.get("if-range", etag) == etag:
+        byte_range = parse_byte_range(range_header, size)
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            receipt_store.read_range(sha256, 0, size - 1) if size else iter(()),
+            media_type=media_type,
+            headers=headers
+        )
     
-    return {"expense": expense, "ocr_data": ocr_data}
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        receipt_store.read_range(sha256, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers=headers
+    )
 
-@api_router.get("/expenses", response_model=List[Expense])
-async def get_expenses(current_user: User = Depends(get_current_user)):
-    """Get expenses based on user role with bulletproof company isolation."""
+@api_router.post("/events/token")
+async def create_event_token(current_user: User = Depends(get_current_user)):
+    """Issue a stream token for GET /api/events?token=, valid for EVENTS_TOKEN_TTL_SECONDS."""
+    return {"token": create_event_stream_token(current_user.email), "expires_in": EVENTS_TOKEN_TTL_SECONDS}
+
+@api_router.get("/events")
+async def stream_events(current_user: User = Depends(get_event_stream_user)):
+    """
+    Server-sent events for expenses the caller can see: expense.created and
+    expense.status_changed, plus "ready" on connect and "resync" when the
+    client fell behind and should refetch. EventSource cannot set headers, so
+    it passes a stream token from POST /events/token as ?token=; the token is
+    only checked on connect.
+    """
+    if not event_broker.has_capacity():
+        raise HTTPException(status_code=503, detail="Too many open event streams, retry later")
+    return StreamingResponse(
+        event_stream(current_user, EVENTS_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/receipt-jobs/{job_id}")
+async def get_receipt_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Status of a receipt OCR job, with the OCR data and expense once it succeeded."""
+    job = await db.ocr_jobs.find_one(
+        {"id": job_id, "employee_id": current_user.id},
+        {"_id": 0, "lease_expires_at": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Receipt job not found")
     
-    # Get user IDs that current user can access (already company-filtered)
-    accessible_user_ids = await get_accessible_user_ids(current_user)
+    expense = None
+    if job["status"] == "succeeded":
+        expense = await db.expenses.find_one({"id": job["expense_id"]}, {"_id": 0})
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "cached": job.get("cached", False),
+        "error": job["error"],
+        "ocr_data": job["ocr_data"],
+        "expense": expense
+    }
+
+@api_router.get("/expenses", response_model=List[Expense], response_class=ORJSONResponse)
+async def get_expenses(
+    request: Request,
+    page: ExpensePageParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get expenses based on user role with bulletproof company isolation.
+    Newest first; the cursor for the next page is returned in X-Next-Cursor.
+    Answers If-None-Match with 304 while the caller's data version is unchanged.
+    """
+    etag = await data_version_etag(request, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
     
-    # Get expenses only from accessible users
-    expenses = await db.expenses.find({
-        "employee_id": {"$in": accessible_user_ids}
-    }).to_list(1000)
+    # Get expenses only from accessible users (company-filtered)
+    expenses, next_cursor = await fetch_expense_page(expense_visibility_query(current_user), page)
     
-    return [Expense(**expense) for expense in expenses]
+    headers = {"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return ORJSONResponse(expenses, headers=headers)
 
-@api_router.get("/expenses/pending", response_model=List[Expense])
-async def get_pending_expenses(current_user: User = Depends(require_role_and_company("admin", "manager"))):
+@api_router.get("/expenses/pending", response_model=List[Expense], response_class=ORJSONResponse)
+async def get_pending_expenses(
+    request: Request,
+    page: ExpensePageParams = Depends(),
+    current_user: User = Depends(require_role_and_company("admin", "manager"))
+):
     """Get pending expenses - only for managers and admins, with strict company isolation."""
+    etag = await data_version_etag(request, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    
+    # Get pending expenses only from accessible users (company-filtered)
+    expenses, next_cursor = await fetch_expense_page({
+        **expense_visibility_query(current_user),
+        "status": "pending"
+    }, page)
+    
+    headers = {"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return ORJSONResponse(expenses, headers=headers)
+
+@api_router.get("/expenses/search", response_class=ORJSONResponse)
+async def search_expenses_endpoint(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find in merchant, description or category"),
+    page: int = Query(1, ge=1),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    filters: ExpenseFilterParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Full-text search over the expenses the caller can see, best matches first,
+    with counts by category, status and month across all matches.
+    Answers If-None-Match with 304 while the caller's data version is unchanged.
+    """
+    etag = await data_version_etag(request, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    
+    result = await search_expenses(current_user, q, filters, page, limit)
+    return ORJSONResponse(result, headers={"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL})
+
+def parse_bulk_csv(content: bytes) -> List[dict]:
+    """Read CSV rows (header: amount,currency,category,description,date); blank cells are omitted."""
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8 encoded")
+    reader = csv.DictReader(io.StringIO(text))
+    return [
+        {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+        for row in reader
+    ]
+
+def bulk_body_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Request body is too large; the limit is {BULK_IMPORT_MAX_BYTES} bytes"
+    )
+
+async def read_bulk_body(request: Request) -> bytes:
+    """Read the request body, giving up with 413 once it passes BULK_IMPORT_MAX_BYTES."""
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > BULK_IMPORT_MAX_BYTES:
+            raise bulk_body_too_large()
+    return bytes(body)
+
+async def import_expense_rows(rows: List[Any], current_user: User) -> Dict[str, Any]:
+    """
+    Validate rows against ExpenseCreate and insert the valid ones with unordered
+    insert_many in BULK_IMPORT_CHUNK_SIZE chunks. A bad row never fails the
+    batch; it is reported with its index instead.
+    """
+    errors = []
+    inserted_ids = []
+    
+    for chunk_start in range(0, len(rows), BULK_IMPORT_CHUNK_SIZE):
+        chunk = rows[chunk_start:chunk_start + BULK_IMPORT_CHUNK_SIZE]
+        documents = []
+        row_numbers = []
+        owner_chain = await get_owner_chain(current_user.id)
+        
+        for offset, row in enumerate(chunk):
+            row_number = chunk_start + offset
+            if not isinstance(row, dict):
+                errors.append({"row": row_number, "errors": [{"field": "", "message": "Expected an object"}]})
+                continue
+            try:
+                expense_data = ExpenseCreate(**row)
+            except ValidationError as e:
+                errors.append({
+                    "row": row_number,
+                    "errors": [
+                        {"field": ".".join(str(part) for part in error["loc"]), "message": error["msg"]}
+                        for error in e.errors()
+                    ]
+                })
+                continue
+            documents.append(Expense(
+                employee_id=current_user.id,
+                company_id=current_user.company_id,
+                **owner_chain,
+                **expense_data.dict()
+            ).dict())
+            row_numbers.append(row_number)
+        
+        if not documents:
+            continue
+        
+        failed_positions = set()
+        try:
+            await db.expenses.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed_positions.add(write_error["index"])
+                errors.append({
+                    "row": row_numbers[write_error["index"]],
+                    "errors": [{"field": "", "message": write_error.get("errmsg", "Insert failed")}]
+                })
+        
+        written = [document for position, document in enumerate(documents) if position not in failed_positions]
+        await record_new_expense_rollups(written)
+        publish_expense_events("expense.created", written)
+        inserted_ids.extend(document["id"] for document in written)
+    
+    if inserted_ids:
+        await bump_data_versions(current_user.company_id, [current_user.id])
+    
+    errors.sort(key=lambda error: error["row"])
+    return {
+        "received": len(rows),
+        "inserted": len(inserted_ids),
+        "failed": len(errors),
+        "inserted_ids": inserted_ids,
+        "errors": errors
+    }
+
+@api_router.post("/expenses/bulk")
+async def bulk_create_expenses(request: Request, current_user: User = Depends(get_current_user)):
+    """
+    Create many expenses in one call. Accepts a JSON array of ExpenseCreate
+    objects, a text/csv body, or a multipart upload with the CSV in "file".
+    """
+    content_type = request.headers.get("content-type", "")
+    content_length = request.headers.get("content-length", "")
+    # Refuse oversized uploads before anything is read or parsed
+    if content_length.isdigit() and int(content_length) > BULK_IMPORT_MAX_BYTES:
+        raise bulk_body_too_large()
+    
+    if content_type.startswith("application/json"):
+        try:
+            rows = json.loads(await read_bulk_body(request))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of expenses")
+    elif content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Upload the CSV as the 'file' form field")
+        # Multipart parts are spooled to disk, so a chunked body is still sized before it is read
+        if upload.size is not None and upload.size > BULK_IMPORT_MAX_BYTES:
+            raise bulk_body_too_large()
+        rows = parse_bulk_csv(await upload.read())
+    elif content_type.startswith("text/csv"):
+        rows = parse_bulk_csv(await read_bulk_body(request))
+    else:
+        raise HTTPException(status_code=415, detail="Send a JSON array or a CSV file")
+    
+    if len(rows) > BULK_IMPORT_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many rows ({len(rows)}); the limit is {BULK_IMPORT_MAX_ROWS} per request"
+        )
+    
+    return await import_expense_rows(rows, current_user)
+
+EXPORT_FIELDS = ["id", "date", "employee_id", "manager_id", "category", "description",
+                 "amount", "currency", "status", "created_at"]
+
+async def stream_expense_export(query: dict, export_format: str):
+    """
+    Yield an export straight from a Motor cursor, one encoded chunk per batch,
+    so memory stays flat regardless of how many rows match.
+    """
+    projection = {field: 1 for field in EXPORT_FIELDS}
+    projection["_id"] = 0
+    cursor = db.expenses.find(query, projection).sort("date", ASCENDING).batch_size(EXPORT_BATCH_SIZE)
     
-    # Get user IDs that current user can access (company-filtered)
-    accessible_user_ids = await get_accessible_user_ids(current_user)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    if export_format == "csv":
+        writer.writeheader()
     
-    # Get pending expenses only from accessible users
-    expenses = await db.expenses.find({
-        "status": "pending",
-        "employee_id": {"$in": accessible_user_ids}
-    }).to_list(1000)
+    rows_in_batch = 0
+    try:
+        async for expense in cursor:
+            row = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in expense.items()}
+            if export_format == "csv":
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row))
+                buffer.write("\n")
+            rows_in_batch += 1
+            if rows_in_batch >= EXPORT_BATCH_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                rows_in_batch = 0
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        await cursor.close()
+
+@api_router.get("/expenses/export")
+async def export_expenses(
+    export_format: str = Query("csv", alias="format", regex="^(csv|ndjson)$"),
+    filters: ExpenseFilterParams = Depends(),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream every expense the user can see as CSV or NDJSON, oldest first."""
+    
+    query = {**expense_visibility_query(current_user), **filters.filters()}
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    filename = f"expenses-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{export_format}"
     
-    return [Expense(**expense) for expense in expenses]
+    return StreamingResponse(
+        stream_expense_export(query, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @api_router.post("/expenses/{expense_id}/approve")
 async def approve_expense(
@@ -619,27 +3546,17 @@ async def approve_expense(
     approval: ApprovalAction,
     current_user: User = Depends(require_role_and_company("admin", "manager"))
 ):
-    """Approve/reject expense with bulletproof company and permission checks."""
+    """
+    Approve/reject a pending expense. Access is resolved in one aggregation and
+    the status change is a conditional update on status "pending", so two
+    approvers racing on the same expense get exactly one success and one 409.
+    """
     
-    # Use company-safe expense retrieval
-    expense = await get_company_safe_expense(expense_id, current_user)
-    if not expense:
-        raise HTTPException(
-            status_code=404, 
-            detail="Expense not found or access denied"
-        )
+    if approval.action not in ("approve", "reject"):
+        raise HTTPException(status_code=400, detail="Action must be 'approve' or 'reject'")
     
-    # Additional role-based check for approval rights
-    if current_user.role == "manager":
-        # Manager can only approve expenses from their direct reports
-        accessible_user_ids = await get_manager_accessible_users(current_user)
-        if expense["employee_id"] not in accessible_user_ids:
-            raise HTTPException(
-                status_code=403,
-                detail="You can only approve expenses from your direct reports"
-            )
+    expense = await resolve_expense_for_approval(expense_id, current_user)
     
-    # Update expense status with company-safe query
     approval_entry = {
         "approver_id": current_user.id,
         "approver_name": current_user.full_name,
@@ -648,76 +3565,314 @@ async def approve_expense(
         "timestamp": datetime.now(timezone.utc)
     }
     
-    update_data = {
-        "$set": {"status": "approved" if approval.action == "approve" else "rejected"},
-        "$push": {"approval_history": approval_entry}
-    }
+    new_status = "approved" if approval.action == "approve" else "rejected"
+    previous = await db.expenses.find_one_and_update(
+        {"id": expense_id, "status": "pending"},
+        {"$set": {"status": new_status}, "$push": {"approval_history": approval_entry}},
+        projection={"_id": 0, "status": 1},
+        return_document=ReturnDocument.BEFORE
+    )
     
-    # Update with company verification (double-check)
-    result = await db.expenses.update_one({"id": expense_id}, update_data)
+    if previous is None:
+        current = await db.expenses.find_one({"id": expense_id}, {"_id": 0, "status": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Expense is already {current['status']}"
+        )
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Expense not found")
+    await record_expense_rollup(expense, previous["status"], new_status)
+    await bump_data_versions(current_user.company_id, [expense["employee_id"]])
+    publish_expense_events("expense.status_changed", [
+        {**expense, "status": new_status, "ancestor_ids": expense.get("owner_ancestor_ids")}
+    ])
     
     return {"message": f"Expense {approval.action}d successfully"}
 
-@api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    """Get dashboard statistics with bulletproof company isolation."""
+async def convert_to_company_currency(
+    amounts_by_currency: Dict[str, Dict[str, float]],
+    company_currency: str
+) -> Tuple[Dict[str, float], set]:
+    """
+    Collapse {bucket: {currency: amount}} into {bucket: amount in company currency}.
+    Also returns the currencies that had no rate and were left out.
+    """
+    foreign = {currency for per_currency in amounts_by_currency.values() for currency in per_currency} - {company_currency}
+    rates = await get_currency_rates(company_currency) if foreign else {company_currency: 1.0}
     
-    # Get user IDs that current user can access (already company-filtered)
-    accessible_user_ids = await get_accessible_user_ids(current_user)
+    totals = {}
+    unconverted = set()
+    for bucket, per_currency in amounts_by_currency.items():
+        total = 0.0
+        for currency, amount in per_currency.items():
+            rate = rates.get(currency)
+            if currency == company_currency:
+                total += amount
+            elif rate:
+                total += amount / rate
+            else:
+                unconverted.add(currency)
+        totals[bucket] = round(total, 2)
+    return totals, unconverted
+
+@api_router.post("/expenses/approve-batch")
+async def approve_expenses_batch(
+    batch: BatchApprovalAction,
+    current_user: User = Depends(require_role_and_company("admin", "manager"))
+):
+    """
+    Approve/reject many expenses with one action and comment. Access for the
+    whole set is checked with a single query and every change goes out in one
+    bulk_write; the response reports the outcome per expense id.
+    """
     
-    if current_user.role == "employee":
-        # Employee stats - only their own data
-        total_expenses = await db.expenses.count_documents({"employee_id": current_user.id})
-        pending_expenses = await db.expenses.count_documents({
-            "employee_id": current_user.id, 
-            "status": "pending"
-        })
-        approved_expenses = await db.expenses.count_documents({
-            "employee_id": current_user.id, 
-            "status": "approved"
-        })
-        
-        # Total amount spent (approved expenses only)
-        pipeline = [
-            {"$match": {"employee_id": current_user.id, "status": "approved"}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]
-        result = await db.expenses.aggregate(pipeline).to_list(1)
-        total_amount = result[0]["total"] if result else 0
-        
+    if batch.action not in ("approve", "reject"):
+        raise HTTPException(status_code=400, detail="Action must be 'approve' or 'reject'")
+    expense_ids = list(dict.fromkeys(batch.expense_ids))  # De-duplicate, keep order
+    if not expense_ids:
+        raise HTTPException(status_code=400, detail="No expense ids given")
+    if len(expense_ids) > APPROVE_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many expenses ({len(expense_ids)}); the limit is {APPROVE_BATCH_MAX_SIZE} per request"
+        )
+    
+    # One query resolves which of the ids this user may act on (company + team scope)
+    accessible = await db.expenses.find(
+        {**expense_visibility_query(current_user), "id": {"$in": expense_ids}},
+        {"_id": 0, "id": 1, "employee_id": 1, "company_id": 1, "manager_id": 1, "ancestor_ids": 1,
+         "amount": 1, "currency": 1, "date": 1, "status": 1}
+    ).to_list(None)
+    expenses_by_id = {expense["id"]: expense for expense in accessible}
+    
+    new_status = "approved" if batch.action == "approve" else "rejected"
+    batch_id = str(uuid.uuid4())
+    approval_entry = {
+        "approver_id": current_user.id,
+        "approver_name": current_user.full_name,
+        "action": batch.action,
+        "comment": batch.comment,
+        "timestamp": datetime.now(timezone.utc),
+        "batch_id": batch_id
+    }
+    
+    # Only pending expenses can be decided; the status guard also stops a
+    # concurrent decision from being overwritten
+    operations = [
+        UpdateOne(
+            {"id": expense["id"], "status": "pending"},
+            {"$set": {"status": new_status}, "$push": {"approval_history": approval_entry}}
+        )
+        for expense in accessible if expense["status"] == "pending"
+    ]
+    
+    applied_ids = set()
+    if operations:
+        result = await db.expenses.bulk_write(operations, ordered=False)
+        if result.matched_count == len(operations):
+            applied_ids = {expense["id"] for expense in accessible if expense["status"] == "pending"}
+        else:
+            applied = await db.expenses.find(
+                {"id": {"$in": list(expenses_by_id)}, "approval_history.batch_id": batch_id},
+                {"_id": 0, "id": 1}
+            ).to_list(None)
+            applied_ids = {expense["id"] for expense in applied}
+    
+    await apply_rollup_transitions([
+        (expenses_by_id[expense_id], "pending", new_status)
+        for expense_id in applied_ids
+    ])
+    if applied_ids:
+        await bump_data_versions(
+            current_user.company_id,
+            [expenses_by_id[expense_id]["employee_id"] for expense_id in applied_ids]
+        )
+        publish_expense_events("expense.status_changed", [
+            {**expenses_by_id[expense_id], "status": new_status} for expense_id in applied_ids
+        ])
+    
+    results = []
+    for expense_id in expense_ids:
+        if expense_id in applied_ids:
+            results.append({"id": expense_id, "outcome": new_status})
+        elif expense_id in expenses_by_id:
+            results.append({"id": expense_id, "outcome": "conflict", "detail": "Expense is no longer pending"})
+        else:
+            results.append({"id": expense_id, "outcome": "not_found", "detail": "Expense not found or access denied"})
+    
+    return {
+        "action": batch.action,
+        "succeeded": len(applied_ids),
+        "failed": len(expense_ids) - len(applied_ids),
+        "results": results
+    }
+
+def users_in_scope_query(current_user: User) -> Optional[dict]:
+    """Users counted in dashboard stats (None for employees, who only see themselves)."""
+    if current_user.role == "admin":
+        return {"company_id": current_user.company_id}
+    elif current_user.role == "manager":
         return {
-            "total_expenses": total_expenses,
-            "pending_expenses": pending_expenses,
-            "approved_expenses": approved_expenses,
-            "total_amount": total_amount
+            "company_id": current_user.company_id,
+            "$or": [{"ancestor_ids": current_user.id}, {"id": current_user.id}]
         }
+    return None
+
+def dashboard_stats_pipeline(current_user: User) -> List[dict]:
+    """
+    One aggregation over expense_rollups for the whole dashboard: a $facet
+    buckets the visible rollups by status and currency, and uncorrelated
+    $lookups pull the company currency and the user count into the same
+    result document. Cost grows with users x months, not expenses.
+    """
+    pipeline = [
+        {"$match": expense_visibility_query(current_user)},
+        {"$facet": {
+            "by_status": [
+                {"$group": {
+                    "_id": {"status": "$status", "currency": "$currency"},
+                    "count": {"$sum": "$count"},
+                    "amount": {"$sum": "$amount"}
+                }}
+            ]
+        }},
+        {"$lookup": {
+            "from": "companies",
+            "pipeline": [
+                {"$match": {"id": current_user.company_id}},
+                {"$project": {"_id": 0, "currency": 1}}
+            ],
+            "as": "company"
+        }}
+    ]
+    users_query = users_in_scope_query(current_user)
+    if users_query is not None:
+        pipeline.append({"$lookup": {
+            "from": "users",
+            "pipeline": [{"$match": users_query}, {"$count": "total"}],
+            "as": "users"
+        }})
+    return pipeline
+
+async def compute_dashboard_stats(current_user: User) -> Dict[str, Any]:
+    """Dashboard statistics with bulletproof company isolation, in one round trip."""
+    result = await db.expense_rollups.aggregate(dashboard_stats_pipeline(current_user)).to_list(1)
+    facets = result[0] if result else {}
+    buckets = facets.get("by_status", [])
     
-    else:
-        # Manager/Admin stats - using accessible user IDs (company-safe)
-        total_expenses = await db.expenses.count_documents({
-            "employee_id": {"$in": accessible_user_ids}
-        })
-        pending_expenses = await db.expenses.count_documents({
-            "employee_id": {"$in": accessible_user_ids}, 
-            "status": "pending"
-        })
-        approved_expenses = await db.expenses.count_documents({
-            "employee_id": {"$in": accessible_user_ids}, 
-            "status": "approved"
-        })
-        
+    counts = {"pending": 0, "approved": 0, "rejected": 0}
+    amounts_by_currency: Dict[str, Dict[str, float]] = {status_name: {} for status_name in counts}
+    for bucket in buckets:
+        status_name = bucket["_id"]["status"]
+        currency = bucket["_id"].get("currency") or "USD"
+        counts[status_name] = counts.get(status_name, 0) + bucket["count"]
+        per_currency = amounts_by_currency.setdefault(status_name, {})
+        per_currency[currency] = per_currency.get(currency, 0) + bucket["amount"]
+    
+    stats = {
+        "total_expenses": sum(counts.values()),
+        "pending_expenses": counts["pending"],
+        "approved_expenses": counts["approved"],
+        "rejected_expenses": counts["rejected"]
+    }
+    
+    if current_user.role == "employee":
+        # Total amount spent (approved expenses only)
+        stats["total_amount"] = sum(amounts_by_currency["approved"].values())
+        return stats
+    
+    # Manager/Admin: per-status totals converted to the company currency
+    company = facets.get("company") or [{}]
+    company_currency = company[0].get("currency", "USD")
+    amounts_by_status, unconverted = await convert_to_company_currency(amounts_by_currency, company_currency)
+    
+    users = facets.get("users") or [{}]
+    stats.update({
         # Total users count (team-wide for manager, company-wide for admin)
-        total_users = len(accessible_user_ids)
-        
-        return {
-            "total_expenses": total_expenses,
-            "pending_expenses": pending_expenses,
-            "approved_expenses": approved_expenses,
-            "total_users": total_users
-        }
+        "total_users": users[0].get("total", 0),
+        "currency": company_currency,
+        "amounts_by_status": amounts_by_status,
+        "total_amount": amounts_by_status["approved"],
+        "unconverted_currencies": sorted(unconverted)
+    })
+    return stats
+
+@api_router.get("/dashboard/stats")
+async def get_dashboard_stats(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    """Get dashboard statistics; 304 for a matching If-None-Match while nothing changed."""
+    # Manager/admin totals are converted at current rates, so their ETag also rolls over with the rates
+    rates_epoch = currency_rates_epoch() if current_user.role != "employee" else None
+    etag = await data_version_etag(request, current_user, rates_epoch)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = DATA_CACHE_CONTROL
+    return await compute_dashboard_stats(current_user)
+
+@api_router.get("/reports/monthly")
+async def get_monthly_report(
+    request: Request,
+    response: Response,
+    month_from: Optional[str] = Query(None, regex=r"^\d{4}-\d{2}$", description="YYYY-MM, inclusive"),
+    month_to: Optional[str] = Query(None, regex=r"^\d{4}-\d{2}$", description="YYYY-MM, inclusive"),
+    current_user: User = Depends(get_current_user)
+):
+    """Monthly expense counts and totals (company currency) per status, read from the rollups."""
+    etag = await data_version_etag(request, current_user, currency_rates_epoch())
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = DATA_CACHE_CONTROL
+    
+    query = expense_visibility_query(current_user)
+    if month_from or month_to:
+        query["month"] = {}
+        if month_from:
+            query["month"]["$gte"] = month_from
+        if month_to:
+            query["month"]["$lte"] = month_to
+    
+    buckets = await db.expense_rollups.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": {"month": "$month", "status": "$status", "currency": "$currency"},
+            "count": {"$sum": "$count"},
+            "amount": {"$sum": "$amount"}
+        }}
+    ]).to_list(None)
+    
+    company = await db.companies.find_one({"id": current_user.company_id}, {"_id": 0, "currency": 1})
+    company_currency = (company or {}).get("currency", "USD")
+    
+    counts: Dict[Tuple[str, str], int] = {}
+    amounts_by_currency: Dict[Tuple[str, str], Dict[str, float]] = {}
+    for bucket in buckets:
+        key = (bucket["_id"]["month"], bucket["_id"]["status"])
+        counts[key] = counts.get(key, 0) + bucket["count"]
+        per_currency = amounts_by_currency.setdefault(key, {})
+        currency = bucket["_id"]["currency"]
+        per_currency[currency] = per_currency.get(currency, 0) + bucket["amount"]
+    
+    totals, unconverted = await convert_to_company_currency(amounts_by_currency, company_currency)
+    
+    months: Dict[str, Dict[str, Any]] = {}
+    for (month, status_name), count in sorted(counts.items()):
+        if count == 0:
+            continue
+        months.setdefault(month, {})[status_name] = {"count": count, "amount": totals[(month, status_name)]}
+    
+    return {
+        "currency": company_currency,
+        "months": [{"month": month, "statuses": statuses} for month, statuses in months.items()],
+        "unconverted_currencies": sorted(unconverted)
+    }
 
 # Admin User Management Routes
 @api_router.post("/admin/users", response_model=UserResponse, dependencies=[Depends(require_role("admin"))])
@@ -747,7 +3902,8 @@ async def create_user_by_admin(
     
     # Create user
     user_id = str(uuid.uuid4())
-    hashed_password = bcrypt.hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
+    ancestor_ids = await ancestor_ids_for_manager(user_data.manager_id, current_user.company_id)
     
     new_user = {
         "id": user_id,
@@ -757,11 +3913,15 @@ async def create_user_by_admin(
         "role": user_data.role,
         "company_id": current_user.company_id,  # Auto-assign to admin's company
         "manager_id": user_data.manager_id,
+        "ancestor_ids": ancestor_ids,
         "created_at": datetime.utcnow(),
         "is_active": True
     }
     
     await db.users.insert_one(new_user)
+    if ancestor_ids:
+        await bump_org_version(current_user.company_id)
+    await bump_data_versions(current_user.company_id)
     
     # Return user data without password
     return UserResponse(
@@ -837,13 +3997,21 @@ async def update_user_by_admin(
         if user_updates.manager_id and not await validate_manager_assignment(user_updates.manager_id, current_user):
             raise HTTPException(status_code=400, detail="Invalid manager assignment")
         
-        update_data["manager_id"] = user_updates.manager_id
+        update_data["manager_id"] = user_updates.manager_id or None  # Empty string clears the manager
+    
+    manager_changed = "manager_id" in update_data and update_data["manager_id"] != target_user.get("manager_id")
+    if manager_changed:
+        update_data["ancestor_ids"] = await ancestor_ids_for_manager(update_data["manager_id"], current_user.company_id)
+        try:
+            check_org_cycle(user_id, update_data["ancestor_ids"])
+        except OrgCycleError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
     if user_updates.is_active is not None:
         update_data["is_active"] = user_updates.is_active
     
     if user_updates.password is not None:
-        update_data["hashed_password"] = bcrypt.hash(user_updates.password)
+        update_data["hashed_password"] = await password_hasher.hash(user_updates.password)
     
     if not update_data:
         raise HTTPException(status_code=400, detail="No valid fields to update")
@@ -859,6 +4027,14 @@ async def update_user_by_admin(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found or access denied")
     
+    # Drop the cached principal so role, manager and active changes apply immediately
+    principal_cache.invalidate(target_user["email"])
+    
+    # Move the user's subtree, expenses and rollups under the new chain
+    if manager_changed:
+        await reparent_user(target_user, update_data["ancestor_ids"])
+    await bump_data_versions(current_user.company_id, [user_id])
+    
     # Get updated user
     updated_user = await db.users.find_one(
         {"id": user_id, "company_id": current_user.company_id},
@@ -875,20 +4051,78 @@ async def update_user_by_admin(
         is_active=updated_user.get("is_active", True)
     )
 
+@api_router.get("/admin/cache-stats", dependencies=[Depends(require_role("admin"))])
+async def get_cache_stats(current_user: User = Depends(require_role("admin"))):
+    """Get hit/miss counters for the in-process caches."""
+    return {
+        "principal_cache": principal_cache.stats(),
+        "currency_rates": currency_rate_service.stats(),
+        "ocr_results": ocr_result_cache.stats(),
+        "org": org_cache.stats()
+    }
+
+@api_router.get("/admin/password-hasher-stats", dependencies=[Depends(require_role("admin"))])
+async def get_password_hasher_stats(current_user: User = Depends(require_role("admin"))):
+    """Get pool configuration and queue-depth counters for password hashing."""
+    return {"password_hasher": password_hasher.stats()}
+
+@api_router.get("/admin/metrics-summary", dependencies=[Depends(require_role("admin"))])
+async def get_metrics_summary(current_user: User = Depends(require_role("admin"))):
+    """Get p50/p95/p99 latency per route and per Mongo command, and event-loop lag."""
+    return metrics.summary()
+
+@api_router.get("/admin/slow-queries", dependencies=[Depends(require_role("admin"))])
+async def get_slow_queries(
+    limit: int = Query(50, ge=1, le=500),
+    collscan_only: bool = False,
+    current_user: User = Depends(require_role("admin"))
+):
+    """
+    Get the latest slow query profiles (newest first) and profiler counters.
+    Profiles hold query shapes only, never filter values.
+    """
+    query = {"collscan": True} if collscan_only else {}
+    profiles = await db[PROFILER_COLLECTION].find(query, {"_id": 0}).sort("$natural", -1).limit(limit).to_list(limit)
+    return {"profiler": slow_query_profiler.stats(), "profiles": profiles}
+
+@api_router.get("/admin/event-stats", dependencies=[Depends(require_role("admin"))])
+async def get_event_stats(current_user: User = Depends(require_role("admin"))):
+    """Get open event stream and delivery counters."""
+    return event_broker.stats()
+
+@api_router.get("/admin/ocr-queue-stats", dependencies=[Depends(require_role("admin"))])
+async def get_ocr_queue_stats(current_user: User = Depends(require_role("admin"))):
+    """Get receipt OCR job counts by status for the company, plus worker pool counters."""
+    counts = await db.ocr_jobs.aggregate([
+        {"$match": {"company_id": current_user.company_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    return {
+        "jobs": {row["_id"]: row["count"] for row in counts},
+        "workers": ocr_worker_pool.stats(),
+        "preprocessing": receipt_preprocessor.stats()
+    }
+
 # Manager Team Management Routes
 @api_router.get("/manager/team", dependencies=[Depends(require_role("manager"))])
-async def get_manager_team(current_user: User = Depends(require_role("manager"))):
-    """Get all direct reports of the current manager."""
+async def get_manager_team(
+    include_indirect: bool = Query(False, description="Include everyone below the manager, not just direct reports"),
+    current_user: User = Depends(require_role("manager"))
+):
+    """Get the direct reports (or the whole subtree) of the current manager."""
     
-    # Get direct reports with company isolation
-    direct_report_ids = await get_direct_reports(current_user)
+    # Get reports with company isolation
+    if include_indirect:
+        report_ids = await org_cache.subtree(current_user.company_id, current_user.id)
+    else:
+        report_ids = await get_direct_reports(current_user)
     
-    if not direct_report_ids:
+    if not report_ids:
         return {"team_members": []}
     
-    # Get detailed user information for direct reports
+    # Get detailed user information for the reports
     team_cursor = db.users.find({
-        "id": {"$in": direct_report_ids},
+        "id": {"$in": report_ids},
         "company_id": current_user.company_id  # Extra safety check
     }, {
         "hashed_password": 0  # Exclude password from response
@@ -901,7 +4135,7 @@ async def get_manager_team(current_user: User = Depends(require_role("manager"))
     for member in team_members:
         team_responses.append(UserResponse(
             id=member["id"],
-            name=member["name"],
+            full_name=member["full_name"],
             email=member["email"],
             role=member["role"],
             company_id=member["company_id"],
@@ -919,59 +4153,75 @@ async def get_manager_team(current_user: User = Depends(require_role("manager"))
         "team_size": len(team_responses)
     }
 
-@api_router.get("/manager/team/expenses", dependencies=[Depends(require_role("manager"))])
-async def get_team_expenses(current_user: User = Depends(require_role("manager"))):
-    """Get all expenses from the manager's direct reports."""
-    
-    # Get accessible user IDs (manager + direct reports)
-    accessible_user_ids = await get_manager_accessible_users(current_user)
-    
-    if not accessible_user_ids:
-        return {"expenses": []}
-    
-    # Get expenses from team members with company isolation
-    expenses_cursor = db.expenses.find({
-        "employee_id": {"$in": accessible_user_ids},
-        "company_id": current_user.company_id  # Company isolation
-    })
+@api_router.get("/manager/team/expenses", dependencies=[Depends(require_role("manager"))],
+                response_class=ORJSONResponse)
+async def get_team_expenses(
+    request: Request,
+    page: ExpensePageParams = Depends(),
+    current_user: User = Depends(require_role("manager"))
+):
+    """Get expenses from everyone below the manager, one page at a time."""
+    etag = await data_version_etag(request, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
     
-    expenses = await expenses_cursor.to_list(length=None)
+    # Manager + whole subtree, with company isolation
+    expenses, next_cursor = await fetch_expense_page(expense_visibility_query(current_user), page)
     
-    return {"expenses": expenses, "count": len(expenses)}
+    return ORJSONResponse(
+        {"expenses": expenses, "count": len(expenses), "next_cursor": next_cursor},
+        headers={"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL}
+    )
 
-@api_router.get("/manager/team/pending", dependencies=[Depends(require_role("manager"))])
-async def get_team_pending_expenses(current_user: User = Depends(require_role("manager"))):
-    """Get pending expenses from manager's direct reports only."""
-    
-    # Get direct reports only (exclude manager's own expenses)
-    direct_report_ids = await get_direct_reports(current_user)
-    
-    if not direct_report_ids:
-        return {"pending_expenses": []}
+@api_router.get("/manager/team/pending", dependencies=[Depends(require_role("manager"))],
+                response_class=ORJSONResponse)
+async def get_team_pending_expenses(
+    request: Request,
+    page: ExpensePageParams = Depends(),
+    current_user: User = Depends(require_role("manager"))
+):
+    """Get pending expenses from manager's direct reports only, one page at a time."""
+    etag = await data_version_etag(request, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
     
-    # Get pending expenses from direct reports with company isolation
-    expenses_cursor = db.expenses.find({
-        "employee_id": {"$in": direct_report_ids},
-        "company_id": current_user.company_id,  # Company isolation
+    # Direct reports only (exclude manager's own expenses), with company isolation
+    pending_expenses, next_cursor = await fetch_expense_page({
+        "company_id": current_user.company_id,
+        "manager_id": current_user.id,
         "status": "pending"
-    })
+    }, page)
     
-    pending_expenses = await expenses_cursor.to_list(length=None)
-    
-    return {
+    return ORJSONResponse({
         "pending_expenses": pending_expenses,
-        "count": len(pending_expenses)
-    }
+        "count": len(pending_expenses),
+        "next_cursor": next_cursor
+    }, headers={"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL})
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint."""
+    if METRICS_TOKEN and not secrets.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
 
 # Include the router in the main app
 app.include_router(api_router)
 
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, registry=metrics)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -981,6 +4231,121 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class RedactTokenFilter(logging.Filter):
+    """Blank ?token= values in access log lines (uvicorn logs the full request path)."""
+    pattern = re.compile(r"([?&]token=)[^&\s]*")
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple):
+            record.args = tuple(
+                self.pattern.sub(r"\1[redacted]", arg) if isinstance(arg, str) else arg
+                for arg in record.args
+            )
+        return True
+
+logging.getLogger("uvicorn.access").addFilter(RedactTokenFilter())
+
+@app.on_event("startup")
+async def bootstrap_database():
+    if DB_BOOTSTRAP_ON_STARTUP:
+        # Indexes first, so the backfill migrations don't run as collection scans
+        await ensure_indexes()
+        await run_migrations()
+
+@app.on_event("startup")
+async def start_event_loop_lag_probe():
+    if METRICS_ENABLED:
+        app.state.loop_lag_task = asyncio.create_task(
+            monitor_event_loop_lag(METRICS_LOOP_LAG_INTERVAL_SECONDS, METRICS_LOOP_LAG_WARN_SECONDS)
+        )
+
+@app.on_event("startup")
+async def start_slow_query_profiler():
+    if PROFILER_ENABLED:
+        await ensure_profiler_collection()
+        slow_query_profiler.start(asyncio.get_running_loop())
+
+@app.on_event("startup")
+async def start_ocr_workers():
+    ocr_worker_pool.start()
+
+@app.on_event("startup")
+async def start_expense_change_stream():
+    if EVENTS_FANOUT == "change_stream":
+        app.state.expense_change_stream_task = asyncio.create_task(watch_expense_changes())
+
+@app.on_event("startup")
+async def start_country_index_refresh():
+    if COUNTRIES_REFRESH_INTERVAL_HOURS > 0:
+        app.state.country_refresh_task = asyncio.create_task(refresh_country_index_periodically())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_receipt_preprocessor():
+    receipt_preprocessor.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_currency_rate_service():
+    await currency_rate_service.close()
+
+@app.on_event("shutdown")
+async def stop_ocr_workers():
+    await ocr_worker_pool.stop()
+
+@app.on_event("shutdown")
+async def close_event_streams():
+    event_broker.close()
+    change_stream_task = getattr(app.state, "expense_change_stream_task", None)
+    if change_stream_task:
+        change_stream_task.cancel()
+
+@app.on_event("shutdown")
+async def stop_event_loop_lag_probe():
+    loop_lag_task = getattr(app.state, "loop_lag_task", None)
+    if loop_lag_task:
+        loop_lag_task.cancel()
+
+@app.on_event("shutdown")
+async def stop_country_index_refresh():
+    refresh_task = getattr(app.state, "country_refresh_task", None)
+    if refresh_task:
+        refresh_task.cancel()
+
+# Maintenance commands: python server.py {migrate,index-report,backfill-expenses,rollups-verify,rollups-rebuild}
+async def _run_command(command: str):
+    if command == "migrate":
+        await ensure_indexes()
+        applied = await run_migrations()
+        print(f"Applied migrations: {applied or 'none'}")
+    elif command == "index-report":
+        print(json.dumps(await get_index_report(), indent=2))
+    elif command == "backfill-expenses":
+        modified = await backfill_expense_ownership()
+        print(f"Re-stamped company_id/manager_id on {modified} expenses")
+    elif command == "rollups-verify":
+        report = await verify_expense_rollups()
+        print(json.dumps(report, indent=2, default=str))
+        if report["drifted"] or report["stale_chains"]:
+            raise SystemExit(1)
+    elif command == "rollups-rebuild":
+        await rebuild_expense_rollups()
+        print("Rebuilt expense_rollups from expenses")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Expense Management System maintenance commands",
+        epilog="rollups-rebuild replaces expense_rollups wholesale: stop the app (or all expense writes) "
+               "first, or writes made during the rebuild are lost."
+    )
+    parser.add_argument("command", choices=[
+        "migrate", "index-report", "backfill-expenses", "rollups-verify", "rollups-rebuild"
+    ])
+    args = parser.parse_args()
+    asyncio.run(_run_command(args.command))
@@ -0,0 +1,81 @@
+import { useEffect, useRef } from 'react';
+import axios from 'axios';
+
+const REFRESH_DELAY_MS = 500;
+const RECONNECT_DELAY_MS = 5000;
+
+// Subscribe to the backend's expense event stream (GET /api/events) and call
+// onChange when expenses visible to the user are created or change status.
+// Bursts (e.g. a bulk import) are coalesced into one call. onChange also runs
+// after the stream reconnects, since events may have been missed meanwhile.
+// EventSource cannot send the Authorization header, so each connection uses a
+// short-lived stream token from POST /api/events/token instead of the session
+// token; once the browser's own retry is refused, a fresh token is fetched.
+export function useExpenseEvents(API, onChange) {
+  const onChangeRef = useRef(onChange);
+  onChangeRef.current = onChange;
+
+  useEffect(() => {
+    if (!localStorage.getItem('token') || typeof EventSource === 'undefined') {
+      return undefined;
+    }
+
+    let source = null;
+    let timer = null;
+    let reconnectTimer = null;
+    let connected = false;
+    let closed = false;
+
+    const scheduleRefresh = () => {
+      if (timer) return;
+      timer = setTimeout(() => {
+        timer = null;
+        onChangeRef.current();
+      }, REFRESH_DELAY_MS);
+    };
+
+    const scheduleReconnect = () => {
+      if (closed || reconnectTimer) return;
+      reconnectTimer = setTimeout(() => {
+        reconnectTimer = null;
+        connect();
+      }, RECONNECT_DELAY_MS);
+    };
+
+    const connect = async () => {
+      let token;
+      try {
+        const response = await axios.post(`${API}/events/token`);
+        token = response.data.token;
+      } catch (error) {
+        scheduleReconnect();
+        return;
+      }
+      if (closed) return;
+
+      source = new EventSource(`${API}/events?token=${encodeURIComponent(token)}`);
+      source.addEventListener('expense.created', scheduleRefresh);
+      source.addEventListener('expense.status_changed', scheduleRefresh);
+      source.addEventListener('ready', () => {
+        if (connected) scheduleRefresh();
+        connected = true;
+      });
+      source.onerror = () => {
+        // The browser retries with the same URL; once that is refused the source is closed
+        if (source.readyState === EventSource.CLOSED) {
+          source.close();
+          scheduleReconnect();
+        }
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(timer);
+      clearTimeout(reconnectTimer);
+      if (source) source.close();
+    };
+  }, [API]);
+}
@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { AuthContext } from '../App';
+import { useExpenseEvents } from '@/hooks/use-expense-events';
 import { Card, CardHeader, CardTitle, CardContent } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -14,7 +15,8 @@ import {
   DollarSign,
   MessageSquare,
   User,
-  Building2
+  Building2,
+  AlertTriangle
 } from 'lucide-react';
 import { 
   Dialog,
@@ -27,6 +29,10 @@ import {
 import axios from 'axios';
 import { toast } from 'sonner';
 
+const RECEIPT_URL_TTL_MS = 60000;
+// Matches the backend's APPROVE_BATCH_MAX_SIZE default
+const APPROVE_BATCH_SIZE = 500;
+
 const ApprovalsPage = () => {
   const { user, API } = useContext(AuthContext);
   const [pendingExpenses, setPendingExpenses] = useState([]);
@@ -34,15 +40,21 @@ const ApprovalsPage = () => {
   const [selectedExpense, setSelectedExpense] = useState(null);
   const [comment, setComment] = useState('');
   const [processing, setProcessing] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchPendingExpenses();
   }, []);
 
-  const fetchPendingExpenses = async () => {
+  // Refresh when expenses are submitted or decided elsewhere
+  useExpenseEvents(API, () => fetchPendingExpenses());
+
+  const fetchPendingExpenses = async (after = null) => {
     try {
-      const response = await axios.get(`${API}/expenses/pending`);
-      setPendingExpenses(response.data);
+      const response = await axios.get(`${API}/expenses/pending`, { params: after ? { after } : {} });
+      setPendingExpenses(prev => after ? [...prev, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Failed to fetch pending expenses:', error);
       toast.error('Failed to load pending expenses');
@@ -51,6 +63,12 @@ const ApprovalsPage = () => {
     }
   };
 
+  const loadMorePendingExpenses = async () => {
+    setLoadingMore(true);
+    await fetchPendingExpenses(nextCursor);
+    setLoadingMore(false);
+  };
+
   const handleApprovalAction = async (expenseId, action) => {
     setProcessing(true);
     
@@ -68,6 +86,13 @@ const ApprovalsPage = () => {
       setComment('');
       
     } catch (error) {
+      if (error.response?.status === 409) {
+        // Someone else already decided this expense
+        toast.error(error.response.data.detail);
+        setPendingExpenses(prev => prev.filter(exp => exp.id !== expenseId));
+        setSelectedExpense(null);
+        return;
+      }
       console.error(`Failed to ${action} expense:`, error);
       toast.error(`Failed to ${action} expense. Please try again.`);
     } finally {
@@ -75,6 +100,66 @@ const ApprovalsPage = () => {
     }
   };
 
+  const handleBatchAction = async (action) => {
+    setProcessing(true);
+    
+    try {
+      // Acts on the expenses loaded so far, in batches the endpoint accepts
+      const expenseIds = pendingExpenses.map(exp => exp.id);
+      let succeeded = 0;
+      let failed = 0;
+      const results = [];
+      for (let start = 0; start < expenseIds.length; start += APPROVE_BATCH_SIZE) {
+        const response = await axios.post(`${API}/expenses/approve-batch`, {
+          expense_ids: expenseIds.slice(start, start + APPROVE_BATCH_SIZE),
+          action
+        });
+        succeeded += response.data.succeeded;
+        failed += response.data.failed;
+        results.push(...response.data.results);
+      }
+
+      if (failed > 0) {
+        toast.warning(`${succeeded} expenses ${action}d, ${failed} could not be updated`);
+      } else {
+        toast.success(`${succeeded} expenses ${action}d successfully!`);
+      }
+      
+      // Remove processed expenses from pending list
+      const processedIds = new Set(
+        results.filter(result => result.outcome !== 'not_found').map(result => result.id)
+      );
+      setPendingExpenses(prev => prev.filter(exp => !processedIds.has(exp.id)));
+      // More were waiting beyond the loaded pages; show them now
+      if (nextCursor) fetchPendingExpenses();
+      
+    } catch (error) {
+      console.error(`Failed to ${action} expenses:`, error);
+      toast.error(`Failed to ${action} expenses. Please try again.`);
+    } finally {
+      setProcessing(false);
+    }
+  };
+
+  const openReceipt = async (expense) => {
+    try {
+      // Receipts need the auth header, so fetch them rather than linking directly
+      // Show the downscaled preview when one exists instead of the full-size upload
+      const variant = expense.receipt_variants?.preview ? 'preview' : 'original';
+      const response = await axios.get(`${API}/expenses/${expense.id}/receipt`, {
+        params: { variant },
+        responseType: 'blob'
+      });
+      const url = URL.createObjectURL(response.data);
+      window.open(url, '_blank');
+      // The new tab has loaded the blob by then; free it rather than keep it for the page's lifetime
+      setTimeout(() => URL.revokeObjectURL(url), RECEIPT_URL_TTL_MS);
+    } catch (error) {
+      console.error('Failed to load receipt:', error);
+      toast.error('Failed to load receipt');
+    }
+  };
+
   const formatCurrency = (amount) => {
     return new Intl.NumberFormat('en-US', {
       style: 'currency',
@@ -140,6 +225,17 @@ const ApprovalsPage = () => {
           <p className="mt-1 p-3 bg-gray-50 rounded-md">{expense.description}</p>
         </div>
 
+        {expense.receipt_url && (
+          <Button
+            variant="outline"
+            onClick={() => openReceipt(expense)}
+            data-testid="view-receipt-button"
+          >
+            <Receipt className="h-4 w-4 mr-2" />
+            View Receipt
+          </Button>
+        )}
+
         {/* Comment Section */}
         <div>
           <Label htmlFor="approval-comment" className="text-sm font-medium">
@@ -211,7 +307,7 @@ const ApprovalsPage = () => {
         <div className="flex items-center space-x-2 px-4 py-2 bg-yellow-100 text-yellow-800 rounded-full">
           <Clock className="h-4 w-4" />
           <span className="font-medium" data-testid="pending-count-badge">
-            {pendingExpenses.length} Pending
+            {pendingExpenses.length}{nextCursor ? '+' : ''} Pending
           </span>
         </div>
       </div>
@@ -269,8 +365,31 @@ const ApprovalsPage = () => {
 
       {/* Expenses List */}
       <Card className="glass-effect border-0 shadow-lg">
-        <CardHeader>
+        <CardHeader className="flex flex-row items-center justify-between">
           <CardTitle>Expenses Awaiting Approval</CardTitle>
+          {pendingExpenses.length > 1 && (
+            <div className="flex space-x-2">
+              <Button
+                onClick={() => handleBatchAction('reject')}
+                disabled={processing}
+                variant="outline"
+                className="border-red-300 text-red-700 hover:bg-red-50"
+                data-testid="reject-all-button"
+              >
+                <XCircle className="h-4 w-4 mr-2" />
+                {nextCursor ? `Reject Loaded (${pendingExpenses.length})` : 'Reject All'}
+              </Button>
+              <Button
+                onClick={() => handleBatchAction('approve')}
+                disabled={processing}
+                className="bg-green-600 hover:bg-green-700 text-white"
+                data-testid="approve-all-button"
+              >
+                <CheckCircle className="h-4 w-4 mr-2" />
+                {nextCursor ? `Approve Loaded (${pendingExpenses.length})` : 'Approve All'}
+              </Button>
+            </div>
+          )}
         </CardHeader>
         <CardContent>
           {pendingExpenses.length === 0 ? (
@@ -337,6 +456,17 @@ const ApprovalsPage = () => {
                               <Clock className="w-3 h-3 mr-1" />
                               Pending Review
                             </Badge>
+
+                            {expense.possible_duplicate_of?.length > 0 && (
+                              <Badge
+                                className="bg-red-100 text-red-700 border-red-200"
+                                title={`Same receipt as ${expense.possible_duplicate_of.length} other expense(s)`}
+                                data-testid={`possible-duplicate-${expense.id}`}
+                              >
+                                <AlertTriangle className="w-3 h-3 mr-1" />
+                                Possible Duplicate
+                              </Badge>
+                            )}
                           </div>
                           
                           <Dialog>
@@ -367,6 +497,19 @@ const ApprovalsPage = () => {
               ))}
             </div>
           )}
+
+          {nextCursor && (
+            <div className="flex justify-center pt-6">
+              <Button
+                variant="outline"
+                onClick={loadMorePendingExpenses}
+                disabled={loadingMore}
+                data-testid="load-more-pending-button"
+              >
+                {loadingMore ? 'Loading...' : 'Load More'}
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
     </div>
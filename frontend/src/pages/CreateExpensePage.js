@@ -72,6 +72,18 @@ const CreateExpensePage = () => {
     }
   };
 
+  const waitForReceiptJob = async (jobId) => {
+    // Receipt OCR runs in the background; poll until the job finishes
+    for (let attempt = 0; attempt < 60; attempt++) {
+      const response = await axios.get(`${API}/receipt-jobs/${jobId}`);
+      if (response.data.status === 'succeeded' || response.data.status === 'failed') {
+        return response.data;
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+    throw new Error('Timed out waiting for receipt processing');
+  };
+
   const handleOCRExtraction = async () => {
     if (!selectedFile) {
       toast.error('Please select a receipt image first');
@@ -89,8 +101,13 @@ const CreateExpensePage = () => {
         },
       });
 
-      if (response.data.ocr_data && !response.data.ocr_data.error) {
-        const extracted = response.data.ocr_data;
+      // Receipts seen before come back already processed from the OCR cache
+      const job = response.data.status === 'succeeded'
+        ? response.data
+        : await waitForReceiptJob(response.data.job_id);
+
+      if (job.status === 'succeeded' && job.ocr_data) {
+        const extracted = job.ocr_data;
         setOcrData(extracted);
         
         // Auto-fill form with extracted data
@@ -103,6 +120,9 @@ const CreateExpensePage = () => {
         }));
 
         toast.success('Receipt data extracted successfully! 🎉');
+        if (job.expense?.possible_duplicate_of?.length) {
+          toast.warning('This receipt was already submitted. Your approver will see it flagged as a possible duplicate.');
+        }
         
         // Navigate to expenses page after successful creation
         setTimeout(() => {
@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { AuthContext } from '../App';
+import { useExpenseEvents } from '@/hooks/use-expense-events';
 import { Card, CardHeader, CardTitle, CardContent } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -30,11 +31,14 @@ const DashboardPage = () => {
     fetchDashboardData();
   }, []);
 
+  // Refresh when expenses are submitted or decided elsewhere
+  useExpenseEvents(API, () => fetchDashboardData());
+
   const fetchDashboardData = async () => {
     try {
       const [statsResponse, expensesResponse] = await Promise.all([
         axios.get(`${API}/dashboard/stats`),
-        axios.get(`${API}/expenses`)
+        axios.get(`${API}/expenses`, { params: { limit: 5 } })
       ]);
       
       setStats(statsResponse.data);
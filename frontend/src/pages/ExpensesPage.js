@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useContext } from 'react';
+import React, { useState, useEffect, useContext, useRef } from 'react';
 import { AuthContext } from '../App';
 import { Card, CardHeader, CardTitle, CardContent } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
@@ -21,6 +21,8 @@ import { Link } from 'react-router-dom';
 import axios from 'axios';
 import { toast } from 'sonner';
 
+const SEARCH_DELAY_MS = 300;
+
 const ExpensesPage = () => {
   const { API } = useContext(AuthContext);
   const [expenses, setExpenses] = useState([]);
@@ -29,19 +31,43 @@ const ExpensesPage = () => {
   const [searchTerm, setSearchTerm] = useState('');
   const [statusFilter, setStatusFilter] = useState('all');
   const [categoryFilter, setCategoryFilter] = useState('all');
+  const [categories, setCategories] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [searchPage, setSearchPage] = useState(1);
+  const [searchHasMore, setSearchHasMore] = useState(false);
+  const [searchTotal, setSearchTotal] = useState(0);
+  const searchRequest = useRef(0);
+  const query = searchTerm.trim();
 
+  // Status and category are filtered server-side, so changing them refetches from the first page
   useEffect(() => {
     fetchExpenses();
-  }, []);
+  }, [statusFilter, categoryFilter]);
 
+  // Searching goes to the server (all visible expenses, best matches first);
+  // without a query the list shows the pages loaded so far
   useEffect(() => {
-    filterExpenses();
-  }, [expenses, searchTerm, statusFilter, categoryFilter]);
+    if (!query) {
+      searchRequest.current += 1;
+      setFilteredExpenses(expenses);
+      return undefined;
+    }
+    const timer = setTimeout(() => searchExpenses(), SEARCH_DELAY_MS);
+    return () => clearTimeout(timer);
+  }, [expenses, query]);
+
+  const fetchExpenses = async (after = null) => {
+    const params = {};
+    if (statusFilter !== 'all') params.status = statusFilter;
+    if (categoryFilter !== 'all') params.category = categoryFilter;
+    if (after) params.after = after;
 
-  const fetchExpenses = async () => {
     try {
-      const response = await axios.get(`${API}/expenses`);
-      setExpenses(response.data);
+      const response = await axios.get(`${API}/expenses`, { params });
+      setExpenses(prev => after ? [...prev, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+      setCategories(prev => [...new Set([...prev, ...response.data.map(expense => expense.category)])]);
     } catch (error) {
       console.error('Failed to fetch expenses:', error);
       toast.error('Failed to load expenses');
@@ -50,28 +76,34 @@ const ExpensesPage = () => {
     }
   };
 
-  const filterExpenses = () => {
-    let filtered = expenses;
-
-    // Search filter
-    if (searchTerm) {
-      filtered = filtered.filter(expense =>
-        expense.description.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        expense.category.toLowerCase().includes(searchTerm.toLowerCase())
-      );
-    }
+  const searchExpenses = async (page = 1) => {
+    const params = { q: query, page };
+    if (statusFilter !== 'all') params.status = statusFilter;
+    if (categoryFilter !== 'all') params.category = categoryFilter;
+    // Only the latest search may update the list; older responses can arrive late
+    const request = ++searchRequest.current;
 
-    // Status filter
-    if (statusFilter !== 'all') {
-      filtered = filtered.filter(expense => expense.status === statusFilter);
+    try {
+      const response = await axios.get(`${API}/expenses/search`, { params });
+      if (request !== searchRequest.current) return;
+      setFilteredExpenses(prev => page > 1 ? [...prev, ...response.data.results] : response.data.results);
+      setSearchPage(page);
+      setSearchHasMore(response.data.has_more);
+      setSearchTotal(response.data.total);
+    } catch (error) {
+      console.error('Failed to search expenses:', error);
+      toast.error('Failed to search expenses');
     }
+  };
 
-    // Category filter
-    if (categoryFilter !== 'all') {
-      filtered = filtered.filter(expense => expense.category === categoryFilter);
+  const loadMoreExpenses = async () => {
+    setLoadingMore(true);
+    if (query) {
+      await searchExpenses(searchPage + 1);
+    } else {
+      await fetchExpenses(nextCursor);
     }
-
-    setFilteredExpenses(filtered);
+    setLoadingMore(false);
   };
 
   const getStatusColor = (status) => {
@@ -118,7 +150,6 @@ const ExpensesPage = () => {
   };
 
   const getUniqueCategories = () => {
-    const categories = [...new Set(expenses.map(expense => expense.category))];
     return categories;
   };
 
@@ -277,8 +308,8 @@ const ExpensesPage = () => {
       <Card className="glass-effect border-0 shadow-lg">
         <CardHeader>
           <CardTitle className="flex items-center justify-between">
-            <span>Expenses ({filteredExpenses.length})</span>
-            {filteredExpenses.length !== expenses.length && (
+            <span>Expenses ({query ? searchTotal : filteredExpenses.length})</span>
+            {(searchTerm || statusFilter !== 'all' || categoryFilter !== 'all') && (
               <Button
                 variant="outline"
                 size="sm"
@@ -397,6 +428,19 @@ const ExpensesPage = () => {
               ))}
             </div>
           )}
+
+          {(query ? searchHasMore : nextCursor) && (
+            <div className="flex justify-center pt-6">
+              <Button
+                variant="outline"
+                onClick={loadMoreExpenses}
+                disabled={loadingMore}
+                data-testid="load-more-expenses-button"
+              >
+                {loadingMore ? 'Loading...' : 'Load More'}
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
     </div>
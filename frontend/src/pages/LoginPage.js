@@ -1,5 +1,6 @@
-import React, { useState, useContext } from 'react';
+import React, { useState, useEffect, useContext } from 'react';
 import { AuthContext } from '../App';
+import axios from 'axios';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
@@ -9,7 +10,7 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@
 import { Building2, Zap, TrendingUp, Shield } from 'lucide-react';
 
 const LoginPage = () => {
-  const { login, register } = useContext(AuthContext);
+  const { login, register, API } = useContext(AuthContext);
   const [isLoading, setIsLoading] = useState(false);
   const [loginData, setLoginData] = useState({ email: '', password: '' });
   const [registerData, setRegisterData] = useState({
@@ -34,7 +35,7 @@ const LoginPage = () => {
     setIsLoading(false);
   };
 
-  const countries = [
+  const [countries, setCountries] = useState([
     { code: 'US', name: 'United States' },
     { code: 'GB', name: 'United Kingdom' },
     { code: 'CA', name: 'Canada' },
@@ -43,7 +44,23 @@ const LoginPage = () => {
     { code: 'FR', name: 'France' },
     { code: 'IN', name: 'India' },
     { code: 'SG', name: 'Singapore' }
-  ];
+  ]);
+
+  useEffect(() => {
+    fetchCountries();
+  }, []);
+
+  const fetchCountries = async () => {
+    try {
+      const response = await axios.get(`${API}/countries`);
+      if (response.data.length) {
+        setCountries(response.data);
+      }
+    } catch (error) {
+      // Keep the built-in shortlist if the country list is unavailable
+      console.error('Failed to fetch countries:', error);
+    }
+  };
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-slate-50 via-blue-50 to-indigo-100 flex">
@@ -47,6 +47,8 @@ const ManagerTeamExpensesPage = () => {
   const [sortBy, setSortBy] = useState('date');
   const [sortOrder, setSortOrder] = useState('desc');
   const [dateRange, setDateRange] = useState('all');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchTeamExpenses();
@@ -57,10 +59,14 @@ const ManagerTeamExpensesPage = () => {
     filterAndSortExpenses();
   }, [expenses, searchTerm, statusFilter, employeeFilter, sortBy, sortOrder, dateRange]);
 
-  const fetchTeamExpenses = async () => {
+  const fetchTeamExpenses = async (after = null) => {
     try {
-      const response = await axios.get(`${API}/manager/team/expenses`);
-      setExpenses(response.data.expenses || []);
+      const response = await axios.get(`${API}/manager/team/expenses`, {
+        params: after ? { after } : {}
+      });
+      const page = response.data.expenses || [];
+      setExpenses(prev => after ? [...prev, ...page] : page);
+      setNextCursor(response.data.next_cursor || null);
     } catch (error) {
       console.error('Failed to fetch team expenses:', error);
       toast.error('Failed to load team expenses');
@@ -234,6 +240,12 @@ const ManagerTeamExpensesPage = () => {
     toast.success('Expenses exported successfully');
   };
 
+  const loadMoreExpenses = async () => {
+    setLoadingMore(true);
+    await fetchTeamExpenses(nextCursor);
+    setLoadingMore(false);
+  };
+
   const refreshData = () => {
     setLoading(true);
     Promise.all([fetchTeamExpenses(), fetchTeamMembers()]).finally(() => {
@@ -564,6 +576,19 @@ const ManagerTeamExpensesPage = () => {
         ))}
       </div>
 
+      {nextCursor && (
+        <div className="flex justify-center">
+          <Button
+            onClick={loadMoreExpenses}
+            variant="outline"
+            className="bg-white"
+            disabled={loadingMore}
+          >
+            {loadingMore ? 'Loading...' : 'Load More'}
+          </Button>
+        </div>
+      )}
+
       {/* Empty State */}
       {filteredExpenses.length === 0 && !loading && (
         <Card className="bg-white/80 backdrop-blur-sm border-gray-200">
@@ -0,0 +1,103 @@
+"""Approving and rejecting expenses: racing approvers, visibility, rollups."""
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def submit_expense(api, member, amount=42.0) -> dict:
+    response = await api.post("/api/expenses", headers=member["headers"], json={
+        "amount": amount, "currency": "USD", "category": "travel",
+        "description": "Taxi to airport", "date": "2026-03-02T09:00:00Z"
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_racing_approvers_get_one_success_and_one_conflict(api, company):
+    expense = await submit_expense(api, company["employee"])
+
+    responses = await asyncio.gather(
+        api.post(f"/api/expenses/{expense['id']}/approve", headers=company["manager"]["headers"],
+                 json={"action": "approve"}),
+        api.post(f"/api/expenses/{expense['id']}/approve", headers=company["admin"]["headers"],
+                 json={"action": "reject", "comment": "duplicate"})
+    )
+
+    assert sorted(response.status_code for response in responses) == [200, 409]
+    stored = await server.db.expenses.find_one({"id": expense["id"]})
+    assert len(stored["approval_history"]) == 1
+    winner = "approved" if responses[0].status_code == 200 else "rejected"
+    assert stored["status"] == winner
+
+    # The rollups moved the expense out of pending exactly once
+    rollups = await server.db.expense_rollups.find({"employee_id": expense["employee_id"]}).to_list(None)
+    counts = {rollup["status"]: rollup["count"] for rollup in rollups}
+    assert counts.get("pending", 0) == 0
+    assert counts[winner] == 1
+
+
+async def test_decided_expense_cannot_be_flipped(api, company):
+    expense = await submit_expense(api, company["employee"])
+    url = f"/api/expenses/{expense['id']}/approve"
+
+    rejected = await api.post(url, headers=company["manager"]["headers"], json={"action": "reject"})
+    flipped = await api.post(url, headers=company["admin"]["headers"], json={"action": "approve"})
+
+    assert rejected.status_code == 200
+    assert flipped.status_code == 409
+    assert flipped.json()["detail"] == "Expense is already rejected"
+    assert (await server.db.expenses.find_one({"id": expense["id"]}))["status"] == "rejected"
+
+
+async def test_manager_outside_the_chain_cannot_approve(api, company):
+    expense = await submit_expense(api, company["employee"])
+
+    response = await api.post(f"/api/expenses/{expense['id']}/approve", headers=company["manager2"]["headers"],
+                              json={"action": "approve"})
+
+    assert response.status_code == 403
+    assert (await server.db.expenses.find_one({"id": expense["id"]}))["status"] == "pending"
+
+
+async def test_other_company_gets_not_found(api, company):
+    expense = await submit_expense(api, company["employee"])
+    response = await api.post("/api/auth/register", json={
+        "email": "rival@example.org", "password": "correct-horse", "full_name": "Rival", "company_name": "Rival Co"
+    })
+    rival = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = await api.post(f"/api/expenses/{expense['id']}/approve", headers=rival, json={"action": "approve"})
+
+    assert response.status_code == 404
+    assert (await server.db.expenses.find_one({"id": expense["id"]}))["status"] == "pending"
+
+
+async def test_employee_cannot_approve(api, company):
+    expense = await submit_expense(api, company["employee"])
+
+    response = await api.post(f"/api/expenses/{expense['id']}/approve", headers=company["employee"]["headers"],
+                              json={"action": "approve"})
+
+    assert response.status_code == 403
+
+
+async def test_approval_keeps_the_owner_chain_on_rollups(api, company):
+    expense = await submit_expense(api, company["employee"])
+    manager_id = company["manager"]["user"]["id"]
+
+    response = await api.post(f"/api/expenses/{expense['id']}/approve", headers=company["manager"]["headers"],
+                              json={"action": "approve"})
+
+    assert response.status_code == 200
+    rollups = await server.db.expense_rollups.find({"employee_id": expense["employee_id"]}).to_list(None)
+    assert {rollup["status"] for rollup in rollups} == {"pending", "approved"}
+    for rollup in rollups:
+        assert rollup["manager_id"] == manager_id
+        assert manager_id in rollup["ancestor_ids"]
+    # The manager's rollup-backed views still see the approved expense
+    visible = await server.db.expense_rollups.count_documents({"ancestor_ids": manager_id, "status": "approved"})
+    assert visible == 1
@@ -0,0 +1,44 @@
+"""Bulk expense import: CSV decoding and the request size limit."""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+CSV = "amount,currency,category,description,date\n12.5,USD,meals,Lunch,2026-03-02T12:00:00Z\n"
+
+
+async def test_csv_upload_is_imported(api, company):
+    response = await api.post("/api/expenses/bulk", headers=company["employee"]["headers"],
+                              files={"file": ("expenses.csv", CSV.encode(), "text/csv")})
+
+    assert response.status_code == 200, response.text
+    assert (response.json()["inserted"], response.json()["failed"]) == (1, 0)
+
+
+async def test_non_utf8_csv_is_rejected(api, company):
+    body = CSV.replace("Lunch", "Café").encode("latin-1")
+
+    response = await api.post("/api/expenses/bulk", content=body,
+                              headers={**company["employee"]["headers"], "Content-Type": "text/csv"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "CSV must be UTF-8 encoded"
+
+
+async def test_oversized_upload_is_rejected_before_parsing(api, company, monkeypatch):
+    monkeypatch.setattr(server, "BULK_IMPORT_MAX_BYTES", 64)
+
+    def no_parse(content):
+        raise AssertionError("oversized body was parsed")
+    monkeypatch.setattr(server, "parse_bulk_csv", no_parse)
+
+    for request in (
+        {"files": {"file": ("expenses.csv", CSV.encode() * 4, "text/csv")}},
+        {"content": CSV.encode() * 4, "headers": {"Content-Type": "text/csv"}},
+    ):
+        headers = {**company["employee"]["headers"], **request.pop("headers", {})}
+        response = await api.post("/api/expenses/bulk", headers=headers, **request)
+        assert response.status_code == 413
+
+    assert await server.db.expenses.count_documents({}) == 0
@@ -0,0 +1,81 @@
+"""ETags from per-company/per-user data versions, and 304s before any expense query."""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+EXPENSE = {"amount": 12.5, "currency": "USD", "category": "meals", "description": "Lunch", "date": "2026-03-02T12:00:00Z"}
+
+
+async def revalidate(api, url, member, etag):
+    return await api.get(url, headers={**member["headers"], "If-None-Match": etag})
+
+
+async def test_unchanged_list_is_answered_with_304_without_querying(api, company, monkeypatch):
+    await api.post("/api/expenses", headers=company["admin"]["headers"], json=EXPENSE)
+    first = await api.get("/api/expenses", headers=company["admin"]["headers"])
+    assert first.status_code == 200
+    assert first.headers["cache-control"] == server.DATA_CACHE_CONTROL
+
+    async def no_query(*args, **kwargs):
+        raise AssertionError("expense query ran for a matching If-None-Match")
+    monkeypatch.setattr(server, "fetch_expense_page", no_query)
+
+    second = await revalidate(api, "/api/expenses", company["admin"], first.headers["etag"])
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["etag"] == first.headers["etag"]
+
+
+async def test_write_changes_the_etag(api, company):
+    first = await api.get("/api/expenses", headers=company["manager"]["headers"])
+
+    await api.post("/api/expenses", headers=company["employee"]["headers"], json=EXPENSE)
+
+    second = await revalidate(api, "/api/expenses", company["manager"], first.headers["etag"])
+    assert second.status_code == 200
+    assert second.headers["etag"] != first.headers["etag"]
+    assert len(second.json()) == 1
+
+
+async def test_employee_etag_ignores_colleagues_writes(api, company):
+    first = await api.get("/api/expenses", headers=company["employee"]["headers"])
+
+    await api.post("/api/expenses", headers=company["manager2"]["headers"], json=EXPENSE)
+
+    second = await revalidate(api, "/api/expenses", company["employee"], first.headers["etag"])
+    assert second.status_code == 304
+
+
+async def test_etag_depends_on_query_and_caller(api, company):
+    admin_all = await api.get("/api/expenses", headers=company["admin"]["headers"])
+    admin_pending = await api.get("/api/expenses?status=pending", headers=company["admin"]["headers"])
+    manager_all = await api.get("/api/expenses", headers=company["manager"]["headers"])
+
+    assert len({admin_all.headers["etag"], admin_pending.headers["etag"], manager_all.headers["etag"]}) == 3
+    reused = await revalidate(api, "/api/expenses", company["manager"], admin_all.headers["etag"])
+    assert reused.status_code == 200
+
+
+async def test_pending_list_revalidates_until_an_approval(api, company):
+    created = await api.post("/api/expenses", headers=company["employee"]["headers"], json=EXPENSE)
+    first = await api.get("/api/expenses/pending", headers=company["manager"]["headers"])
+    assert len(first.json()) == 1
+
+    unchanged = await revalidate(api, "/api/expenses/pending", company["manager"], first.headers["etag"])
+    assert unchanged.status_code == 304
+
+    await api.post(f"/api/expenses/{created.json()['id']}/approve", headers=company["manager"]["headers"],
+                   json={"action": "approve"})
+    changed = await revalidate(api, "/api/expenses/pending", company["manager"], first.headers["etag"])
+    assert changed.status_code == 200
+    assert changed.json() == []
+
+
+def test_etag_matching_is_weak_and_accepts_lists():
+    assert server.etag_matches('W/"v1"', '"v1"')
+    assert server.etag_matches('"v0", W/"v1"', '"v1"')
+    assert server.etag_matches("*", '"v1"')
+    assert not server.etag_matches('"v0"', '"v1"')
+    assert not server.etag_matches(None, '"v1"')
@@ -0,0 +1,123 @@
+"""CurrencyRateService against a stubbed exchange-rate API (httpx.MockTransport)."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class RatesApiStub:
+    """Stand-in for exchangerate-api: counts requests, can stall or fail."""
+
+    def __init__(self, rates=None):
+        self.rates = rates or {"USD": 1.0, "EUR": 0.9}
+        self.requests = 0
+        self.delay = 0.0
+        self.error = None
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        base = request.url.path.rsplit("/", 1)[-1]
+        return httpx.Response(200, json={"base": base, "rates": self.rates})
+
+
+def make_service(stub: RatesApiStub, ttl: int = 3600, retry_after: int = 60) -> server.CurrencyRateService:
+    service = server.CurrencyRateService("https://rates.test/v4/latest", ttl=ttl, timeout=1, retry_after=retry_after)
+    service._http = httpx.AsyncClient(transport=httpx.MockTransport(stub))
+    return service
+
+
+async def test_fresh_rates_are_served_from_cache(db):
+    stub = RatesApiStub()
+    service = make_service(stub)
+
+    assert await service.get_rates("usd") == stub.rates
+    assert await service.get_rates("USD") == stub.rates
+
+    assert stub.requests == 1
+    assert (service.misses, service.hits) == (1, 1)
+    persisted = await db.currency_rates.find_one({"base": "USD"})
+    assert persisted["rates"] == stub.rates
+
+
+async def test_expired_rates_are_served_stale_and_refreshed_in_background(db):
+    stub = RatesApiStub()
+    service = make_service(stub, ttl=60)
+    await service.get_rates("USD")
+    service._rates["USD"]["fetched_at"] -= timedelta(seconds=61)
+    stub.rates = {"USD": 1.0, "EUR": 0.8}
+
+    stale = await service.get_rates("USD")
+    assert stale["EUR"] == 0.9
+    assert service.stale_hits == 1
+
+    await asyncio.gather(*service._refreshes.values())
+    assert await service.get_rates("USD") == {"USD": 1.0, "EUR": 0.8}
+    assert stub.requests == 2
+
+
+async def test_concurrent_misses_share_one_upstream_request(db):
+    stub = RatesApiStub()
+    stub.delay = 0.05
+    service = make_service(stub)
+
+    results = await asyncio.gather(*(service.get_rates("EUR") for _ in range(20)))
+
+    assert all(rates == stub.rates for rates in results)
+    assert stub.requests == 1
+    assert service.upstream_fetches == 1
+
+
+async def test_timeout_without_snapshot_raises_and_backs_off(db):
+    stub = RatesApiStub()
+    stub.error = httpx.ReadTimeout("upstream too slow")
+    service = make_service(stub)
+
+    with pytest.raises(server.CurrencyRatesUnavailable):
+        await service.get_rates("USD")
+    # Within retry_after the failed upstream is not asked again
+    with pytest.raises(server.CurrencyRatesUnavailable):
+        await service.get_rates("USD")
+
+    assert stub.requests == 1
+    assert service.upstream_failures == 1
+
+
+async def test_cold_start_serves_persisted_snapshot_when_upstream_is_down(db):
+    await db.currency_rates.insert_one({
+        "base": "USD",
+        "rates": {"USD": 1.0, "GBP": 0.75},
+        "fetched_at": datetime.now(timezone.utc) - timedelta(days=2)
+    })
+    stub = RatesApiStub()
+    stub.error = httpx.ConnectError("offline")
+    service = make_service(stub, ttl=3600)
+
+    assert await service.get_rates("USD") == {"USD": 1.0, "GBP": 0.75}
+    assert service.stale_hits == 1
+
+    # The background refresh fails; the persisted snapshot keeps being served
+    await asyncio.gather(*service._refreshes.values(), return_exceptions=True)
+    assert await service.get_rates("USD") == {"USD": 1.0, "GBP": 0.75}
+    assert service.upstream_failures == 1
+
+
+async def test_fresh_persisted_snapshot_needs_no_upstream(db):
+    await db.currency_rates.insert_one({
+        "base": "EUR",
+        "rates": {"EUR": 1.0, "USD": 1.1},
+        "fetched_at": datetime.now(timezone.utc)
+    })
+    stub = RatesApiStub()
+    service = make_service(stub)
+
+    assert await service.get_rates("EUR") == {"EUR": 1.0, "USD": 1.1}
+    assert stub.requests == 0
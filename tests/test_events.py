@@ -0,0 +1,66 @@
+"""Expense event stream: who receives which events, and stream-token auth."""
+import asyncio
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+EXPENSE = {"amount": 9.0, "currency": "USD", "category": "meals", "description": "Coffee", "date": "2026-03-02T08:00:00Z"}
+
+
+async def open_stream(member):
+    stream = server.event_stream(server.User(**member["user"]), heartbeat=60)
+    assert (await stream.__anext__()).startswith("retry:")
+    return stream
+
+
+async def received(stream) -> list:
+    """(event, employee_id) of every event already queued for the stream."""
+    events = []
+    while True:
+        try:
+            message = await asyncio.wait_for(stream.__anext__(), timeout=0.05)
+        except asyncio.TimeoutError:
+            return events
+        event, data = message.split("\n")[:2]
+        events.append((event.partition(": ")[2], json.loads(data.partition(": ")[2])["employee_id"]))
+
+
+async def test_events_reach_only_the_owner_their_managers_and_admins(api, company, monkeypatch):
+    monkeypatch.setattr(server, "event_broker", server.EventBroker(queue_size=10, max_subscribers=10))
+    streams = {key: await open_stream(company[key]) for key in ("admin", "manager", "manager2", "employee")}
+    employee_id = company["employee"]["user"]["id"]
+    manager2_id = company["manager2"]["user"]["id"]
+
+    await api.post("/api/expenses", headers=company["employee"]["headers"], json=EXPENSE)
+    await api.post("/api/expenses", headers=company["manager2"]["headers"], json=EXPENSE)
+
+    assert await received(streams["employee"]) == [("expense.created", employee_id)]
+    assert await received(streams["manager"]) == [("expense.created", employee_id)]
+    assert await received(streams["manager2"]) == [("expense.created", manager2_id)]
+    assert sorted(await received(streams["admin"])) == sorted(
+        [("expense.created", employee_id), ("expense.created", manager2_id)]
+    )
+    for stream in streams.values():
+        await stream.aclose()
+    assert server.event_broker.subscriber_count == 0
+
+
+async def test_stream_requires_a_stream_token_in_the_query(api, company):
+    session_token = company["employee"]["headers"]["Authorization"].split()[1]
+
+    refused = await api.get("/api/events", params={"token": session_token})
+    assert refused.status_code == 401
+
+    issued = await api.post("/api/events/token", headers=company["employee"]["headers"])
+    assert issued.status_code == 200
+    stream_token = issued.json()["token"]
+    user = await server.get_event_stream_user(token=stream_token, credentials=None)
+    assert user.id == company["employee"]["user"]["id"]
+
+    # The stream token is good for nothing else
+    me = await api.get("/api/auth/me", headers={"Authorization": f"Bearer {stream_token}"})
+    assert me.status_code == 401
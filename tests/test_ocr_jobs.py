@@ -0,0 +1,150 @@
+"""Receipt OCR job queue: leases, retries, idempotent expense creation, spool cleanup."""
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class FailingOcrBackend(server.FakeOcrBackend):
+    """FakeOcrBackend that fails every extraction, remembering the paths it was given."""
+
+    def __init__(self):
+        super().__init__()
+        self.paths = []
+
+    async def extract(self, image_path: str, mime_type: str) -> dict:
+        self.paths.append(image_path)
+        assert os.path.exists(image_path)
+        raise RuntimeError("OCR backend down")
+
+
+class InMemoryGridFSStore(server.GridFSBlobStore):
+    """GridFSBlobStore with blobs in a dict, so local_path spools to a temp file as in production."""
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    async def size(self, sha256):
+        return len(self.blobs[sha256])
+
+    async def read_range(self, sha256, start, end):
+        yield self.blobs[sha256][start:end + 1]
+
+
+@pytest.fixture
+async def ocr(db, monkeypatch):
+    # The unique index on expenses.id is what makes a retried job's insert a no-op
+    await server.ensure_indexes()
+    monkeypatch.setattr(server, "ocr_backend", server.FakeOcrBackend())
+    monkeypatch.setattr(server, "ocr_result_cache", server.OcrResultCache(max_entries=1000))
+    monkeypatch.setattr(server, "OCR_RETRY_BACKOFF_SECONDS", 5)
+    return db
+
+
+async def queue_receipt(db, body: bytes = b"\xff\xd8\xff receipt") -> dict:
+    user = server.User(email="ann@example.com", full_name="Ann", role="employee", company_id="company-1")
+    await db.users.insert_one(user.dict())
+    blob = await server.receipt_store.save(server.BytesReader(body))
+    # No derived images: OCR reads the original
+    await db.receipt_variants.update_one({"_id": blob.sha256}, {"$set": {"variants": {}}}, upsert=True)
+    return await server.enqueue_receipt_job(server.new_receipt_job(user, blob.sha256, "image/jpeg", {}))
+
+
+async def expire_lease(db, job_id: str):
+    await db.ocr_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+
+
+async def make_due(db, job_id: str):
+    await db.ocr_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"run_after": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+
+
+async def test_claim_leases_job_until_lease_expires(ocr):
+    queued = await queue_receipt(ocr)
+
+    claimed = await server.claim_ocr_job()
+    assert claimed["id"] == queued["id"]
+    assert (claimed["status"], claimed["attempts"]) == ("running", 1)
+    assert await server.claim_ocr_job() is None
+
+    await expire_lease(ocr, queued["id"])
+    reclaimed = await server.claim_ocr_job()
+    assert reclaimed["id"] == queued["id"]
+    assert reclaimed["attempts"] == 2
+
+
+async def test_successful_job_creates_expense_from_ocr_data(ocr):
+    queued = await queue_receipt(ocr)
+
+    await server.run_ocr_job(await server.claim_ocr_job())
+
+    job = await ocr.ocr_jobs.find_one({"id": queued["id"]})
+    expense = await ocr.expenses.find_one({"id": queued["expense_id"]})
+    assert job["status"] == "succeeded"
+    assert expense["merchant"] == job["ocr_data"]["merchant_name"]
+    assert expense["amount"] == job["ocr_data"]["amount"]
+
+
+async def test_failed_job_retries_with_backoff_then_fails(ocr, monkeypatch):
+    monkeypatch.setattr(server, "ocr_backend", FailingOcrBackend())
+    queued = await queue_receipt(ocr)
+
+    for attempt in range(1, server.OCR_MAX_ATTEMPTS):
+        before = datetime.now(timezone.utc)
+        await server.run_ocr_job(await server.claim_ocr_job())
+        job = await ocr.ocr_jobs.find_one({"id": queued["id"]})
+        assert (job["status"], job["attempts"]) == ("queued", attempt)
+        backoff = (job["run_after"].replace(tzinfo=timezone.utc) - before).total_seconds()
+        assert backoff == pytest.approx(5 * 2 ** (attempt - 1), abs=1)
+        # Not runnable again until the backoff has passed
+        assert await server.claim_ocr_job() is None
+        await make_due(ocr, queued["id"])
+
+    await server.run_ocr_job(await server.claim_ocr_job())
+    job = await ocr.ocr_jobs.find_one({"id": queued["id"]})
+    assert (job["status"], job["attempts"]) == ("failed", server.OCR_MAX_ATTEMPTS)
+    assert job["error"] == "OCR backend down"
+    assert await server.claim_ocr_job() is None
+    assert await ocr.expenses.count_documents({}) == 0
+
+
+async def test_retried_job_does_not_create_a_second_expense(ocr):
+    queued = await queue_receipt(ocr)
+    first = await server.claim_ocr_job()
+    # The worker created the expense, then lost its lease before marking the job done
+    await server.create_expense_from_receipt_job(first, await server.ocr_backend.extract(
+        str(server.receipt_store.path(first["receipt_sha256"])), "image/jpeg"
+    ))
+    await expire_lease(ocr, queued["id"])
+
+    await server.run_ocr_job(await server.claim_ocr_job())
+
+    assert await ocr.expenses.count_documents({}) == 1
+    assert await ocr.expenses.count_documents({"id": queued["expense_id"]}) == 1
+    assert (await ocr.ocr_jobs.find_one({"id": queued["id"]}))["status"] == "succeeded"
+    rollups = await ocr.expense_rollups.find({}).to_list(None)
+    assert sum(rollup["count"] for rollup in rollups) == 1
+
+
+async def test_spool_file_is_removed_after_final_failure(ocr, monkeypatch):
+    queued = await queue_receipt(ocr)
+    store = InMemoryGridFSStore({queued["receipt_sha256"]: b"\xff\xd8\xff receipt"})
+    backend = FailingOcrBackend()
+    monkeypatch.setattr(server, "receipt_store", store)
+    monkeypatch.setattr(server, "ocr_backend", backend)
+    await ocr.ocr_jobs.update_one({"id": queued["id"]}, {"$set": {"max_attempts": 1}})
+
+    await server.run_ocr_job(await server.claim_ocr_job())
+
+    assert (await ocr.ocr_jobs.find_one({"id": queued["id"]}))["status"] == "failed"
+    assert len(backend.paths) == 1
+    assert not os.path.exists(backend.paths[0])
@@ -0,0 +1,79 @@
+"""Reparenting in the org tree: re-stamped chains, team access, batch approvals, cycles."""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+EXPENSE = {"amount": 30.0, "currency": "USD", "category": "travel", "description": "Train", "date": "2026-03-02T09:00:00Z"}
+
+
+async def set_manager(api, company, key, manager_key):
+    manager_id = company[manager_key]["user"]["id"] if manager_key else ""
+    return await api.patch(f"/api/admin/users/{company[key]['user']['id']}",
+                           headers=company["admin"]["headers"], json={"manager_id": manager_id})
+
+
+async def batch_approve(api, member, expense_id) -> str:
+    response = await api.post("/api/expenses/approve-batch", headers=member["headers"],
+                              json={"expense_ids": [expense_id], "action": "approve"})
+    assert response.status_code == 200, response.text
+    return response.json()["results"][0]["outcome"]
+
+
+@pytest.fixture
+async def chain(api, company):
+    """employee reports to manager2, who has no manager yet; employee has one pending expense."""
+    assert (await set_manager(api, company, "employee", "manager2")).status_code == 200
+    response = await api.post("/api/expenses", headers=company["employee"]["headers"], json=EXPENSE)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def ancestors(user_id: str):
+    return (await server.db.users.find_one({"id": user_id}))["ancestor_ids"]
+
+
+async def test_reparenting_a_mid_level_manager_restamps_the_subtree(api, company, chain):
+    top, mid = company["manager"]["user"]["id"], company["manager2"]["user"]["id"]
+    employee_id = company["employee"]["user"]["id"]
+    assert await server.org_cache.subtree(company["admin"]["user"]["company_id"], top) == []
+
+    assert (await set_manager(api, company, "manager2", "manager")).status_code == 200
+
+    assert await ancestors(mid) == [top]
+    assert await ancestors(employee_id) == [top, mid]
+    expense = await server.db.expenses.find_one({"id": chain["id"]})
+    assert (expense["manager_id"], expense["ancestor_ids"]) == (mid, [top, mid])
+    rollups = await server.db.expense_rollups.find({"employee_id": employee_id}).to_list(None)
+    assert rollups and all(rollup["ancestor_ids"] == [top, mid] for rollup in rollups)
+    assert sorted(await server.org_cache.subtree(company["admin"]["user"]["company_id"], top)) == sorted([mid, employee_id])
+
+    # The new top manager reaches the expense through the re-stamped chain
+    pending = await api.get("/api/expenses/pending", headers=company["manager"]["headers"])
+    assert [expense["id"] for expense in pending.json()] == [chain["id"]]
+    assert await batch_approve(api, company["manager"], chain["id"]) == "approved"
+
+
+async def test_moving_a_manager_away_revokes_the_old_chain(api, company, chain):
+    assert (await set_manager(api, company, "manager2", "manager")).status_code == 200
+    assert (await set_manager(api, company, "manager2", None)).status_code == 200
+
+    assert await ancestors(company["employee"]["user"]["id"]) == [company["manager2"]["user"]["id"]]
+    assert await batch_approve(api, company["manager"], chain["id"]) == "not_found"
+    assert await batch_approve(api, company["manager2"], chain["id"]) == "approved"
+
+
+async def test_manager_cannot_report_to_their_own_descendant(api, company, chain):
+    assert (await set_manager(api, company, "manager2", "manager")).status_code == 200
+    before = {user["id"]: user.get("ancestor_ids") async for user in server.db.users.find({})}
+
+    into_subtree = await set_manager(api, company, "manager", "manager2")
+    to_self = await set_manager(api, company, "manager", "manager")
+
+    assert (into_subtree.status_code, into_subtree.json()["detail"]) == \
+        (400, "Manager assignment would create a reporting cycle")
+    assert to_self.status_code == 400
+    after = {user["id"]: user.get("ancestor_ids") async for user in server.db.users.find({})}
+    assert after == before
+    assert (await server.db.users.find_one({"id": company["manager"]["user"]["id"]})).get("manager_id") is None
@@ -0,0 +1,72 @@
+"""Cached principals in get_current_user: admin changes must apply on the next request."""
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def patch_user(api, company, key, **changes):
+    response = await api.patch(f"/api/admin/users/{company[key]['user']['id']}",
+                               headers=company["admin"]["headers"], json=changes)
+    assert response.status_code == 200, response.text
+    return response
+
+
+async def test_role_change_applies_to_the_cached_principal(api, company):
+    employee = company["employee"]
+    assert (await api.get("/api/expenses/pending", headers=employee["headers"])).status_code == 403
+    assert server.principal_cache.get(employee["user"]["email"]).role == "employee"
+
+    await patch_user(api, company, "employee", role="manager")
+
+    assert server.principal_cache.get(employee["user"]["email"]) is None
+    assert (await api.get("/api/expenses/pending", headers=employee["headers"])).status_code == 200
+
+
+async def test_demotion_revokes_access_immediately(api, company):
+    manager = company["manager"]
+    assert (await api.get("/api/expenses/pending", headers=manager["headers"])).status_code == 200
+
+    await patch_user(api, company, "manager", role="employee")
+
+    assert (await api.get("/api/expenses/pending", headers=manager["headers"])).status_code == 403
+
+
+async def test_deactivated_user_is_refused_despite_a_cached_principal(api, company):
+    employee = company["employee"]
+    assert (await api.get("/api/auth/me", headers=employee["headers"])).status_code == 200
+
+    await patch_user(api, company, "employee", is_active=False)
+
+    assert (await api.get("/api/auth/me", headers=employee["headers"])).status_code == 401
+
+
+async def test_reparent_invalidates_the_moved_user_and_their_reports(api, company):
+    # manager2 gets a report, then moves under manager
+    await patch_user(api, company, "employee", manager_id=company["manager2"]["user"]["id"])
+    for key in ("employee", "manager2"):
+        assert (await api.get("/api/auth/me", headers=company[key]["headers"])).status_code == 200
+
+    await patch_user(api, company, "manager2", manager_id=company["manager"]["user"]["id"])
+
+    for key in ("employee", "manager2"):
+        assert server.principal_cache.get(company[key]["user"]["email"]) is None
+    await api.get("/api/auth/me", headers=company["employee"]["headers"])
+    cached = server.principal_cache.get(company["employee"]["user"]["email"])
+    assert cached.ancestor_ids == [company["manager"]["user"]["id"], company["manager2"]["user"]["id"]]
+
+
+async def test_password_hasher_caps_concurrent_hashes():
+    hasher = server.PasswordHasher(executor_kind="thread", workers=4, max_concurrency=2, rounds=4)
+    try:
+        hashes = await asyncio.gather(*(hasher.hash(f"secret-{index}") for index in range(6)))
+
+        assert hasher.max_queue_depth >= 4
+        assert (hasher.in_flight, hasher.queued, hasher.completed) == (0, 0, 6)
+        assert await hasher.verify("secret-3", hashes[3])
+        assert not await hasher.verify("secret-3", hashes[4])
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,35 @@
+"""rollups-verify: count/amount drift and stale owner chains on expense_rollups."""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+EXPENSE = {"amount": 20.0, "currency": "USD", "category": "meals", "description": "Lunch", "date": "2026-03-02T12:00:00Z"}
+
+
+async def test_verify_is_clean_after_normal_writes(api, company):
+    await api.post("/api/expenses", headers=company["employee"]["headers"], json=EXPENSE)
+
+    report = await server.verify_expense_rollups()
+
+    assert (report["drifted"], report["stale_chains"]) == (0, 0)
+
+
+async def test_verify_reports_a_wiped_owner_chain(api, company):
+    await api.post("/api/expenses", headers=company["employee"]["headers"], json=EXPENSE)
+    employee_id = company["employee"]["user"]["id"]
+    await server.db.expense_rollups.update_many({"employee_id": employee_id},
+                                                {"$set": {"manager_id": None, "ancestor_ids": []}})
+
+    report = await server.verify_expense_rollups()
+
+    assert report["drifted"] == 0
+    assert report["stale_chains"] == 1
+    drift = report["chain_drift"][0]
+    assert drift["employee_id"] == employee_id
+    assert drift["actual"] == {"manager_id": None, "ancestor_ids": []}
+    assert drift["expected"]["manager_id"] == company["manager"]["user"]["id"]
+
+    await server.backfill_expense_ownership()
+    assert (await server.verify_expense_rollups())["stale_chains"] == 0
@@ -0,0 +1,72 @@
+"""Expense search must only match expenses the caller can see."""
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+search_pipeline = server.expense_search_pipeline
+
+
+def regex_search_pipeline(match: dict, skip: int, limit: int):
+    """
+    expense_search_pipeline for mongomock, which has no $text: the words are
+    matched by regex and results ranked by date. The rest of the match, which
+    carries visibility, is left exactly as search_expenses built it.
+    """
+    match = dict(match)
+    words = match.pop("$text")["$search"].split()
+    match = {"$and": [match, {"$or": [
+        {field: {"$regex": word, "$options": "i"}}
+        for word in words for field in ("merchant", "description", "category")
+    ]}]}
+    pipeline = search_pipeline(match, skip, limit)
+    results = pipeline[1]["$facet"]["results"]
+    results[0] = {"$sort": {"date": -1, "id": -1}}
+    results[-1] = {"$project": server.EXPENSE_LIST_PROJECTION}
+    return pipeline
+
+
+@pytest.fixture
+async def taxis(api, company, monkeypatch):
+    monkeypatch.setattr(server, "expense_search_pipeline", regex_search_pipeline)
+    response = await api.post("/api/auth/register", json={
+        "email": "rival@example.org", "password": "correct-horse", "full_name": "Rival", "company_name": "Rival Co"
+    })
+    rival = {"headers": {"Authorization": f"Bearer {response.json()['access_token']}"}}
+    ids = {}
+    for key, member in (("employee", company["employee"]), ("manager2", company["manager2"]), ("rival", rival)):
+        response = await api.post("/api/expenses", headers=member["headers"], json={
+            "amount": 25.0, "currency": "USD", "category": "travel",
+            "description": f"Taxi for {key}", "date": "2026-03-02T09:00:00Z"
+        })
+        assert response.status_code == 200, response.text
+        ids[key] = response.json()["id"]
+    return ids
+
+
+async def search(api, member, q="taxi"):
+    response = await api.get("/api/expenses/search", params={"q": q}, headers=member["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_employee_search_matches_only_their_own_expenses(api, company, taxis):
+    result = await search(api, company["employee"])
+
+    assert [expense["id"] for expense in result["results"]] == [taxis["employee"]]
+    assert result["total"] == 1
+    assert result["facets"]["category"] == [{"value": "travel", "count": 1}]
+
+
+async def test_manager_search_is_limited_to_their_team(api, company, taxis):
+    result = await search(api, company["manager"])
+
+    assert [expense["id"] for expense in result["results"]] == [taxis["employee"]]
+
+
+async def test_admin_search_stays_inside_the_company(api, company, taxis):
+    result = await search(api, company["admin"])
+
+    assert sorted(expense["id"] for expense in result["results"]) == sorted([taxis["employee"], taxis["manager2"]])
+    assert result["total"] == 2